@@ -1,27 +1,46 @@
 import os
 import json
+import time
 import tempfile
 import traceback
 from pathlib import Path
-import requests
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, session, send_file, g
+from flask.sessions import SecureCookieSessionInterface
 from werkzeug.utils import secure_filename
 import hashlib
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 
-from utils.document_processor import enhanced_chunk_docx
-from utils.search_engine import enhanced_search
-from utils.llm_client import SimpleLLMClient
+from utils.search_engine import SearchIndex, enhanced_search_many, build_index, is_analytical_query
+from utils.trigram_index import build_trigram_index
+from utils.facet_index import FILTER_FIELDS, build_facet_index, parse_filters, bitmap_from_positions
+from utils.llm_client import SimpleLLMClient, LLMStreamError, is_error_response
 from utils.github_client import GitHubClient
+from utils.corpus_store import CorpusStore
+from utils.corpus_format import open_corpus, MappedChunks, StaleCorpusError
+from utils.answer_cache import AnswerCache
+from utils.retrieval_cache import RetrievalCache
+from utils.image_store import get_default_image_store
+from utils.metrics import Metrics, StageTimer, cache_samples
+from utils.context_builder import pack_context, token_budget
+# utils.document_processor (python-docx, lxml) and utils.vector_index (numpy)
+# are imported by the routes that use them, so a cold start that only serves
+# keyword chat never loads them
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 
 # Configuration
 ALLOWED_EXTENSIONS = {'docx'}
+SEARCH_MODES = ('keyword', 'vector', 'hybrid')
+# Share of body elements an upload must have in common with the session's
+# document to be re-ingested as a new revision of it
+REVISION_MIN_REUSE = 0.5
 
 # Use /tmp directory for Vercel serverless functions
 UPLOAD_FOLDER = '/tmp/uploads'
 TEMP_FOLDER = '/tmp/temp'
+CORPUS_FOLDER = os.environ.get('CORPUS_STORE_DIR', '/tmp/corpus_store')
 
 # Create directories in /tmp (writable in Vercel)
 try:
@@ -33,12 +52,276 @@ except OSError:
     TEMP_FOLDER = tempfile.gettempdir()
 
 # Initialize clients
-llm_client = SimpleLLMClient()
-github_client = GitHubClient()
+# The LLM client keeps pooled keep-alive connections, so it is configured once
+# per process rather than per request.
+llm_client = SimpleLLMClient(
+    pool_size=int(os.environ.get('LLM_POOL_SIZE', 10)),
+    connect_timeout=float(os.environ.get('LLM_CONNECT_TIMEOUT', 5)),
+    read_timeout=float(os.environ.get('LLM_READ_TIMEOUT', 30)),
+    write_timeout=float(os.environ.get('LLM_WRITE_TIMEOUT', 10)),
+    pool_timeout=float(os.environ.get('LLM_POOL_TIMEOUT', 5)),
+    hedge=os.environ.get('LLM_HEDGE', '').lower() in ('1', 'true', 'yes'),
+    hedge_after=float(os.environ.get('LLM_HEDGE_AFTER', 4))
+)
+llm_client.setup_keys(os.environ.get('OPENAI_API_KEY', ''), os.environ.get('GEMINI_API_KEY', ''))
+# Parsed GitHub chunk files are cached with their ETag and revalidated with
+# If-None-Match (GITHUB_API_URL, GITHUB_CACHE_DIR, GITHUB_CACHE_MAX_BYTES)
+github_client = GitHubClient(
+    base_url=os.environ.get('GITHUB_API_URL', 'https://api.github.com'),
+    cache_dir=os.environ.get('GITHUB_CACHE_DIR', '/tmp/github_cache') or None,
+    max_disk_bytes=int(os.environ.get('GITHUB_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+)
+
+# Chunks are kept server-side; the session cookie only carries the corpus id.
+# Set CORPUS_STORE_DIR to an empty string to keep corpora in memory only.
+corpus_store = CorpusStore(
+    max_entries=int(os.environ.get('CORPUS_STORE_SIZE', 8)),
+    disk_dir=CORPUS_FOLDER or None,
+    max_disk_bytes=int(os.environ.get('CORPUS_STORE_MAX_BYTES', 512 * 1024 * 1024))
+)
+
+# Extracted images, deduplicated by content hash (IMAGE_STORE_DIR, IMAGE_STORE_MAX_BYTES)
+image_store = get_default_image_store()
+IMAGE_MAX_AGE = 31536000
+THUMBNAIL_WIDTH = 320
+
+# Answers are cached per corpus, model, context and temperature.
+# Set ANSWER_CACHE_DIR to an empty string to disable the on-disk tier.
+answer_cache = AnswerCache(
+    max_entries=int(os.environ.get('ANSWER_CACHE_SIZE', 512)),
+    max_bytes=int(os.environ.get('ANSWER_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+    ttl=float(os.environ.get('ANSWER_CACHE_TTL', 3600)),
+    disk_dir=os.environ.get('ANSWER_CACHE_DIR', '/tmp/answer_cache') or None,
+    max_disk_bytes=int(os.environ.get('ANSWER_CACHE_MAX_DISK_BYTES', 64 * 1024 * 1024))
+)
+
+# Search results are cached per corpus, search mode, top_k, filters and
+# normalized query, so rephrasings like "NJ batch sub?" / "batch sub nj" share
+# an entry; RETRIEVAL_CACHE_SIZE=0 disables it
+retrieval_cache = RetrievalCache(max_entries=int(os.environ.get('RETRIEVAL_CACHE_SIZE', 1024)))
+
+# Retrieved text sent to the model is capped per model (see
+# utils/context_builder.py); CONTEXT_TOKEN_BUDGET overrides the cap for all models
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 0)) or None
+
+# /api/chat/batch takes up to BATCH_MAX_QUERIES questions and keeps up to
+# BATCH_WORKERS model calls in flight; more workers than pooled LLM
+# connections would only wait for a connection
+BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', 50))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', min(llm_client.pool_size, 8)))
+
+# Per-stage timings of these endpoints go to the Server-Timing header and
+# /api/metrics; METRICS_WINDOW is the span of the rolling quantiles in seconds
+TIMED_ENDPOINTS = ('chat', 'chat_stream', 'chat_batch', 'upload_file', 'get_chunks')
+metrics = Metrics(window=float(os.environ.get('METRICS_WINDOW', 300)))
+metrics.describe('stage_duration_seconds', 'Duration of one request stage')
+metrics.describe('request_duration_seconds', 'Request duration until the response (or its stream) starts')
+metrics.describe('requests_total', 'Requests by endpoint and status')
+metrics.describe('cache_hits_total', 'Lookups served by a cache')
+metrics.describe('cache_misses_total', 'Lookups a cache could not serve')
+metrics.describe('cache_hit_ratio', 'Hits over lookups since start')
+metrics.describe('context_tokens_total', 'Estimated tokens of context sent to the model')
+metrics.describe('context_units_deduplicated_total', 'Sentences and lines left out of contexts as repeats')
+
+def collect_cache_metrics():
+    answer_stats = answer_cache.get_stats()
+    retrieval_stats = retrieval_cache.get_stats()
+    corpus_stats = corpus_store.get_stats()
+    github_stats = github_client.get_stats()
+    return (cache_samples('answer', answer_stats['hits'], answer_stats['misses'])
+            + cache_samples('retrieval', retrieval_stats['hits'], retrieval_stats['misses'])
+            + cache_samples('corpus', corpus_stats['hits'], corpus_stats['disk_hits'] + corpus_stats['misses'])
+            + cache_samples('github', github_stats['not_modified'], github_stats['downloads']))
+
+metrics.add_collector(collect_cache_metrics)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def activate_corpus(chunks, search_index=None, vector_index=None):
+    """Store chunks server-side and point the session at them"""
+    corpus = corpus_store.put(chunks)
+    # Build the search index once per corpus, at ingestion time
+    if search_index is not None:
+        corpus.set_derived('search_index', search_index)
+    corpus.derived('search_index', build_index)
+    if vector_index is not None:
+        store_vector_index(corpus, vector_index)
+    elif not corpus.is_prebuilt('vector_index'):
+        get_vector_index(corpus)
+    session.pop('chunks', None)
+    session.pop('source_file', None)
+    session['corpus_id'] = corpus.corpus_id
+    session['processing_complete'] = True
+    session['vector_db_ready'] = True
+    return corpus
+
+def get_vector_index(corpus):
+    """Return the corpus embeddings, loading them from disk or computing them once"""
+    def load_or_build(chunks):
+        from utils.vector_index import VectorIndex
+        path = corpus.artifact_path('vectors.npz')
+        if path and os.path.exists(path):
+            try:
+                return VectorIndex.load(path)
+            except (OSError, ValueError) as e:
+                print(f"Error loading vector index: {e}")
+        vector_index = VectorIndex.build(chunks)
+        save_artifact(corpus, 'vectors.npz', vector_index)
+        return vector_index
+
+    return corpus.derived('vector_index', load_or_build)
+
+def store_vector_index(corpus, vector_index):
+    corpus.set_derived('vector_index', vector_index)
+    save_artifact(corpus, 'vectors.npz', vector_index)
+
+def save_artifact(corpus, name, value):
+    """Save a derived structure next to the corpus on disk, if there is a disk tier"""
+    path = corpus.artifact_path(name)
+    if path:
+        try:
+            value.save(path)
+        except OSError as e:
+            print(f"Error saving {name}: {e}")
+            return
+        corpus_store.evict_disk(keep=corpus.corpus_id)
+
+def get_block_cache(corpus):
+    """Parsed blocks of the document a corpus was ingested from, or None"""
+    def load(chunks):
+        from utils.document_processor import BlockCache
+        path = corpus.artifact_path('blocks.json')
+        if path and os.path.exists(path):
+            try:
+                return BlockCache.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error loading block cache: {e}")
+        return None
+
+    return corpus.derived('block_cache', load)
+
+def store_block_cache(corpus, block_cache):
+    block_cache.previous = None
+    corpus.set_derived('block_cache', block_cache)
+    save_artifact(corpus, 'blocks.json', block_cache)
+
+def activate_revision(previous, chunks, changes):
+    """Store a re-ingested document, updating the previous corpus' indexes.
+
+    Only removed, modified and added chunks are re-indexed, and cached
+    answers whose chunks are unchanged carry over to the new corpus.
+    """
+    search_index = previous.derived('search_index', build_index).copy()
+    search_index.apply_changes(chunks, changes)
+    vector_index = get_vector_index(previous).apply_changes(previous.chunks, chunks, changes)
+    
+    corpus = activate_corpus(chunks, search_index, vector_index)
+    if corpus.corpus_id != previous.corpus_id:
+        answer_cache.apply_changes(previous.corpus_id, corpus.corpus_id, changes)
+    return corpus
+
+def run_search(corpus, query, search_mode='keyword', top_k=5, candidates=None, filters=None):
+    """Retrieve chunks with keyword (BM25), vector or hybrid search.
+
+    candidates optionally restricts retrieval to these chunk positions;
+    filters are the parsed facet filters they were selected with.
+    """
+    return run_search_many(corpus, [query], search_mode, top_k, candidates, filters)[0]
+
+def run_search_many(corpus, queries, search_mode='keyword', top_k=5, candidates=None, filters=None):
+    """run_search for a list of queries in one retrieval pass; one result list per query.
+
+    Results come from the retrieval cache where it has them; only the
+    other queries are searched.  Candidates given without the filters
+    they came from cannot be keyed, so those searches bypass the cache.
+    """
+    if candidates is not None and not filters:
+        return search_corpus(corpus, queries, search_mode, top_k, candidates)
+    
+    keys = [retrieval_cache.make_key(corpus.corpus_id, query, search_mode, top_k, filters) for query in queries]
+    results = [retrieval_cache.get(key) for key in keys]
+    # Queries that normalize alike are searched once
+    missing = {}
+    for position, key in enumerate(keys):
+        if results[position] is None:
+            missing.setdefault(key, position)
+    if missing:
+        found = search_corpus(corpus, [queries[position] for position in missing.values()],
+                              search_mode, top_k, candidates)
+        found = dict(zip(missing, found))
+        for key, search_results in found.items():
+            retrieval_cache.put(key, search_results)
+        for position, key in enumerate(keys):
+            if results[position] is None:
+                results[position] = list(found[key])
+    return results
+
+def search_corpus(corpus, queries, search_mode, top_k, candidates):
+    """Search a corpus for a list of queries, bypassing the retrieval cache"""
+    if search_mode in ('vector', 'hybrid'):
+        from utils.vector_index import vector_search_many, hybrid_search_many
+    if search_mode == 'vector':
+        return vector_search_many(corpus.chunks, queries, top_k, vector_index=get_vector_index(corpus),
+                                  candidates=candidates)
+    
+    index = corpus.derived('search_index', build_index)
+    if search_mode == 'hybrid':
+        return hybrid_search_many(corpus.chunks, queries, top_k, index=index,
+                                  vector_index=get_vector_index(corpus), candidates=candidates)
+    return enhanced_search_many(corpus.chunks, queries, top_k=top_k, index=index, candidates=candidates)
+
+def apply_facet_filters(corpus, filters, positions=None):
+    """Narrow a corpus (or the given chunk positions) with parsed facet filters.
+
+    Returns (positions, facet counts), where positions is None when
+    nothing was filtered.
+    """
+    facet_index = corpus.derived('facet_index', build_facet_index)
+    bitmap = facet_index.select(filters)
+    if positions is not None:
+        bitmap &= bitmap_from_positions(positions, len(facet_index))
+    counts = facet_index.counts(bitmap)
+    if not filters and positions is None:
+        return None, counts
+    return facet_index.positions(bitmap), counts
+
+def get_session_corpus():
+    """Return the Corpus for the current session, or None"""
+    with stage('corpus'):
+        if not session.get('processing_complete'):
+            return None
+        return corpus_store.get(session.get('corpus_id'))
+
+def stage(name):
+    """Time a stage of the current request; a no-op outside TIMED_ENDPOINTS"""
+    timer = g.get('timer')
+    return timer.stage(name) if timer is not None else nullcontext()
+
+class TimedSessionInterface(SecureCookieSessionInterface):
+    """Cookie sessions that time their decoding, which Flask does before any handler runs"""
+    
+    def open_session(self, app, request):
+        start = time.perf_counter()
+        session = super().open_session(app, request)
+        request.environ['sop.session_seconds'] = time.perf_counter() - start
+        return session
+
+app.session_interface = TimedSessionInterface()
+
+@app.before_request
+def start_timer():
+    if request.endpoint in TIMED_ENDPOINTS:
+        g.timer = StageTimer(metrics, request.endpoint)
+        g.timer.record('session', request.environ.get('sop.session_seconds', 0.0))
+
+@app.after_request
+def add_server_timing(response):
+    timer = g.pop('timer', None)
+    if timer is not None:
+        response.headers['Server-Timing'] = timer.finish(response.status_code)
+    return response
+
 @app.route('/')
 def index():
     """Main dashboard"""
@@ -61,31 +344,55 @@ def upload_file():
         # Save uploaded file
         filename = secure_filename(file.filename)
         filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
+        with stage('save'):
+            file.save(filepath)
         
         # Get chunk size from request
         chunk_size = int(request.form.get('chunk_size', 800))
         
         # Process document
+        from utils.document_processor import iter_chunks_docx, BlockCache, diff_chunks
         with open(filepath, 'rb') as f:
             file_content = f.read()
         
-        chunks = enhanced_chunk_docx(file_content, chunk_size)
+        # A re-upload of the session's document only parses the elements
+        # that changed since the previous revision
+        previous = get_session_corpus()
+        previous_blocks = get_block_cache(previous) if previous else None
+        block_cache = previous_blocks.revision() if previous_blocks else BlockCache()
+        same_file = previous is not None and session.get('source_file') == filename
+        
+        # Index chunks as the chunker yields them; a failure part-way through
+        # discards the partial document
+        chunks = []
+        search_index = SearchIndex() if previous_blocks is None and not same_file else None
+        try:
+            with stage('chunk'):
+                for chunk in iter_chunks_docx(file_content, chunk_size, image_store=image_store,
+                                              block_cache=block_cache):
+                    if search_index is not None:
+                        search_index.add(chunk)
+                    chunks.append(chunk)
+        except Exception as e:
+            print(f"Error processing document: {e}")
+            print(traceback.format_exc())
+            chunks = []
         
         if chunks:
-            # Store chunks in session
-            session['chunks'] = chunks
-            session['processing_complete'] = True
-            session['vector_db_ready'] = True
-            
-            # Store temp image directory path if images were extracted
-            for chunk in chunks:
-                if chunk.get('images'):
-                    for img in chunk['images']:
-                        if 'path' in img:
-                            session['temp_image_dir'] = os.path.dirname(img['path'])
-                            break
-                    break
+            # Store chunks server-side, keyed by content hash.  The same file
+            # uploaded again, or mostly known elements, mean a new revision
+            # of the same document: keep chunk ids stable and update the
+            # indexes with the change set.
+            changes = None
+            with stage('index'):
+                reused = previous_blocks is not None and block_cache.hit_rate >= REVISION_MIN_REUSE
+                if same_file or reused:
+                    chunks, changes = diff_chunks(previous.chunks, chunks)
+                    corpus = activate_revision(previous, chunks, changes)
+                else:
+                    corpus = activate_corpus(chunks, search_index)
+                store_block_cache(corpus, block_cache)
+            session['source_file'] = filename
             
             # Clean up uploaded file
             os.remove(filepath)
@@ -100,7 +407,8 @@ def upload_file():
                 'chunks_count': len(chunks),
                 'chunks_with_images': chunks_with_images,
                 'total_images': total_images,
-                'preview': chunks[0]['text'][:200] + '...' if chunks else ''
+                'preview': chunks[0]['text'][:200] + '...' if chunks else '',
+                'changes': {name: len(ids) for name, ids in changes.items()} if changes else None
             })
         else:
             return jsonify({'error': 'Failed to process document'}), 500
@@ -113,15 +421,27 @@ def load_default_chunks():
     """Load default chunks.json file from the app"""
     try:
         chunks_path = os.path.join(os.path.dirname(__file__), 'output', 'chunks.json')
+        corpus_path = os.path.join(os.path.dirname(__file__), 'output', 'chunks.corpus')
         
-        if os.path.exists(chunks_path):
+        # The binary corpus file is mapped instead of parsed.  It ships with
+        # the app, so one that no longer matches chunks.json is a deploy
+        # error, not something to quietly work around
+        chunks = None
+        if os.path.exists(corpus_path):
+            try:
+                chunks = open_corpus(corpus_path, source_path=chunks_path if os.path.exists(chunks_path) else None)
+            except StaleCorpusError as e:
+                print(str(e))
+                return jsonify({'error': str(e)}), 500
+        
+        if chunks is None and os.path.exists(chunks_path):
             with open(chunks_path, 'r', encoding='utf-8') as f:
                 chunks = json.load(f)
+        
+        if chunks is not None:
             
-            if chunks and isinstance(chunks, list):
-                session['chunks'] = chunks
-                session['processing_complete'] = True
-                session['vector_db_ready'] = True
+            if chunks and isinstance(chunks, (list, MappedChunks)):
+                activate_corpus(chunks)
                 
                 return jsonify({
                     'success': True,
@@ -147,6 +467,7 @@ def load_from_github():
         data = request.get_json()
         repo_url = data.get('repo_url')
         file_path = data.get('file_path', 'output/chunks.json')
+        ref = data.get('ref') or None
         
         if not repo_url:
             return jsonify({'error': 'Repository URL required'}), 400
@@ -159,12 +480,10 @@ def load_from_github():
         owner, repo = parts[0], parts[1]
         
         # Fetch chunks from GitHub
-        chunks = github_client.fetch_chunks(owner, repo, file_path, github_token)
+        chunks = github_client.fetch_chunks(owner, repo, file_path, github_token, ref=ref)
         
         if chunks:
-            session['chunks'] = chunks
-            session['processing_complete'] = True
-            session['vector_db_ready'] = True
+            activate_corpus(chunks)
             
             return jsonify({
                 'success': True,
@@ -177,117 +496,391 @@ def load_from_github():
     except Exception as e:
         return jsonify({'error': f'Error loading from GitHub: {str(e)}'}), 500
 
+NO_RESULTS_ANSWER = "I couldn't find relevant information for your query. Please try rephrasing your question."
+
+def build_context(query, search_results, model=None):
+    """Build the LLM context from search results, within the model's token budget"""
+    context, stats = pack_context(query, search_results, token_budget(model, CONTEXT_TOKEN_BUDGET),
+                                  analytical=is_analytical_query(query))
+    metrics.increment('context_tokens_total', stats['tokens'])
+    metrics.increment('context_units_deduplicated_total', stats['deduplicated_units'])
+    return context
+
+def format_search_results(search_results):
+    """JSON-friendly summary of search results"""
+    return [{
+        'score': result['score'],
+        'search_types': result.get('search_types', []),
+        'preview': result['chunk']['text'][:150] + '...',
+        'metadata': result['chunk'].get('metadata', {})
+    } for result in search_results]
+
+def prepare_chat(data):
+    """Validate a chat request and run retrieval.
+
+    Returns (error_response, None) on failure, or (None, chat) where chat
+    holds the query, model settings, search results and context.
+    """
+    corpus = get_session_corpus()
+    if corpus is None:
+        return (jsonify({'error': 'Please process a document first'}), 400), None
+    
+    data = data or {}
+    query = data.get('query', '')
+    if not query:
+        return (jsonify({'error': 'Query required'}), 400), None
+    
+    error, options = parse_chat_options(data)
+    if error:
+        return error, None
+    
+    # Facet filters narrow the candidates before anything is scored
+    candidates, facets = filter_candidates(corpus, options['filters'])
+    
+    # Search for relevant chunks
+    with stage('search'):
+        search_results = run_search(corpus, query, options['search_mode'], top_k=5, candidates=candidates,
+                                    filters=options['filters'])
+    
+    with stage('context'):
+        context = build_context(query, search_results, options['model']) if search_results else None
+    
+    return None, make_chat_request(corpus, query, options, search_results, context, facets)
+
+def parse_chat_options(data):
+    """Validate the model, search and filter settings shared by the chat endpoints.
+
+    Returns (error_response, None) on failure, or (None, options) with the
+    model, temperature, search_mode, hedge and parsed filters.
+    """
+    model = data.get('model', 'GPT-4 Mini')
+    temperature = float(data.get('temperature', 0.1))
+    search_mode = data.get('search_mode', 'keyword')
+    # None falls back to the LLM_HEDGE setting
+    hedge = data.get('hedge')
+    
+    if search_mode not in SEARCH_MODES:
+        return (jsonify({'error': f'Invalid search mode. Use one of: {", ".join(SEARCH_MODES)}'}), 400), None
+    
+    try:
+        filters = parse_filters(data.get('filters'))
+    except ValueError as e:
+        return (jsonify({'error': f'Invalid filters: {e}'}), 400), None
+    
+    if not llm_client.openai_key:
+        return (jsonify({'error': 'OpenAI API key not configured'}), 500), None
+    
+    return None, {
+        'model': model,
+        'temperature': temperature,
+        'search_mode': search_mode,
+        'hedge': None if hedge is None else bool(hedge),
+        'filters': filters
+    }
+
+def filter_candidates(corpus, filters):
+    """(candidate positions or None, facet counts or None) for parsed facet filters"""
+    if not filters:
+        return None, None
+    with stage('filters'):
+        candidates, facets = apply_facet_filters(corpus, filters)
+    return (None if candidates is None else set(candidates)), facets
+
+def make_chat_request(corpus, query, options, search_results, context, facets=None):
+    """The prepared chat request generate_answer and stream_answer take"""
+    return {
+        'corpus_id': corpus.corpus_id,
+        'query': query,
+        'model': options['model'],
+        'temperature': options['temperature'],
+        'hedge': options['hedge'],
+        'search_results': search_results,
+        'facets': facets,
+        'context': context
+    }
+
+def context_chunk_ids(chat_request):
+    return [result['chunk_id'] for result in chat_request['search_results']]
+
+def answer_cache_key(chat_request, model):
+    return (chat_request['corpus_id'], model, chat_request['context'], chat_request['temperature'])
+
+def generate_answer(chat_request):
+    """Return (answer, cached, model that answered) for a prepared chat request.
+
+    With hedging the backup model may answer; its answer is cached under
+    the backup model, never under the requested one.
+    """
+    answer = answer_cache.get(*answer_cache_key(chat_request, chat_request['model']))
+    if answer is not None:
+        return answer, True, chat_request['model']
+    
+    answer, answered_by = llm_client.generate_with_model(
+        chat_request['model'], chat_request['context'], chat_request['temperature'],
+        hedge=chat_request['hedge']
+    )
+    if not is_error_response(answer):
+        answer_cache.put(*answer_cache_key(chat_request, answered_by), answer,
+                         chunk_ids=context_chunk_ids(chat_request))
+    return answer, False, answered_by
+
+def stream_answer(chat_request):
+    """Yield answer text deltas, serving and filling the answer cache.
+
+    The model that answered is left in chat_request['answered_by'], and the
+    answer is cached under it.  A failed stream raises LLMStreamError and
+    its partial answer is not cached.
+    """
+    chat_request['answered_by'] = chat_request['model']
+    answer = answer_cache.get(*answer_cache_key(chat_request, chat_request['model']))
+    if answer is not None:
+        yield answer
+        return
+    
+    parts = []
+    stream = llm_client.stream_response(
+        chat_request['model'], chat_request['context'], chat_request['temperature'],
+        hedge=chat_request['hedge']
+    )
+    for text in stream:
+        chat_request['answered_by'] = stream.model
+        parts.append(text)
+        yield text
+    
+    # Only reached when the stream finished without an error
+    answer = ''.join(parts)
+    if answer:
+        answer_cache.put(*answer_cache_key(chat_request, stream.model), answer,
+                         chunk_ids=context_chunk_ids(chat_request))
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Handle chat requests"""
     try:
-        if not session.get('processing_complete'):
-            return jsonify({'error': 'Please process a document first'}), 400
-        
-        data = request.get_json()
-        query = data.get('query', '')
-        model = data.get('model', 'GPT-4 Mini')
-        temperature = float(data.get('temperature', 0.1))
-        
-        if not query:
-            return jsonify({'error': 'Query required'}), 400
-        
-        # Get API keys from environment
-        openai_key = os.environ.get('OPENAI_API_KEY')
-        if not openai_key:
-            return jsonify({'error': 'OpenAI API key not configured'}), 500
-        
-        # Setup LLM client
-        llm_client.setup_keys(openai_key, '')
-        
-        # Search for relevant chunks
-        chunks = session.get('chunks', [])
-        search_results = enhanced_search(chunks, query, top_k=5)
+        error, chat_request = prepare_chat(request.get_json())
+        if error:
+            return error
         
+        search_results = chat_request['search_results']
         if search_results:
-            # Build context
-            query_lower = query.lower()
-            analytical_keywords = [
-                'how many', 'what states', 'which state', 'highest', 'lowest', 'compare', 
-                'all states', 'total', 'maximum', 'minimum', 'list all', 'differences',
-                'across states', 'between states', 'summary', 'overview'
-            ]
-            
-            is_analytical = any(keyword in query_lower for keyword in analytical_keywords)
-            
-            if is_analytical:
-                context_parts = [f"USER QUESTION: {query}\n\nCOMPREHENSIVE DATA FOR ANALYSIS:"]
-                
-                state_data = {}
-                all_topics = set()
-                
-                for i, result in enumerate(search_results):
-                    chunk = result['chunk']
-                    metadata = chunk.get('metadata', {})
-                    states = metadata.get('states', [])
-                    topics = metadata.get('topics', [])
-                    
-                    context_parts.append(f"\n--- Section {i+1} (Score: {result['score']:.2f}) ---")
-                    
-                    if states:
-                        context_parts.append(f"STATES: {', '.join(states)}")
-                    if topics:
-                        context_parts.append(f"TOPICS: {', '.join(topics)}")
-                        all_topics.update(topics)
-                    
-                    for state in states:
-                        if state not in state_data:
-                            state_data[state] = []
-                        state_data[state].append({
-                            'text': chunk['text'],
-                            'topics': topics,
-                            'score': result['score']
-                        })
-                    
-                    context_parts.append(f"CONTENT: {chunk['text']}")
-                
-                context_parts.append(f"\n--- SUMMARY FOR ANALYSIS ---")
-                context_parts.append(f"TOTAL SECTIONS FOUND: {len(search_results)}")
-                context_parts.append(f"STATES MENTIONED: {', '.join(sorted(state_data.keys()))}")
-                context_parts.append(f"TOPICS COVERED: {', '.join(sorted(all_topics))}")
-                context_parts.append(f"\nINSTRUCTION: Please analyze ALL the provided sections to answer the user's question.")
-                
-            else:
-                context_parts = [f"USER QUESTION: {query}\n\nRELEVANT DOCUMENTATION:"]
-                
-                for i, result in enumerate(search_results):
-                    context_parts.append(f"\n--- Section {i+1} (Score: {result['score']:.2f}) ---")
-                    context_parts.append(result['chunk']['text'])
-            
-            context = '\n'.join(context_parts)
-            
-            # Generate response
-            answer = llm_client.generate_response(model, context, temperature)
+            # Generate response, reusing a cached answer for the same context
+            with stage('llm'):
+                answer, cached, answered_by = generate_answer(chat_request)
             
             # Get relevant images
-            relevant_images = get_relevant_images(search_results, query)
+            with stage('images'):
+                relevant_images = get_relevant_images(search_results, chat_request['query'])
             
             return jsonify({
                 'success': True,
                 'answer': answer,
-                'search_results': [{
-                    'score': result['score'],
-                    'preview': result['chunk']['text'][:150] + '...',
-                    'metadata': result['chunk'].get('metadata', {})
-                } for result in search_results],
-                'images': relevant_images
+                'cached': cached,
+                'model': answered_by,
+                'search_results': format_search_results(search_results),
+                'images': relevant_images,
+                'facets': chat_request['facets']
             })
         else:
             return jsonify({
                 'success': True,
-                'answer': "I couldn't find relevant information for your query. Please try rephrasing your question.",
+                'answer': NO_RESULTS_ANSWER,
                 'search_results': [],
-                'images': []
+                'images': [],
+                'facets': chat_request['facets']
             })
             
     except Exception as e:
         return jsonify({'error': f'Error processing chat: {str(e)}'}), 500
 
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Streaming chat over Server-Sent Events.
+
+    Sends a `results` event with the search results and images first, then
+    `delta` events as the model produces text, and a final `done` event
+    naming the model that answered.
+    """
+    try:
+        error, chat_request = prepare_chat(request.get_json())
+        if error:
+            return error
+    except Exception as e:
+        return jsonify({'error': f'Error processing chat: {str(e)}'}), 500
+    
+    search_results = chat_request['search_results']
+    # The body is generated after the request context is gone; its stages
+    # reach the metrics, but not the already sent Server-Timing header
+    timer = g.timer
+    
+    def generate():
+        try:
+            with timer.stage('images'):
+                images = get_relevant_images(search_results, chat_request['query']) if search_results else []
+            yield sse_event('results', {
+                'search_results': format_search_results(search_results),
+                'images': images,
+                'facets': chat_request['facets']
+            })
+            
+            if not search_results:
+                yield sse_event('delta', {'text': NO_RESULTS_ANSWER})
+                yield sse_event('done', {'success': True})
+            else:
+                with timer.stage('llm'):
+                    for text in stream_answer(chat_request):
+                        yield sse_event('delta', {'text': text})
+                yield sse_event('done', {'success': True, 'model': chat_request['answered_by']})
+        except LLMStreamError as e:
+            yield sse_event('error', {'error': str(e)})
+        except Exception as e:
+            yield sse_event('error', {'error': f'Error processing chat: {str(e)}'})
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def answer_batch(corpus, queries, model='GPT-4 Mini', temperature=0.1, search_mode='keyword', hedge=None,
+                 candidates=None, filters=None, workers=None, timer=None):
+    """Answer a list of questions over one corpus, yielding one item per question in order.
+
+    Retrieval runs once for the whole batch, contexts and images are built
+    up front, and the model calls go to a pool of workers (BATCH_WORKERS),
+    so several answers are generated at once while items still come out in
+    question order.  An item holds the index, query, answer, cached flag,
+    model that answered, search results, images and timings in
+    milliseconds, or an error.  The
+    last item is {'done': True, 'count', 'timings'} for the whole batch.
+    candidates and filters are as for run_search_many.
+    """
+    start = time.perf_counter()
+    options = {'model': model, 'temperature': temperature, 'search_mode': search_mode, 'hedge': hedge}
+    
+    def timed(name):
+        return timer.stage(name) if timer is not None else nullcontext()
+    
+    def call_llm(chat_request):
+        llm_start = time.perf_counter()
+        answer, cached, answered_by = generate_answer(chat_request)
+        return answer, cached, answered_by, time.perf_counter() - llm_start
+    
+    with timed('search'):
+        all_results = run_search_many(corpus, queries, search_mode, top_k=5, candidates=candidates,
+                                      filters=filters)
+    retrieval_seconds = time.perf_counter() - start
+    
+    executor = ThreadPoolExecutor(max_workers=workers or BATCH_WORKERS, thread_name_prefix='chat-batch')
+    try:
+        # Repeated questions with the same context share one model call
+        pending, submitted = [], {}
+        for index, (query, search_results) in enumerate(zip(queries, all_results)):
+            item = {'index': index, 'query': query}
+            future = None
+            try:
+                step = time.perf_counter()
+                context = build_context(query, search_results, model) if search_results else None
+                context_seconds = time.perf_counter() - step
+                
+                step = time.perf_counter()
+                images = get_relevant_images(search_results, query) if search_results else []
+                images_seconds = time.perf_counter() - step
+                
+                if search_results:
+                    future = submitted.get(context)
+                    if future is None:
+                        future = submitted[context] = executor.submit(
+                            call_llm, make_chat_request(corpus, query, options, search_results, context))
+                item.update({
+                    'search_results': format_search_results(search_results),
+                    'images': images,
+                    'timings': {'context_ms': round(context_seconds * 1000, 2),
+                                'images_ms': round(images_seconds * 1000, 2)}
+                })
+                if timer is not None:
+                    timer.record('context', context_seconds)
+                    timer.record('images', images_seconds)
+            except Exception as e:
+                item = {'index': index, 'query': query, 'error': f'Error processing chat: {str(e)}'}
+            pending.append((item, future))
+        
+        for item, future in pending:
+            if 'error' not in item:
+                try:
+                    answer, cached, answered_by, llm_seconds = (
+                        future.result() if future else (NO_RESULTS_ANSWER, False, None, 0.0))
+                    if future and timer is not None:
+                        timer.record('llm', llm_seconds)
+                    item = dict(item, answer=answer, cached=cached)
+                    if answered_by:
+                        item['model'] = answered_by
+                    item['timings'] = dict(item['timings'], llm_ms=round(llm_seconds * 1000, 2))
+                except Exception as e:
+                    item = {'index': item['index'], 'query': item['query'],
+                            'error': f'Error processing chat: {str(e)}'}
+            item['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            yield item
+    finally:
+        # A client that stops reading must not leave model calls queued
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    yield {
+        'done': True,
+        'count': len(queries),
+        'timings': {'retrieval_ms': round(retrieval_seconds * 1000, 2),
+                    'total_ms': round((time.perf_counter() - start) * 1000, 2)}
+    }
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answer many questions in one request, streamed as NDJSON.
+
+    Takes the /api/chat settings with `queries`, a list of questions, in
+    place of `query`.  Each response line is one answer_batch item, in
+    question order, as soon as its answer is ready; the last line is the
+    {"done": true} summary.
+    """
+    try:
+        corpus = get_session_corpus()
+        if corpus is None:
+            return jsonify({'error': 'Please process a document first'}), 400
+        
+        data = request.get_json() or {}
+        queries = data.get('queries')
+        if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+            return jsonify({'error': 'Queries required: a list of non-empty questions'}), 400
+        
+        if len(queries) > BATCH_MAX_QUERIES:
+            return jsonify({'error': f'Too many queries. At most {BATCH_MAX_QUERIES} per batch'}), 400
+        
+        error, options = parse_chat_options(data)
+        if error:
+            return error
+        
+        candidates, _ = filter_candidates(corpus, options['filters'])
+    except Exception as e:
+        return jsonify({'error': f'Error processing batch: {str(e)}'}), 500
+    
+    # As in chat_stream, stages timed while streaming only reach the metrics
+    timer = g.timer
+    
+    def generate():
+        try:
+            for item in answer_batch(corpus, queries, options['model'], options['temperature'],
+                                     options['search_mode'], options['hedge'], candidates=candidates,
+                                     filters=options['filters'], timer=timer):
+                yield json.dumps(item) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': f'Error processing batch: {str(e)}'}) + '\n'
+    
+    return Response(generate(), mimetype='application/x-ndjson', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 def get_relevant_images(search_results, query):
     """Extract relevant images from search results"""
     relevant_images = []
@@ -349,37 +942,70 @@ def get_relevant_images(search_results, query):
                 if relevance_score >= min_threshold:
                     relevant_images.append({
                         'filename': img['filename'],
+                        'url': f"/images/{img['filename']}",
+                        'thumbnail_url': f"/images/{img['filename']}?w={THUMBNAIL_WIDTH}",
                         'label': img['label'],
                         'score': relevance_score,
                         'chunk_score': result['score']
                     })
     
     relevant_images.sort(key=lambda x: x['score'], reverse=True)
-    return relevant_images[:3]
+    
+    # Images are content-addressed, so one picture can come from several
+    # chunks under different labels; keep its best-scoring entry
+    unique_images = []
+    seen = set()
+    for image in relevant_images:
+        if image['filename'] not in seen:
+            seen.add(image['filename'])
+            unique_images.append(image)
+    return unique_images[:3]
 
 @app.route('/api/chunks')
 def get_chunks():
     """Get processed chunks"""
-    if not session.get('processing_complete'):
+    corpus = get_session_corpus()
+    if corpus is None:
         return jsonify({'error': 'No document processed'}), 400
     
-    chunks = session.get('chunks', [])
+    chunks = corpus.chunks
     search_term = request.args.get('search', '')
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 5))
+    fuzzy = request.args.get('fuzzy', '').lower() in ('1', 'true', 'yes')
+    try:
+        filters = parse_filters({field: request.args[field] for field in FILTER_FIELDS if field in request.args})
+    except ValueError as e:
+        return jsonify({'error': f'Invalid filters: {e}'}), 400
     
-    if search_term:
-        chunks = [
-            chunk for chunk in chunks 
-            if search_term.lower() in chunk['text'].lower()
-        ]
-    
-    total = len(chunks)
     start = (page - 1) * per_page
     end = start + per_page
     
+    docs = None
+    if search_term:
+        # Substring search through the trigram index; with no exact match,
+        # fall back to typo-tolerant matching
+        with stage('search'):
+            trigram_index = corpus.derived('trigram_index', build_trigram_index)
+            docs = trigram_index.search(search_term, fuzzy=fuzzy)
+            if not docs and not fuzzy:
+                fuzzy = True
+                docs = trigram_index.search(search_term, fuzzy=True)
+    
+    # Facet counts describe the matching chunks, before paging
+    with stage('filters'):
+        positions, facets = apply_facet_filters(corpus, filters, docs)
+    if positions is None:
+        total = len(chunks)
+        page_chunks = chunks[start:end]
+    else:
+        total = len(positions)
+        page_chunks = [chunks[position] for position in positions[start:end]]
+    
     return jsonify({
-        'chunks': chunks[start:end],
+        'chunks': page_chunks,
+        'facets': facets,
+        'fuzzy': bool(search_term) and fuzzy,
         'total': total,
         'page': page,
         'per_page': per_page,
@@ -389,19 +1015,59 @@ def get_chunks():
 @app.route('/api/status')
 def get_status():
     """Get processing status"""
+    corpus = get_session_corpus()
     return jsonify({
-        'processing_complete': session.get('processing_complete', False),
-        'vector_db_ready': session.get('vector_db_ready', False),
-        'chunks_count': len(session.get('chunks', []))
+        'processing_complete': corpus is not None,
+        'vector_db_ready': corpus is not None and session.get('vector_db_ready', False),
+        'corpus_id': corpus.corpus_id if corpus else None,
+        'chunks_count': len(corpus) if corpus else 0
     })
 
+@app.route('/api/llm/stats')
+def get_llm_stats():
+    """Connection pool, reuse and answer cache statistics for the LLM providers"""
+    stats = llm_client.get_stats()
+    stats['answer_cache'] = answer_cache.get_stats()
+    return jsonify(stats)
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Stage latency histograms, request counters and cache hit rates (Prometheus text format)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/images/<filename>')
 def serve_image(filename):
-    """Serve processed images"""
-    temp_dir = session.get('temp_image_dir')
-    if temp_dir and os.path.exists(os.path.join(temp_dir, filename)):
-        return send_from_directory(temp_dir, filename)
-    return '', 404
+    """Serve processed images, or a thumbnail with ?w=<width>"""
+    width = request.args.get('w', type=int)
+    if width is not None:
+        width = image_store.thumbnail_width(width)
+    
+    # Image URLs are content-addressed, so the validator is known up front
+    # and revalidations never touch the store
+    etag = image_store.etag(filename, width)
+    if etag is None:
+        return '', 404
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return cache_forever(response)
+    
+    if width is None:
+        path = image_store.get_path(filename)
+    else:
+        path = image_store.get_thumbnail_path(filename, width)
+    if not path:
+        return '', 404
+    
+    response = send_file(path, etag=etag, max_age=IMAGE_MAX_AGE, conditional=True)
+    return cache_forever(response)
+
+def cache_forever(response):
+    """Mark a content-addressed response as cacheable for a year"""
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""Cold-start benchmark for the serverless deployment.
+
+Each run starts a fresh interpreter with empty cache directories and times:
+    import    importing app (what every cold serverless instance pays)
+    load      POST /api/load-default-chunks
+    search    the first keyword retrieval, as a chat request runs it
+
+and records which heavy modules were loaded along the way.  The run fails
+if the median total exceeds the budget, if a keyword chat loads the DOCX or
+LLM provider modules, or if output/chunks.corpus is missing or stale.
+
+Usage:
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --runs 10 --budget-ms 600
+    python benchmarks/cold_start.py --profile 20
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Default budget for import + load + first search, in milliseconds
+COLD_START_BUDGET_MS = 500
+
+HEAVY_MODULES = ('openai', 'httpx', 'requests', 'docx', 'lxml', 'numpy', 'PIL')
+# Must not be imported by a cold start that only serves keyword chat
+CHAT_FORBIDDEN_MODULES = ('openai', 'docx', 'lxml')
+
+PROBE = r'''
+import sys, json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+after_import = [m for m in HEAVY if m in sys.modules]
+
+client = app.app.test_client()
+response = client.post('/api/load-default-chunks')
+assert response.status_code == 200, response.get_data(as_text=True)
+loaded = time.perf_counter()
+
+corpus_id = client.get('/api/status').get_json()['corpus_id']
+corpus = app.corpus_store.get(corpus_id)
+results = app.run_search(corpus, 'What are the pricing rules for Ohio RISE orders?')
+searched = time.perf_counter()
+
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'load_ms': (loaded - imported) * 1000,
+    'search_ms': (searched - loaded) * 1000,
+    'total_ms': (searched - start) * 1000,
+    'results': len(results),
+    'corpus_file': type(corpus.chunks).__name__ == 'MappedChunks',
+    'modules_after_import': after_import,
+    'modules_after_search': [m for m in HEAVY if m in sys.modules]
+}))
+'''
+
+
+def cold_env(scratch):
+    """Environment for a cold instance: empty caches under scratch"""
+    env = dict(os.environ)
+    for name in ('CORPUS_STORE_DIR', 'ANSWER_CACHE_DIR', 'GITHUB_CACHE_DIR', 'IMAGE_STORE_DIR'):
+        env[name] = os.path.join(scratch, name.lower())
+    env.pop('OPENAI_API_KEY', None)
+    env.pop('GEMINI_API_KEY', None)
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    return env
+
+
+def run_once():
+    with tempfile.TemporaryDirectory() as scratch:
+        probe = f"HEAVY = {HEAVY_MODULES!r}\n{PROBE}"
+        output = subprocess.run([sys.executable, '-c', probe], cwd=REPO_ROOT, env=cold_env(scratch),
+                                capture_output=True, text=True, check=True).stdout
+    # The app may print while loading; the measurement is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def profile_imports(top):
+    """Print the slowest imports of app by cumulative time (python -X importtime)"""
+    with tempfile.TemporaryDirectory() as scratch:
+        stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=REPO_ROOT,
+                                env=cold_env(scratch), capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|').split('|')]
+        rows.append((int(cumulative_us), int(self_us), name))
+    rows.sort(reverse=True)
+    print(f"{'cumulative ms':>13}  {'self ms':>8}  module")
+    for cumulative_us, self_us, name in rows[:top]:
+        print(f"{cumulative_us / 1000:>13.1f}  {self_us / 1000:>8.1f}  {name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure app cold start against a budget')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=COLD_START_BUDGET_MS,
+                        help=f'Budget for the median total (default {COLD_START_BUDGET_MS})')
+    parser.add_argument('--profile', type=int, metavar='N', default=0,
+                        help='Also print the N slowest imports')
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        profile_imports(args.profile)
+        print()
+
+    runs = [run_once() for _ in range(args.runs)]
+    print(f"{'stage':<8}  {'median ms':>9}  {'max ms':>8}")
+    for stage in ('import', 'load', 'search', 'total'):
+        values = [run[f'{stage}_ms'] for run in runs]
+        print(f"{stage:<8}  {statistics.median(values):>9.1f}  {max(values):>8.1f}")
+    last = runs[-1]
+    print(f"modules after import: {', '.join(last['modules_after_import']) or 'none'}")
+    print(f"modules after search: {', '.join(last['modules_after_search']) or 'none'}")
+
+    failures = []
+    total = statistics.median(run['total_ms'] for run in runs)
+    if total > args.budget_ms:
+        failures.append(f"median cold start {total:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+    loaded = sorted(set(m for run in runs for m in run['modules_after_search'] if m in CHAT_FORBIDDEN_MODULES))
+    if loaded:
+        failures.append(f"keyword chat loaded {', '.join(loaded)}")
+    if not all(run['corpus_file'] for run in runs):
+        failures.append("default corpus was parsed from JSON; rebuild output/chunks.corpus "
+                        "with python -m utils.corpus_format build output/chunks.json")
+    if not all(run['results'] for run in runs):
+        failures.append("first search returned no results")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print(f"OK: median cold start {total:.1f} ms within {args.budget_ms:.0f} ms")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
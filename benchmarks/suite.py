@@ -0,0 +1,224 @@
+"""Benchmark suite for ingestion, search and context building.
+
+Measures, on synthetic data from benchmarks/synthetic.py:
+    ingest    enhanced_chunk_docx time and tracemalloc peak per DOCX size
+    index     build_index time per corpus scale
+    search    enhanced_search latency percentiles per corpus scale
+    batch     enhanced_search_many time per query, all queries in one call
+    images    get_relevant_images latency percentiles
+    context   build_context latency percentiles and context size
+
+Results can be saved as a baseline and later runs compared against it; a
+metric that got slower (or bigger) than the tolerance allows fails the run.
+Baselines are machine specific, so record one on the machine that compares.
+
+Usage:
+    python benchmarks/suite.py --save            # record benchmarks/baseline.json
+    python benchmarks/suite.py                   # compare against it
+    python benchmarks/suite.py --sections 10,100 --scales 1,50 --tolerance 0.2
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import synthetic
+
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, 'benchmarks', 'baseline.json')
+DEFAULT_TOLERANCE = 0.3
+# Differences below these floors are noise, whatever the ratio
+NOISE_FLOOR = {'ms': 0.05, 'mb': 0.5, 'chars': 0}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    rank = min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered)))) - 1
+    return ordered[rank]
+
+
+def timed(function, *args, **kwargs):
+    """(result, milliseconds) of one call"""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def latency_metrics(prefix, latencies):
+    return {
+        f'{prefix}.p50_ms': percentile(latencies, 50),
+        f'{prefix}.p95_ms': percentile(latencies, 95),
+        f'{prefix}.p99_ms': percentile(latencies, 99)
+    }
+
+
+def bench_ingest(sections, runs):
+    """Chunking time (median of runs) and peak traced memory per document size"""
+    from utils.document_processor import enhanced_chunk_docx
+    from utils.image_store import ImageStore
+
+    metrics = {}
+    for count in sections:
+        data = synthetic.make_docx(count, seed=count)
+        times = []
+        with tempfile.TemporaryDirectory() as scratch:
+            for run in range(runs):
+                # A fresh image store each run, so no run finds images already stored
+                store = ImageStore(os.path.join(scratch, str(run)))
+                chunks, ms = timed(enhanced_chunk_docx, data, image_store=store)
+                times.append(ms)
+
+            # Measured separately: tracing slows the code it traces
+            tracemalloc.start()
+            enhanced_chunk_docx(data, image_store=ImageStore(os.path.join(scratch, 'traced')))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        prefix = f'ingest.sections_{count}'
+        metrics[f'{prefix}.median_ms'] = statistics.median(times)
+        metrics[f'{prefix}.peak_mb'] = peak / (1024 * 1024)
+        print(f"  {count} sections ({len(data) / 1024:.0f} KB, {len(chunks)} chunks): "
+              f"{statistics.median(times):.1f} ms, peak {peak / (1024 * 1024):.1f} MB")
+    return metrics
+
+
+def bench_retrieval(scales, query_count, top_k, runs):
+    """Index build, search, image selection and context building per corpus scale"""
+    from app import build_context, get_relevant_images
+    from utils.search_engine import build_index, enhanced_search, enhanced_search_many
+
+    base = synthetic.load_chunks()
+    queries = synthetic.make_queries(query_count)
+    metrics = {}
+    for scale in scales:
+        chunks = synthetic.scale_corpus(base, scale)
+        index_ms = []
+        for _ in range(runs):
+            index, ms = timed(build_index, chunks)
+            index_ms.append(ms)
+        index_ms = statistics.median(index_ms)
+
+        # Warm up once so the first query does not pay one-time costs
+        enhanced_search(chunks, queries[0], top_k=top_k, index=index)
+
+        search_ms, image_ms, context_ms, context_chars = [], [], [], []
+        for query in queries:
+            results, ms = timed(enhanced_search, chunks, query, top_k=top_k, index=index)
+            search_ms.append(ms)
+            _, ms = timed(get_relevant_images, results, query)
+            image_ms.append(ms)
+            if results:
+                context, ms = timed(build_context, query, results)
+                context_ms.append(ms)
+                context_chars.append(len(context))
+
+        _, batch_ms = timed(enhanced_search_many, chunks, queries, top_k=top_k, index=index)
+        batch_ms /= len(queries)
+
+        prefix = f'scale_{scale}'
+        metrics[f'index.{prefix}.median_ms'] = index_ms
+        metrics.update(latency_metrics(f'search.{prefix}', search_ms))
+        metrics[f'batch.{prefix}.per_query_ms'] = batch_ms
+        metrics.update(latency_metrics(f'images.{prefix}', image_ms))
+        metrics.update(latency_metrics(f'context.{prefix}', context_ms))
+        metrics[f'context.{prefix}.mean_chars'] = statistics.mean(context_chars)
+        print(f"  x{scale} ({len(chunks)} chunks): index {index_ms:.0f} ms, "
+              f"search p50 {percentile(search_ms, 50):.2f} ms / p99 {percentile(search_ms, 99):.2f} ms, "
+              f"batch {batch_ms:.2f} ms/query, "
+              f"context p50 {percentile(context_ms, 50):.3f} ms")
+    return metrics
+
+
+def metric_unit(name):
+    return name.rsplit('_', 1)[-1]
+
+
+def compare(baseline, current, tolerance):
+    """Print current against baseline metrics; returns the regressed metric names.
+
+    Every metric is lower-is-better.  A metric regresses when it grew by
+    more than tolerance (a fraction) and by more than its noise floor.
+    """
+    regressions = []
+    print(f"{'metric':<36}  {'baseline':>10}  {'current':>10}  {'change':>8}")
+    for name in sorted(current):
+        if name not in baseline:
+            print(f"{name:<36}  {'-':>10}  {current[name]:>10.3f}  {'new':>8}")
+            continue
+        old, new = baseline[name], current[name]
+        change = (new - old) / old if old else 0.0
+        regressed = change > tolerance and new - old > NOISE_FLOOR.get(metric_unit(name), 0)
+        if regressed:
+            regressions.append(name)
+        flag = '  REGRESSED' if regressed else ''
+        print(f"{name:<36}  {old:>10.3f}  {new:>10.3f}  {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ingestion, search and context building')
+    parser.add_argument('--sections', default='10,50,200',
+                        help='Comma-separated DOCX sizes in state sections (default 10,50,200)')
+    parser.add_argument('--scales', default='1,10,50',
+                        help='Comma-separated multiples of output/chunks.json to search (default 1,10,50)')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=3, help='Runs per ingestion and index build timing')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save', action='store_true', help='Record this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f'Allowed slowdown as a fraction (default {DEFAULT_TOLERANCE})')
+    args = parser.parse_args(argv)
+
+    config = {
+        'sections': [int(value) for value in args.sections.split(',') if value],
+        'scales': [int(value) for value in args.scales.split(',') if value],
+        'queries': args.queries,
+        'runs': args.runs,
+        'top_k': args.top_k
+    }
+
+    print("Ingestion")
+    metrics = bench_ingest(config['sections'], config['runs'])
+    print("Retrieval")
+    metrics.update(bench_retrieval(config['scales'], config['queries'], config['top_k'], config['runs']))
+    print()
+
+    if args.save:
+        record = {
+            'config': config,
+            'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'metrics': metrics
+        }
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; record one with --save")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('config') != config:
+        print(f"WARNING: baseline was recorded with {baseline.get('config')}, this run used {config}")
+    regressions = compare(baseline['metrics'], metrics, args.tolerance)
+    if regressions:
+        print(f"FAIL: {len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+        return 1
+    print(f"OK: no metric regressed by more than {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
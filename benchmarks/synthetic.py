@@ -0,0 +1,186 @@
+"""Synthetic SOP documents, corpora and queries for the benchmarks.
+
+make_docx builds a DOCX shaped like the real SOPs: a header and footer,
+one heading per state and section, paragraphs about the usual topics,
+tables (some with pictures in their cells), numbered and descriptive image
+captions, and inline pictures.  scale_corpus grows a chunk list such as
+output/chunks.json to any size while keeping its term and metadata
+distributions, and make_queries produces a repeatable query mix.
+Everything is seeded, so the same arguments always give the same bytes.
+
+Usage:
+    python benchmarks/synthetic.py docx 50 -o /tmp/sop.docx
+    python benchmarks/synthetic.py corpus 20 -o /tmp/chunks_x20.json
+"""
+import io
+import os
+import sys
+import json
+import zlib
+import struct
+import random
+import argparse
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATES = ['OHIO', 'MARYLAND', 'NEW JERSEY', 'ILLINOIS', 'NEW YORK', 'NEVADA', 'MASSACHUSETTS']
+SECTIONS = ['RISE', 'REGULAR']
+TOPICS = ['PRICING', 'BATTERIES', 'BATCH SUB', 'DELIVERY DATE', 'ORDER LIMIT']
+
+WORDS = [
+    'order', 'orders', 'menu', 'price', 'units', 'invoice', 'delivery', 'store', 'brand',
+    'batch', 'sub', 'limit', 'separate', 'product', 'customer', 'account', 'sheet', 'total',
+    'discount', 'schedule', 'date', 'available', 'partial', 'split', 'note', 'required',
+    'the', 'a', 'per', 'on', 'must', 'be', 'for', 'each', 'with', 'all', 'only', 'if'
+]
+CELL_TEXTS = ['Brand', 'Limit 10 units', 'Batch sub ok', 'Separate invoice', 'Menu price', 'Yes', 'No', '']
+DESCRIPTIONS = ['order form setup', 'invoice example', 'delivery schedule sheet', 'pricing template',
+                'batch sub process', 'menu format']
+
+QUERY_TEMPLATES = [
+    'What are the {topic} rules for {state} {section} orders?',
+    'How does {topic} work in {state}?',
+    '{state} {topic}',
+    'Show me an example of the {topic} sheet',
+    'Can {section} customers get a separate invoice for batteries in {state}?',
+    'What is the order limit for {state}?',
+    'Which states allow batch sub?',
+    'Compare {topic} across states'
+]
+
+
+def make_png(width, height, seed):
+    """A small valid RGB PNG with random pixels, built without PIL"""
+    rng = random.Random(seed)
+    raw = b''.join(b'\x00' + bytes(rng.randrange(256) for _ in range(width * 3)) for _ in range(height))
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b'')
+
+
+def make_docx(sections=10, seed=0, images=True, image_size=32, distinct_images=8):
+    """DOCX bytes of a synthetic SOP with the given number of state sections"""
+    from docx import Document
+    from docx.shared import Inches
+
+    rng = random.Random(seed)
+    pictures = [make_png(image_size, image_size, seed * 1000 + i) for i in range(distinct_images)]
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = 'SOP ORDER PROCESSING GUIDE'
+    doc.sections[0].footer.paragraphs[0].text = 'Internal use only'
+
+    def add_picture(run=None):
+        picture = io.BytesIO(rng.choice(pictures))
+        if run is None:
+            doc.add_picture(picture, width=Inches(1))
+        else:
+            run.add_picture(picture, width=Inches(1))
+
+    image_number = 0
+    for section in range(sections):
+        state = STATES[section % len(STATES)]
+        doc.add_heading(f"{state} {SECTIONS[(section // len(STATES)) % 2]} ORDERS", 1)
+        for _ in range(rng.randint(4, 10)):
+            topic = rng.choice(TOPICS)
+            kind = rng.random()
+            if not images and 0.65 <= kind < 0.85:
+                kind = 0.0  # a paragraph instead of a picture
+            if kind < 0.5:
+                words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 80)))
+                doc.add_paragraph(f"{topic}: {words}.")
+            elif kind < 0.65:
+                table = doc.add_table(rows=rng.randint(2, 4), cols=rng.randint(2, 3))
+                for row in table.rows:
+                    for cell in row.cells:
+                        cell.text = rng.choice(CELL_TEXTS)
+                if images and rng.random() < 0.3:
+                    add_picture(table.rows[0].cells[-1].paragraphs[0].add_run())
+            elif kind < 0.78:
+                image_number += 1
+                if rng.random() < 0.5:
+                    doc.add_paragraph(f"Image {image_number}: {topic.lower()} {rng.choice(DESCRIPTIONS)}")
+                add_picture()
+                if rng.random() < 0.3:
+                    doc.add_paragraph(f"Figure {image_number}. {rng.choice(DESCRIPTIONS).capitalize()}")
+            elif kind < 0.85:
+                image_number += 1
+                paragraph = doc.add_paragraph(f"See the {rng.choice(DESCRIPTIONS)} below ")
+                add_picture(paragraph.add_run())
+            else:
+                doc.add_paragraph('')
+
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def scale_corpus(chunks, factor, seed=0, mutation=0.2):
+    """Chunk list factor times as large as chunks, with unique chunk ids.
+
+    The first copy is the original; in every further copy a fraction of the
+    words is replaced by words drawn from the corpus, so the copies are not
+    identical but keep the vocabulary, chunk lengths and metadata mix.
+    """
+    rng = random.Random(seed)
+    vocabulary = [word for chunk in chunks for word in chunk['text'].split()]
+    scaled = []
+    for copy in range(factor):
+        for chunk in chunks:
+            text = chunk['text']
+            if copy:
+                words = text.split(' ')
+                for i in range(len(words)):
+                    if rng.random() < mutation:
+                        words[i] = rng.choice(vocabulary)
+                text = ' '.join(words)
+            scaled.append(dict(chunk, chunk_id=len(scaled), text=text))
+    return scaled
+
+
+def load_chunks(path=None):
+    with open(path or os.path.join(REPO_ROOT, 'output', 'chunks.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def make_queries(count, seed=0):
+    """A repeatable mix of chat-style queries over states, sections and topics"""
+    rng = random.Random(seed)
+    return [rng.choice(QUERY_TEMPLATES).format(state=rng.choice(STATES).title(), section=rng.choice(SECTIONS),
+                                               topic=rng.choice(TOPICS).lower())
+            for _ in range(count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic SOP documents and corpora')
+    commands = parser.add_subparsers(dest='command', required=True)
+    docx_parser = commands.add_parser('docx', help='Write a synthetic SOP DOCX')
+    docx_parser.add_argument('sections', type=int)
+    docx_parser.add_argument('-o', '--output', required=True)
+    docx_parser.add_argument('--seed', type=int, default=0)
+    docx_parser.add_argument('--no-images', action='store_true')
+    corpus_parser = commands.add_parser('corpus', help='Write a scaled-up copy of a chunk file')
+    corpus_parser.add_argument('factor', type=int)
+    corpus_parser.add_argument('-o', '--output', required=True)
+    corpus_parser.add_argument('--input', help='Chunk file to scale (default output/chunks.json)')
+    corpus_parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == 'docx':
+        data = make_docx(args.sections, seed=args.seed, images=not args.no_images)
+        with open(args.output, 'wb') as f:
+            f.write(data)
+        print(f"Wrote {args.output} ({len(data) / 1024:.0f} KB, {args.sections} sections)")
+    else:
+        chunks = scale_corpus(load_chunks(args.input), args.factor, seed=args.seed)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(chunks, f)
+        print(f"Wrote {args.output} ({len(chunks)} chunks)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from utils.answer_cache import AnswerCache
+
+CORPUS_A = 'a' * 32
+CORPUS_B = 'b' * 32
+
+
+class AnswerCacheDiskTest(unittest.TestCase):
+
+    def setUp(self):
+        self.disk_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.disk_dir, ignore_errors=True)
+
+    def cache(self, max_disk_bytes):
+        return AnswerCache(disk_dir=self.disk_dir, max_disk_bytes=max_disk_bytes)
+
+    def disk_bytes(self):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(self.disk_dir) for name in names)
+
+    def put_aged(self, cache, corpus_id, context, age):
+        """Cache an answer whose disk file looks age seconds old"""
+        cache.put(corpus_id, 'GPT-4', context, 0.1, 'x' * 200)
+        path = cache._disk_path((corpus_id, cache.make_key('GPT-4', context, 0.1)))
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+
+    def test_disk_tier_is_capped(self):
+        cache = self.cache(max_disk_bytes=2000)
+        for i in range(20):
+            self.put_aged(cache, CORPUS_A, f'context {i}', age=100 - i)
+
+        self.assertLessEqual(self.disk_bytes(), 2000)
+        self.assertGreater(cache.get_stats()['disk_evictions'], 0)
+
+        # The newest answers survive on disk, the oldest are gone
+        fresh = self.cache(max_disk_bytes=2000)
+        self.assertIsNotNone(fresh.get(CORPUS_A, 'GPT-4', 'context 19', 0.1))
+        self.assertIsNone(fresh.get(CORPUS_A, 'GPT-4', 'context 0', 0.1))
+
+    def test_recently_read_answers_are_kept(self):
+        cache = self.cache(max_disk_bytes=1000)
+        self.put_aged(cache, CORPUS_A, 'popular', age=100)
+        self.put_aged(cache, CORPUS_A, 'other', age=50)
+
+        # A disk hit marks the answer as recently used
+        self.assertIsNotNone(self.cache(max_disk_bytes=1000).get(CORPUS_A, 'GPT-4', 'popular', 0.1))
+        for i in range(2):
+            cache.put(CORPUS_A, 'GPT-4', f'context {i}', 0.1, 'x' * 200)
+
+        fresh = self.cache(max_disk_bytes=1000)
+        self.assertIsNone(fresh.get(CORPUS_A, 'GPT-4', 'other', 0.1))
+        self.assertIsNotNone(fresh.get(CORPUS_A, 'GPT-4', 'popular', 0.1))
+
+    def test_overwriting_an_answer_is_not_counted_twice(self):
+        cache = self.cache(max_disk_bytes=10_000)
+        for _ in range(5):
+            cache.put(CORPUS_A, 'GPT-4', 'same context', 0.1, 'x' * 200)
+
+        self.assertEqual(cache._disk.total(), self.disk_bytes())
+
+    def test_empty_corpus_directories_are_removed(self):
+        cache = self.cache(max_disk_bytes=1000)
+        self.put_aged(cache, CORPUS_A, 'old', age=100)
+        for i in range(5):
+            cache.put(CORPUS_B, 'GPT-4', f'context {i}', 0.1, 'x' * 200)
+
+        self.assertEqual(os.listdir(self.disk_dir), [CORPUS_B])
+
+
+if __name__ == '__main__':
+    unittest.main()
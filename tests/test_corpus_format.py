@@ -0,0 +1,63 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from utils.corpus_format import (open_corpus, write_corpus, file_sha256, main,
+                                 MappedChunks, StaleCorpusError)
+
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'output')
+
+CHUNKS = [
+    {'chunk_id': 0, 'text': 'Ohio RISE orders follow the price list', 'metadata': {'states': ['OH']}},
+    {'chunk_id': 1, 'text': 'New Jersey batch substitutions need approval', 'metadata': {'states': ['NJ']}},
+]
+
+
+class CorpusFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, 'chunks.json')
+        self.corpus = os.path.join(self.tmp_dir, 'chunks.corpus')
+        self.write_source(CHUNKS)
+        write_corpus(CHUNKS, self.corpus, source_sha256=file_sha256(self.source), vectors=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write_source(self, chunks):
+        with open(self.source, 'w', encoding='utf-8') as f:
+            json.dump(chunks, f)
+
+    def test_current_file_opens(self):
+        chunks = open_corpus(self.corpus, source_path=self.source)
+
+        self.assertIsInstance(chunks, MappedChunks)
+        self.assertEqual([chunk['text'] for chunk in chunks], [chunk['text'] for chunk in CHUNKS])
+        self.assertEqual(main(['check', self.source, '-o', self.corpus]), 0)
+
+    def test_stale_file_raises(self):
+        self.write_source(CHUNKS[:1])
+
+        with self.assertRaises(StaleCorpusError) as raised:
+            open_corpus(self.corpus, source_path=self.source)
+        self.assertIn('python -m utils.corpus_format build', str(raised.exception))
+        self.assertEqual(main(['check', self.source, '-o', self.corpus]), 1)
+
+    def test_missing_file(self):
+        os.remove(self.corpus)
+
+        self.assertIsNone(open_corpus(self.corpus, source_path=self.source))
+        self.assertEqual(main(['check', self.source, '-o', self.corpus]), 1)
+
+    def test_default_corpus_is_current(self):
+        # output/chunks.corpus is committed; it must be rebuilt with chunks.json
+        source = os.path.join(OUTPUT_DIR, 'chunks.json')
+        self.assertEqual(main(['check', source]), 0,
+                         'output/chunks.corpus is stale; run python -m utils.corpus_format build output/chunks.json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from utils.corpus_store import CorpusStore
+
+
+def make_chunks(name, count=20):
+    return [{'chunk_id': i, 'text': f'{name} chunk {i} ' + 'x' * 100} for i in range(count)]
+
+
+class CorpusStoreDiskTest(unittest.TestCase):
+
+    def setUp(self):
+        self.disk_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.disk_dir, ignore_errors=True)
+
+    def age(self, corpus_id, seconds):
+        mtime = time.time() - seconds
+        for name in os.listdir(self.disk_dir):
+            if name.startswith(corpus_id):
+                os.utime(os.path.join(self.disk_dir, name), (mtime, mtime))
+
+    def test_disk_tier_is_capped(self):
+        store = CorpusStore(disk_dir=self.disk_dir, max_disk_bytes=6000)
+        first = store.put(make_chunks('first'))
+        with open(first.artifact_path('vectors.npz'), 'wb') as f:
+            f.write(b'\0' * 1000)
+        self.age(first.corpus_id, 100)
+        second = store.put(make_chunks('second'))
+        self.age(second.corpus_id, 50)
+        third = store.put(make_chunks('third'))
+
+        names = os.listdir(self.disk_dir)
+        # The oldest corpus went together with its artifact
+        self.assertFalse(any(name.startswith(first.corpus_id) for name in names))
+        self.assertIn(f'{third.corpus_id}.json', names)
+        self.assertEqual(store.get_stats()['disk_evictions'], 1)
+
+        fresh = CorpusStore(disk_dir=self.disk_dir)
+        self.assertIsNone(fresh.get(first.corpus_id))
+        self.assertEqual(fresh.get(third.corpus_id).chunks, make_chunks('third'))
+
+    def test_recently_loaded_corpus_is_kept(self):
+        store = CorpusStore(disk_dir=self.disk_dir, max_disk_bytes=6000)
+        first = store.put(make_chunks('first'))
+        self.age(first.corpus_id, 100)
+        second = store.put(make_chunks('second'))
+        self.age(second.corpus_id, 50)
+
+        # Another worker loading the first corpus marks it as recently used
+        self.assertIsNotNone(CorpusStore(disk_dir=self.disk_dir).get(first.corpus_id))
+        store.put(make_chunks('third'))
+
+        names = os.listdir(self.disk_dir)
+        self.assertIn(f'{first.corpus_id}.json', names)
+        self.assertNotIn(f'{second.corpus_id}.json', names)
+
+    def test_corpus_being_written_is_never_evicted(self):
+        store = CorpusStore(disk_dir=self.disk_dir, max_disk_bytes=10)
+        corpus = store.put(make_chunks('only'))
+
+        self.assertEqual(os.listdir(self.disk_dir), [f'{corpus.corpus_id}.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
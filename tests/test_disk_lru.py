@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from utils.disk_lru import DiskLRU, write_file, scan_files
+
+
+class DiskLRUTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def write(self, name, size, age=0):
+        path = self.path(name)
+        delta = write_file(path, b'x' * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return delta
+
+    def test_overwrite_reports_the_size_change(self):
+        self.assertEqual(self.write('a', 100), 100)
+        self.assertEqual(self.write('a', 40), -60)
+        self.assertEqual(write_file(self.path('b'), 'é'), 2)
+        self.assertEqual(sorted(os.listdir(self.root)), ['a', 'b'])
+
+    def test_running_total_tracks_overwrites(self):
+        disk = DiskLRU(lambda: scan_files(self.root), 10_000)
+        self.write('a', 100)
+        self.assertEqual(disk.total(), 100)
+
+        disk.added(self.write('a', 300))
+        disk.added(self.write('b', 50))
+        self.assertEqual(disk.total(), sum(size for _, size, _ in scan_files(self.root)))
+
+    def test_evicts_least_recently_used_first(self):
+        disk = DiskLRU(lambda: scan_files(self.root), 250)
+        self.write('old', 100, age=30)
+        self.write('middle', 100, age=20)
+        self.write('new', 100, age=10)
+
+        self.assertEqual(disk.evict(), 1)
+        self.assertEqual(sorted(os.listdir(self.root)), ['middle', 'new'])
+        self.assertEqual(disk.total(), 200)
+
+    def test_groups_priority_and_keep(self):
+        disk = DiskLRU(lambda: scan_files(self.root), 250,
+                       group=lambda path: os.path.basename(path).split('.')[0],
+                       priority=lambda path: not path.endswith('.thumb'))
+        self.write('a.json', 100, age=30)
+        self.write('a.npz', 100, age=5)
+        self.write('b.json', 100, age=20)
+        self.write('c.thumb', 50, age=1)
+
+        # The thumbnail goes first despite being newest; group b is older
+        # than group a, whose newest file was written recently
+        self.assertEqual(disk.evict(keep='b'), 2)
+        self.assertEqual(sorted(os.listdir(self.root)), ['b.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.github_client import GitHubClient, RAW_MEDIA_TYPE, iter_json_array
+
+CHUNKS_PATH = '/repos/owner/repo/contents/output/chunks.json'
+
+
+class FakeGitHub(ThreadingHTTPServer):
+    """Local stand-in for the GitHub contents API.
+
+    files maps a request path to (body bytes, ETag); a request whose
+    If-None-Match matches the ETag gets a 304.  Every request is recorded.
+    """
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeGitHubHandler)
+        self.files = {}
+        self.requests = []
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        self.server.requests.append({'path': path, 'query': query, 'headers': dict(self.headers)})
+        if path not in self.server.files:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body, etag = self.server.files[path]
+        if etag and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_chunks(count, text='chunk'):
+    return [{'chunk_id': i, 'text': f'{text} {i}'} for i in range(count)]
+
+
+class GitHubClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGitHub()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def serve(self, body, etag='"v1"', path=CHUNKS_PATH):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.server.files[path] = (body, etag)
+
+    def client(self, cache_dir=True, **kwargs):
+        return GitHubClient(base_url=self.server.base_url, timeout=5,
+                            cache_dir=self.cache_dir if cache_dir else None, **kwargs)
+
+    def fetch(self, client, ref=None):
+        return client.fetch_chunks('owner', 'repo', 'output/chunks.json', 'secret', ref=ref)
+
+    def cache_files(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_200_returns_chunks(self):
+        chunks = make_chunks(3)
+        self.serve(chunks)
+        client = self.client()
+
+        self.assertEqual(self.fetch(client, ref='dev'), chunks)
+
+        request = self.server.requests[0]
+        self.assertEqual(request['path'], CHUNKS_PATH)
+        self.assertEqual(request['query'], 'ref=dev')
+        self.assertEqual(request['headers']['Authorization'], 'token secret')
+        self.assertEqual(request['headers']['Accept'], RAW_MEDIA_TYPE)
+        self.assertNotIn('If-None-Match', request['headers'])
+        self.assertEqual(client.get_stats()['downloads'], 1)
+
+    def test_large_file_is_parsed_across_reads(self):
+        # Well past the 64 KB read size, so items span several pieces
+        chunks = make_chunks(2000, text='x' * 100)
+        self.serve(chunks)
+
+        self.assertEqual(self.fetch(self.client()), chunks)
+
+    def test_304_reuses_cached_chunks(self):
+        chunks = make_chunks(3)
+        self.serve(chunks)
+        client = self.client(cache_dir=False)
+
+        first = self.fetch(client)
+        second = self.fetch(client)
+
+        self.assertEqual(second, chunks)
+        self.assertIs(second, first)
+        self.assertEqual(self.server.requests[1]['headers']['If-None-Match'], '"v1"')
+        stats = client.get_stats()
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['downloads'], 1)
+        self.assertEqual(stats['not_modified'], 1)
+
+    def test_changed_etag_downloads_again(self):
+        self.serve(make_chunks(3))
+        client = self.client()
+        self.fetch(client)
+
+        self.serve(make_chunks(5), etag='"v2"')
+        self.assertEqual(self.fetch(client), make_chunks(5))
+        self.assertEqual(client.get_stats()['downloads'], 2)
+
+        # The new ETag replaced the old one
+        self.fetch(client)
+        self.assertEqual(self.server.requests[-1]['headers']['If-None-Match'], '"v2"')
+        self.assertEqual(client.get_stats()['not_modified'], 1)
+
+    def test_refs_are_cached_separately(self):
+        self.serve(make_chunks(3))
+        client = self.client()
+        self.fetch(client, ref='main')
+        self.fetch(client, ref='dev')
+
+        self.assertNotIn('If-None-Match', self.server.requests[1]['headers'])
+        self.assertEqual(client.get_stats()['downloads'], 2)
+
+    def test_disk_tier_survives_a_new_client(self):
+        chunks = make_chunks(3)
+        self.serve(chunks)
+        self.fetch(self.client())
+        self.assertEqual(len(self.cache_files()), 2)
+
+        # A fresh process only has the disk cache
+        client = self.client()
+        self.assertEqual(self.fetch(client), chunks)
+        self.assertEqual(self.server.requests[1]['headers']['If-None-Match'], '"v1"')
+        stats = client.get_stats()
+        self.assertEqual(stats['downloads'], 0)
+        self.assertEqual(stats['not_modified'], 1)
+
+    def test_disk_entry_without_etag_is_ignored(self):
+        self.serve(make_chunks(3))
+        self.fetch(self.client())
+        for name in self.cache_files():
+            if name.endswith('.etag'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+        client = self.client()
+        self.assertEqual(self.fetch(client), make_chunks(3))
+        self.assertNotIn('If-None-Match', self.server.requests[1]['headers'])
+        self.assertEqual(client.get_stats()['downloads'], 1)
+
+    def test_no_etag_is_not_cached(self):
+        self.serve(make_chunks(3), etag=None)
+        client = self.client()
+
+        self.assertEqual(self.fetch(client), make_chunks(3))
+        self.assertEqual(self.cache_files(), [])
+        self.assertEqual(client.get_stats()['cached_files'], 0)
+
+    def test_truncated_array(self):
+        body = json.dumps(make_chunks(3)).encode('utf-8')
+        self.serve(body[:len(body) // 2])
+        client = self.client()
+
+        self.assertEqual(self.fetch(client), [])
+        # Nothing partial is kept, in memory or on disk
+        self.assertEqual(self.cache_files(), [])
+        self.assertEqual(client.get_stats()['cached_files'], 0)
+
+        # The next load downloads the whole file instead of sending an ETag
+        self.serve(make_chunks(3))
+        self.assertEqual(self.fetch(client), make_chunks(3))
+        self.assertNotIn('If-None-Match', self.server.requests[1]['headers'])
+
+    def test_array_missing_closing_bracket(self):
+        body = json.dumps(make_chunks(3)).encode('utf-8')
+        self.serve(body[:-1])
+
+        self.assertEqual(self.fetch(self.client()), [])
+        self.assertEqual(self.cache_files(), [])
+
+    def test_non_array_body(self):
+        self.serve({'chunks': make_chunks(3)})
+
+        self.assertEqual(self.fetch(self.client()), [])
+        self.assertEqual(self.cache_files(), [])
+
+    def test_array_of_non_objects(self):
+        self.serve([1, 2, 3])
+
+        self.assertEqual(self.fetch(self.client()), [])
+        self.assertEqual(self.cache_files(), [])
+
+    def test_empty_array(self):
+        self.serve([])
+
+        self.assertEqual(self.fetch(self.client()), [])
+        self.assertEqual(self.cache_files(), [])
+
+    def test_trailing_comma(self):
+        self.serve(b'[{"chunk_id": 0, "text": "a"},]')
+
+        self.assertEqual(self.fetch(self.client()), [])
+        self.assertEqual(self.cache_files(), [])
+
+    def test_disk_tier_keeps_the_most_recently_used_files(self):
+        chunks = make_chunks(50)
+        size = len(json.dumps(chunks)) + len('"v1"')
+        client = self.client(max_disk_bytes=size * 2)
+        self.serve(chunks)
+        self.fetch(client, ref='a')
+        self.fetch(client, ref='b')
+        # A new process reads ref a from disk, which makes b the oldest
+        self.fetch(self.client(), ref='a')
+
+        self.fetch(client, ref='c')
+        self.assertEqual(len(self.cache_files()), 4)
+        self.assertEqual(client.get_stats()['disk_evictions'], 1)
+
+        client = self.client()
+        self.fetch(client, ref='a')
+        self.fetch(client, ref='b')
+        self.fetch(client, ref='c')
+        self.assertNotIn('If-None-Match', self.server.requests[-2]['headers'])
+        self.assertEqual(client.get_stats()['not_modified'], 2)
+
+    def test_http_error(self):
+        client = self.client()
+
+        self.assertEqual(client.fetch_chunks('owner', 'repo', 'missing.json', 'secret'), [])
+        self.assertEqual(client.get_stats()['downloads'], 0)
+
+
+class IterJsonArrayTest(unittest.TestCase):
+
+    def parse(self, text, size=3):
+        return list(iter_json_array(text[i:i + size] for i in range(0, len(text), size)))
+
+    def test_matches_json_loads(self):
+        for text in ['[]', '[ ]', '[1]', '[1, 2.5, -3e+10, "a,]"]', '[{"a": [1, 2]}, null, true]']:
+            for size in (1, 3, 100):
+                self.assertEqual(self.parse(text, size), json.loads(text))
+
+    def test_rejects_malformed_arrays(self):
+        for text in ['[1,]', '[1, ]', '[,]', '[,1]', '[1 2]', '[1.]', '{}', '[1']:
+            with self.assertRaises(ValueError, msg=text):
+                self.parse(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from utils.image_store import ImageStore, content_hash
+
+
+def image_part(name, blob):
+    return types.SimpleNamespace(partname=f'/word/media/{name}', blob=blob, content_type='image/png')
+
+
+class ImageStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_repeated_images_are_stored_once(self):
+        store = ImageStore(self.root)
+        logo = b'\x89PNG logo' * 50
+        first = store.add_images([image_part('image1.png', logo), image_part('image2.png', b'\x89PNG other')])
+        # The next revision carries the same logo under another part name
+        second = store.add_images([image_part('image7.png', logo)])
+
+        filename = first['/word/media/image1.png']['filename']
+        self.assertEqual(second['/word/media/image7.png']['filename'], filename)
+        self.assertEqual(filename, f"{content_hash(logo)}.png")
+        self.assertEqual(sorted(os.listdir(store.blobs_dir)),
+                         sorted(entry['filename'] for entry in first.values()))
+        stats = store.get_stats()
+        self.assertEqual((stats['stored_images'], stats['reused_images']), (2, 1))
+
+        with open(store.get_path(filename), 'rb') as f:
+            self.assertEqual(f.read(), logo)
+
+    def test_unknown_and_invalid_filenames(self):
+        store = ImageStore(self.root)
+
+        self.assertIsNone(store.get_path('0' * 32 + '.png'))
+        self.assertIsNone(store.get_path('../secret.png'))
+
+    def test_size_is_bounded(self):
+        store = ImageStore(self.root, max_bytes=3000)
+        for i in range(5):
+            store.add_images([image_part(f'image{i}.png', bytes([i]) * 1000)])
+
+        self.assertLessEqual(store.get_stats()['bytes'], 3000)
+        # The newest image is kept
+        self.assertIsNotNone(store.get_path(f"{content_hash(bytes([4]) * 1000)}.png"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from utils.search_engine import SearchIndex, enhanced_search, tokenize
+
+CHUNKS = [
+    {'chunk_id': 0, 'text': 'Ohio pricing follows the current price list', 'metadata': {}},
+    {'chunk_id': 1, 'text': 'New Jersey batch substitutions need approval', 'metadata': {}},
+    {'chunk_id': 2, 'text': 'Ohio delivery dates are set by the sales team', 'metadata': {}},
+]
+
+
+class BM25Test(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SearchIndex(CHUNKS)
+
+    def test_unknown_terms_do_not_change_scores(self):
+        known = self.index.bm25_scores(set(tokenize('ohio pricing')))
+        with_unknown = self.index.bm25_scores(set(tokenize('ohio pricing zzqxv')))
+
+        self.assertEqual(with_unknown, known)
+
+    def test_only_unknown_terms_score_nothing(self):
+        self.assertEqual(self.index.bm25_scores({'zzqxv'}), {})
+
+    def test_batch_matches_single_queries(self):
+        term_sets = [set(tokenize(query)) for query in
+                     ('ohio pricing', 'ohio zzqxv', 'batch substitutions ohio', 'zzqxv')]
+
+        self.assertEqual(self.index.bm25_scores_many(term_sets),
+                         [self.index.bm25_scores(terms) for terms in term_sets])
+
+
+class RankingTest(unittest.TestCase):
+
+    def test_ties_keep_document_order(self):
+        chunks = [{'chunk_id': i, 'text': 'batch substitution rules', 'metadata': {}} for i in range(8)]
+
+        results = enhanced_search(chunks, 'batch substitution', top_k=5)
+
+        self.assertEqual([result['chunk_id'] for result in results], [0, 1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
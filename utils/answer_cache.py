@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+from utils.disk_lru import DiskLRU, write_file, touch, scan_files
+
+
+class AnswerCache:
+    """Cache of LLM answers keyed by model, exact context and temperature.
+
+    Entries are namespaced by corpus id, so answers computed against an old
+    corpus are never served once the corpus hash changes.  The in-memory tier
+    is an LRU bounded by entry count and answer bytes, with a TTL; the
+    optional disk tier keeps one small JSON file per answer under
+    disk_dir/<corpus_id>/, capped at max_disk_bytes by removing the least
+    recently used files first.  Entries can record the chunk ids their context
+    was built from, so a new revision of a corpus can take over every
+    answer whose chunks did not change.
+    """
+
+    def __init__(self, max_entries=512, max_bytes=8 * 1024 * 1024, ttl=3600, disk_dir=None,
+                 max_disk_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._disk = DiskLRU(self._disk_files, max_disk_bytes, on_remove=self._remove_empty_dir)
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'disk_hits': 0,
+            'evictions': 0,
+            'disk_evictions': 0,
+            'expirations': 0
+        }
+
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+            except OSError:
+                self.disk_dir = None
+
+    @staticmethod
+    def make_key(model, context, temperature):
+        payload = json.dumps([model, float(temperature), context], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, corpus_id, model, context, temperature):
+        """Return the cached answer, or None on a miss"""
+        key = (corpus_id, self.make_key(model, context, temperature))
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                answer, expires_at = entry[:2]
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return answer
+                self._drop(key)
+                self._stats['expirations'] += 1
+
+        answer, expires_at, chunk_ids = self._read_from_disk(key, now)
+        with self._lock:
+            if answer is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._stats['disk_hits'] += 1
+        self._remember(key, answer, expires_at, chunk_ids)
+        return answer
+
+    def put(self, corpus_id, model, context, temperature, answer, chunk_ids=None):
+        """Cache an answer for this corpus, model, context and temperature.
+
+        chunk_ids lists the chunks the context was built from.
+        """
+        key = (corpus_id, self.make_key(model, context, temperature))
+        expires_at = time.time() + self.ttl
+        if chunk_ids is not None:
+            chunk_ids = list(chunk_ids)
+        self._remember(key, answer, expires_at, chunk_ids)
+        self._write_to_disk(key, answer, expires_at, chunk_ids)
+
+    def apply_changes(self, old_corpus_id, new_corpus_id, changes):
+        """Carry answers over to a new revision of a corpus.
+
+        Answers are keyed by their exact context, so they stay valid; those
+        built from a removed or modified chunk can no longer be asked for and
+        are left behind.  The old corpus keeps its entries.
+        """
+        stale = set(changes['removed']) | set(changes['modified'])
+
+        def carried_over(chunk_ids):
+            return not chunk_ids or not stale.intersection(chunk_ids)
+
+        now = time.time()
+        with self._lock:
+            entries = [(key[1], entry) for key, entry in self._entries.items()
+                       if key[0] == old_corpus_id and entry[1] > now and carried_over(entry[3])]
+        for digest, (answer, expires_at, _, chunk_ids) in entries:
+            self._remember((new_corpus_id, digest), answer, expires_at, chunk_ids)
+
+        if not self.disk_dir or not self._safe_id(old_corpus_id) or not self._safe_id(new_corpus_id):
+            return
+        try:
+            names = os.listdir(os.path.join(self.disk_dir, old_corpus_id))
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            digest = name[:-len('.json')]
+            answer, expires_at, chunk_ids = self._read_from_disk((old_corpus_id, digest), now)
+            if answer is not None and carried_over(chunk_ids):
+                self._write_to_disk((new_corpus_id, digest), answer, expires_at, chunk_ids)
+
+    def invalidate_corpus(self, corpus_id):
+        """Drop every cached answer computed against corpus_id"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == corpus_id]:
+                self._drop(key)
+        if self.disk_dir and self._safe_id(corpus_id):
+            shutil.rmtree(os.path.join(self.disk_dir, corpus_id), ignore_errors=True)
+            self._disk.forget()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, key, answer, expires_at, chunk_ids=None):
+        size = len(answer.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (answer, expires_at, size, chunk_ids)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats['evictions'] += 1
+
+    def _drop(self, key):
+        # Caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    @staticmethod
+    def _safe_id(corpus_id):
+        return bool(corpus_id) and all(c in '0123456789abcdef' for c in corpus_id)
+
+    def _disk_path(self, key):
+        corpus_id, digest = key
+        return os.path.join(self.disk_dir, corpus_id, f"{digest}.json")
+
+    def _write_to_disk(self, key, answer, expires_at, chunk_ids=None):
+        if not self.disk_dir or not self._safe_id(key[0]):
+            return
+        path = self._disk_path(key)
+        entry = {'answer': answer, 'expires_at': expires_at, 'chunk_ids': chunk_ids}
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            size = write_file(path, json.dumps(entry, ensure_ascii=False))
+        except OSError as e:
+            print(f"Error writing answer cache entry: {e}")
+            return
+        self._disk.added(size)
+        evicted = self._disk.evict(keep=path)
+        if evicted:
+            with self._lock:
+                self._stats['disk_evictions'] += evicted
+
+    def _read_from_disk(self, key, now):
+        if not self.disk_dir or not self._safe_id(key[0]):
+            return None, None, None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None, None, None
+        expires_at = entry.get('expires_at', 0)
+        if expires_at <= now:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._disk.added(-size)
+            except OSError:
+                pass
+            return None, None, None
+        # Recently served answers are the last to be evicted
+        touch(path)
+        return entry.get('answer'), expires_at, entry.get('chunk_ids')
+
+    def _disk_files(self):
+        """(mtime, size, path) for every answer on disk"""
+        return scan_files(self.disk_dir, recursive=True)
+
+    def _remove_empty_dir(self, path):
+        # Drop the corpus directory once its last answer is gone
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
@@ -0,0 +1,182 @@
+"""Batch ingestion of a directory (or glob) of SOP DOCX files.
+
+Chunks every file in a process pool with enhanced_chunk_docx, merges the
+results into one corpus with globally unique chunk ids, and writes it in the
+output/chunks.json format, together with the binary corpus file built from
+it (chunks.corpus next to it), so the two never disagree.  The corpus (and
+its vector index) is also put in the corpus store, so the app finds the
+index already built when it loads the same chunks.
+
+Usage:
+    python -m utils.batch_ingest sops/ -o output/chunks.json
+    python -m utils.batch_ingest "sops/*.docx" --workers 4 --chunk-size 800
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.document_processor import enhanced_chunk_docx
+from utils.image_store import ImageStore
+from utils.corpus_store import CorpusStore
+from utils.corpus_format import write_corpus, file_sha256
+from utils.vector_index import VectorIndex
+
+
+def find_docx_files(inputs):
+    """Expand directories, globs and file paths into a sorted list of DOCX files"""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, '**', '*.docx'), recursive=True)
+        else:
+            matches = glob.glob(item, recursive=True) or [item]
+        for path in matches:
+            # Skip Word lock files (~$name.docx)
+            if path.lower().endswith('.docx') and not os.path.basename(path).startswith('~$'):
+                files.append(os.path.normpath(path))
+    return sorted(set(files))
+
+
+def source_names(files):
+    """Path of each file relative to the directory all of them are under.
+
+    Files with the same name in different folders (a/oh.docx, b/oh.docx)
+    keep distinct names.
+    """
+    if not files:
+        return []
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in files])
+    return [os.path.relpath(os.path.abspath(path), root).replace(os.sep, '/') for path in files]
+
+
+def chunk_file(path, chunk_size, image_store_dir):
+    """Chunk one file; runs in a worker process"""
+    start = time.perf_counter()
+    try:
+        with open(path, 'rb') as f:
+            file_content = f.read()
+    except OSError as e:
+        print(f"Error reading {path}: {e}")
+        return [], time.perf_counter() - start
+    chunks = enhanced_chunk_docx(file_content, chunk_size, image_store=ImageStore(image_store_dir))
+    return chunks, time.perf_counter() - start
+
+
+def merge_chunks(results):
+    """Merge per-file chunk lists into one corpus.
+
+    results is [(source_file, chunks)] in the order the files should appear;
+    chunk ids are renumbered globally and each chunk records its source file.
+    """
+    merged = []
+    for source_file, chunks in results:
+        for chunk in chunks:
+            chunk['chunk_id'] = len(merged)
+            chunk.setdefault('metadata', {})['source_file'] = source_file
+            merged.append(chunk)
+    return merged
+
+
+def ingest(files, chunk_size=800, workers=None, image_store_dir='/tmp/image_store'):
+    """Chunk files in parallel; returns (chunks, timings)
+
+    timings is [{'file', 'chunks', 'images', 'seconds'}] in file order.
+    """
+    if workers == 1 or len(files) <= 1:
+        outcomes = [chunk_file(path, chunk_size, image_store_dir) for path in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(chunk_file, path, chunk_size, image_store_dir) for path in files]
+            outcomes = [future.result() for future in futures]
+
+    results = []
+    timings = []
+    for path, name, (chunks, seconds) in zip(files, source_names(files), outcomes):
+        results.append((name, chunks))
+        timings.append({
+            'file': path,
+            'chunks': len(chunks),
+            'images': sum(len(chunk.get('images', [])) for chunk in chunks),
+            'seconds': seconds
+        })
+    return merge_chunks(results), timings
+
+
+def print_report(timings, wall_seconds):
+    width = max([len(t['file']) for t in timings] + [4])
+    print(f"{'file':<{width}}  {'chunks':>6}  {'images':>6}  {'seconds':>8}")
+    for t in timings:
+        print(f"{t['file']:<{width}}  {t['chunks']:>6}  {t['images']:>6}  {t['seconds']:>8.2f}")
+    busy = sum(t['seconds'] for t in timings)
+    print(f"{len(timings)} files, {sum(t['chunks'] for t in timings)} chunks "
+          f"in {wall_seconds:.2f}s wall ({busy:.2f}s summed over files)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Chunk a directory of SOP DOCX files into one corpus')
+    parser.add_argument('inputs', nargs='+', help='DOCX files, directories or glob patterns')
+    parser.add_argument('-o', '--output', default=os.path.join('output', 'chunks.json'),
+                        help='Where to write the merged chunks (default output/chunks.json); the '
+                             'corpus file goes next to it with a .corpus extension')
+    parser.add_argument('--no-corpus-file', action='store_true',
+                        help='Only write the JSON, not the binary corpus file')
+    parser.add_argument('--chunk-size', type=int, default=800)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: one per CPU)')
+    parser.add_argument('--image-store-dir', default=os.environ.get('IMAGE_STORE_DIR', '/tmp/image_store'))
+    parser.add_argument('--corpus-store-dir', default=os.environ.get('CORPUS_STORE_DIR', '/tmp/corpus_store'),
+                        help='Corpus store to warm with the chunks and vector index (empty to skip)')
+    args = parser.parse_args(argv)
+
+    files = find_docx_files(args.inputs)
+    if not files:
+        print("No DOCX files found")
+        return 1
+
+    start = time.perf_counter()
+    chunks, timings = ingest(files, args.chunk_size, args.workers, args.image_store_dir)
+    print_report(timings, time.perf_counter() - start)
+
+    failed = [t['file'] for t in timings if not t['chunks']]
+    if failed:
+        print(f"No chunks from: {', '.join(failed)}")
+    if not chunks:
+        return 1
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(chunks, f, ensure_ascii=False, indent=2)
+    print(f"Wrote {len(chunks)} chunks to {args.output}")
+
+    # Round-trip through JSON so the corpus id matches what the app loads
+    with open(args.output, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+
+    # The corpus file and the corpus store share one vector index
+    vector_index = None
+    if not args.no_corpus_file or args.corpus_store_dir:
+        vector_index = VectorIndex.build(chunks)
+
+    # A corpus file left from older chunks would be out of date; rebuild it
+    if not args.no_corpus_file:
+        corpus_path = os.path.splitext(args.output)[0] + '.corpus'
+        write_corpus(chunks, corpus_path, source_sha256=file_sha256(args.output), vector_index=vector_index)
+        print(f"Wrote corpus file {corpus_path}")
+
+    if args.corpus_store_dir:
+        corpus = CorpusStore(disk_dir=args.corpus_store_dir).put(chunks)
+        path = corpus.artifact_path('vectors.npz')
+        if path:
+            vector_index.save(path)
+            print(f"Stored corpus {corpus.corpus_id} with its vector index in {args.corpus_store_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import re
+import math
+from functools import lru_cache
+
+# Prompt tokens available for retrieved context, per model.  The rest of the
+# model's window holds the system prompt and the answer (up to 1000 tokens).
+MODEL_TOKEN_BUDGETS = {
+    "GPT-4": 3000,
+    "GPT-4 Mini": 6000,
+    "Gemini 2.0 Flash": 6000
+}
+DEFAULT_TOKEN_BUDGET = 4000
+
+# Units (lines and sentences) shorter than this are never dropped as
+# duplicates: "Yes." or "FORMAT:" repeat legitimately
+MIN_DEDUP_CHARS = 24
+
+TOKEN_PIECE = re.compile(r'\w+|[^\w\s]')
+# A unit is a line or sentence, kept with the whitespace that follows it
+UNIT_PATTERN = re.compile(r'.*?(?:[.!?](?=\s)|\n|$)\s*', re.DOTALL)
+WHITESPACE = re.compile(r'\s+')
+
+
+def estimate_tokens(text):
+    """Approximate tokenizer count: a token per word or punctuation mark,
+    and at least one per four characters (long words split into several)"""
+    if not text:
+        return 0
+    return max(len(TOKEN_PIECE.findall(text)), math.ceil(len(text) / 4))
+
+
+def token_budget(model, override=None):
+    """Context token budget for a model; override (e.g. from the environment) wins"""
+    if override:
+        return override
+    return MODEL_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+
+
+def split_units(text):
+    """Split text into units whose concatenation is text"""
+    return [unit for unit in UNIT_PATTERN.findall(text) if unit]
+
+
+def normalize_unit(unit):
+    return WHITESPACE.sub(' ', unit).strip().lower()
+
+
+@lru_cache(maxsize=4096)
+def chunk_units(text):
+    """(unit, normalized, tokens) for each unit of a chunk text.
+
+    The same chunks are retrieved again and again, so their units are
+    cached by text rather than split and counted per request.
+    """
+    return tuple((unit, normalize_unit(unit), estimate_tokens(unit)) for unit in split_units(text))
+
+
+class ContextPacker:
+    """Packs chunk text into a token budget, dropping spans already included.
+
+    Results are taken in the order given (best first).  Each chunk is cut
+    into lines and sentences; a unit whose normalized text already appears
+    in the packed context (whole, or inside a longer unit) is dropped, so
+    text repeated across overlapping chunks is sent once.  A chunk that
+    does not fit is cut after its last whole unit that does.
+    """
+
+    def __init__(self, budget):
+        self.remaining = budget
+        self.seen = ''
+        self.deduplicated = 0
+        self.truncated = 0
+        self.skipped = 0
+
+    def take(self, text, overhead):
+        """The novel part of text that fits after overhead tokens, or None"""
+        units = []
+        for unit, normalized, tokens in chunk_units(text):
+            if len(normalized) >= MIN_DEDUP_CHARS and normalized in self.seen:
+                self.deduplicated += 1
+                continue
+            units.append((unit, normalized, tokens))
+        if not any(normalized for _, normalized, _ in units):
+            self.skipped += 1
+            return None
+
+        cost = overhead
+        taken = []
+        for unit, normalized, tokens in units:
+            if cost + tokens > self.remaining:
+                break
+            cost += tokens
+            taken.append((unit, normalized))
+        if not any(normalized for _, normalized in taken):
+            self.skipped += 1
+            return None
+        if len(taken) < len(units):
+            self.truncated += 1
+
+        self.remaining -= cost
+        self.seen += '\0' + '\0'.join(normalized for _, normalized in taken)
+        return ''.join(unit for unit, _ in taken).strip()
+
+
+def pack_context(query, search_results, budget=DEFAULT_TOKEN_BUDGET, analytical=False):
+    """LLM context for a query from ranked search results, within a token budget.
+
+    Returns (context, stats), where stats counts the estimated tokens, the
+    sections included, and the units and sections dropped to fit.
+    Analytical questions get state and topic labels per section and a
+    summary of the states and topics covered.
+    """
+    if analytical:
+        preamble = f"USER QUESTION: {query}\n\nCOMPREHENSIVE DATA FOR ANALYSIS:"
+    else:
+        preamble = f"USER QUESTION: {query}\n\nRELEVANT DOCUMENTATION:"
+    context_parts = [preamble]
+
+    # The summary is only known at the end; reserve room for the largest one
+    reserve = 0
+    if analytical:
+        all_states = {state for result in search_results for state in result['chunk'].get('metadata', {}).get('states', [])}
+        all_topics = {topic for result in search_results for topic in result['chunk'].get('metadata', {}).get('topics', [])}
+        reserve = estimate_tokens(' '.join(sorted(all_states | all_topics))) + 40
+
+    packer = ContextPacker(budget - estimate_tokens(preamble) - reserve)
+    states_covered = set()
+    topics_covered = set()
+    sections = 0
+
+    for result in search_results:
+        chunk = result['chunk']
+        metadata = chunk.get('metadata', {})
+        header = [f"\n--- Section {sections + 1} (Score: {result['score']:.2f}) ---"]
+        if analytical:
+            states = metadata.get('states', [])
+            topics = metadata.get('topics', [])
+            if states:
+                header.append(f"STATES: {', '.join(states)}")
+            if topics:
+                header.append(f"TOPICS: {', '.join(topics)}")
+
+        text = packer.take(chunk['text'], estimate_tokens('\n'.join(header)) + 2)
+        if text is None:
+            continue
+        sections += 1
+        context_parts.extend(header)
+
+        if analytical:
+            states_covered.update(states)
+            topics_covered.update(topics)
+            context_parts.append(f"CONTENT: {text}")
+        else:
+            context_parts.append(text)
+
+    if analytical:
+        context_parts.append(f"\n--- SUMMARY FOR ANALYSIS ---")
+        context_parts.append(f"TOTAL SECTIONS FOUND: {sections}")
+        context_parts.append(f"STATES MENTIONED: {', '.join(sorted(states_covered))}")
+        context_parts.append(f"TOPICS COVERED: {', '.join(sorted(topics_covered))}")
+        context_parts.append(f"\nINSTRUCTION: Please analyze ALL the provided sections to answer the user's question.")
+
+    context = '\n'.join(context_parts)
+    return context, {
+        'tokens': estimate_tokens(context),
+        'budget': budget,
+        'sections': sections,
+        'deduplicated_units': packer.deduplicated,
+        'truncated_sections': packer.truncated,
+        'skipped_sections': packer.skipped
+    }
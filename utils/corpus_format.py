@@ -0,0 +1,413 @@
+"""Compact binary corpus files, loaded through a memory map.
+
+One file holds everything the app needs for a corpus: the chunk texts as a
+single UTF-8 blob with an offsets array, the rest of each chunk as compact
+JSON records whose metadata values are interned, and the prebuilt BM25 and
+vector indexes as flat arrays.  Opening a file only parses a small header;
+chunks are decoded when they are accessed, and worker processes that open
+the same file share its pages through the OS page cache.
+
+Layout:
+    MAGIC, format version (uint32), header length (uint32), header JSON,
+    then the sections listed in the header, each 8-byte aligned.
+
+Usage:
+    python -m utils.corpus_format build output/chunks.json -o output/chunks.corpus
+    python -m utils.corpus_format check output/chunks.json   # exit 1 if stale
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+from array import array
+from collections.abc import Sequence
+
+from utils.corpus_store import compute_corpus_id
+from utils.search_engine import SearchIndex
+
+MAGIC = b'SOPCRPS\x00'
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct('<8sII')
+ALIGNMENT = 8
+
+
+class StaleCorpusError(Exception):
+    """A corpus file was not built from the current contents of its source"""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _blob(items):
+    """Concatenate byte strings; returns (blob, offsets array with n + 1 entries)"""
+    offsets = array('Q', [0])
+    for item in items:
+        offsets.append(offsets[-1] + len(item))
+    return b''.join(items), offsets
+
+
+def _intern_metadata(chunks):
+    """Split metadata into per-key value tables and per-chunk index pairs"""
+    keys = {}
+    values = []
+    value_ids = []
+    encoded = []
+    for chunk in chunks:
+        pairs = []
+        for key, value in chunk.get('metadata', {}).items():
+            if key not in keys:
+                keys[key] = len(keys)
+                values.append([])
+                value_ids.append({})
+            k = keys[key]
+            token = json.dumps(value, sort_keys=True)
+            if token not in value_ids[k]:
+                value_ids[k][token] = len(values[k])
+                values[k].append(value)
+            pairs.append([k, value_ids[k][token]])
+        encoded.append(pairs)
+    return list(keys), values, encoded
+
+
+def write_corpus(chunks, path, source_sha256=None, vectors=True, vector_index=None):
+    """Write chunks, their search index and (optionally) vector index to path.
+
+    vector_index is one already built for these chunks; otherwise it is
+    built here.
+    """
+    if any(not isinstance(chunk.get('chunk_id'), int) for chunk in chunks):
+        raise ValueError("Corpus files need integer chunk ids")
+
+    metadata_keys, metadata_values, metadata_pairs = _intern_metadata(chunks)
+    texts = [chunk['text'].encode('utf-8') for chunk in chunks]
+    records = []
+    for chunk, pairs in zip(chunks, metadata_pairs):
+        # The text placeholder keeps the key order of the original chunk
+        record = {key: (None if key == 'text' else value) for key, value in chunk.items()}
+        if 'metadata' in record:
+            record['metadata'] = pairs
+        records.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    index = SearchIndex(chunks)
+    terms = sorted(index.postings)
+    posting_offsets = array('Q', [0])
+    posting_docs = array('I')
+    posting_tfs = array('I')
+    for term in terms:
+        for doc, tf in index.postings[term]:
+            posting_docs.append(doc)
+            posting_tfs.append(tf)
+        posting_offsets.append(len(posting_docs))
+
+    text_blob, text_offsets = _blob(texts)
+    record_blob, record_offsets = _blob(records)
+    sections = [
+        ('text', text_blob),
+        ('text_offsets', text_offsets),
+        ('records', record_blob),
+        ('record_offsets', record_offsets),
+        ('chunk_ids', array('q', [chunk['chunk_id'] for chunk in chunks])),
+        ('terms', '\n'.join(terms).encode('utf-8')),
+        ('posting_offsets', posting_offsets),
+        ('posting_docs', posting_docs),
+        ('posting_tfs', posting_tfs),
+        ('doc_lengths', array('I', index.doc_lengths)),
+    ]
+
+    vector_dim = None
+    if vectors and chunks:
+        if vector_index is None:
+            from utils.vector_index import VectorIndex
+            vector_index = VectorIndex.build(chunks)
+        vector_dim = vector_index.matrix.shape[1]
+        sections.extend([
+            ('vector_idf', vector_index.idf),
+            ('vector_components', vector_index.components),
+            ('vector_matrix', vector_index.matrix),
+        ])
+
+    header = {
+        'corpus_id': compute_corpus_id(chunks),
+        'source_sha256': source_sha256,
+        'byteorder': sys.byteorder,
+        'count': len(chunks),
+        'metadata_keys': metadata_keys,
+        'metadata_values': metadata_values,
+        'search': {
+            'total_length': index.total_length,
+            'metadata_postings': [[field, value, sorted(docs)]
+                                  for (field, value), docs in index.metadata_postings.items()],
+            'image_docs': sorted(index.image_docs),
+            'long_docs': sorted(index.long_docs)
+        },
+        'vector_dim': vector_dim,
+        'sections': {}
+    }
+
+    # Section offsets depend on the header length, which depends on the
+    # offsets; widening the reserved space until they agree settles quickly
+    payloads = [(name, bytes(data) if isinstance(data, (bytes, array)) else data.tobytes())
+                for name, data in sections]
+    reserved = 0
+    while True:
+        offset = _align(PREAMBLE.size + reserved)
+        for name, payload in payloads:
+            header['sections'][name] = [offset, len(payload)]
+            offset = _align(offset + len(payload))
+        encoded_header = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(encoded_header) <= reserved:
+            break
+        reserved = len(encoded_header) + 64
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(encoded_header)))
+        f.write(encoded_header)
+        for name, payload in payloads:
+            f.seek(header['sections'][name][0])
+            f.write(payload)
+        f.truncate(max(offset, f.tell()))
+    os.replace(tmp_path, path)
+    return header['corpus_id']
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class CorpusFile:
+    """A memory-mapped corpus file.
+
+    Raises ValueError if the file is not a corpus file of this version or
+    was written on a machine with the other byte order.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        if len(self._mmap) < PREAMBLE.size:
+            raise ValueError(f"Not a corpus file: {path}")
+        magic, version, header_length = PREAMBLE.unpack_from(self._mmap)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"Not a version {FORMAT_VERSION} corpus file: {path}")
+        start = PREAMBLE.size
+        self.header = json.loads(str(self._view[start:start + header_length], 'utf-8'))
+        if self.header['byteorder'] != sys.byteorder:
+            raise ValueError(f"Corpus file was written with {self.header['byteorder']}-endian arrays")
+
+        self.corpus_id = self.header['corpus_id']
+        self.source_sha256 = self.header.get('source_sha256')
+        self.count = self.header['count']
+        self._metadata_keys = self.header['metadata_keys']
+        self._metadata_values = self.header['metadata_values']
+        self._text = self.section('text')
+        self._text_offsets = self.section('text_offsets', 'Q')
+        self._records = self.section('records')
+        self._record_offsets = self.section('record_offsets', 'Q')
+
+    def section(self, name, fmt=None):
+        """Zero-copy view of a section, cast to an array format if given"""
+        offset, length = self.header['sections'][name]
+        view = self._view[offset:offset + length]
+        return view.cast(fmt) if fmt else view
+
+    def text(self, doc):
+        return str(self._text[self._text_offsets[doc]:self._text_offsets[doc + 1]], 'utf-8')
+
+    def chunk(self, doc):
+        """Decode one chunk into the dict it was written from"""
+        record = json.loads(str(self._records[self._record_offsets[doc]:self._record_offsets[doc + 1]], 'utf-8'))
+        if 'text' in record:
+            record['text'] = self.text(doc)
+        if 'metadata' in record:
+            metadata = {}
+            for k, v in record['metadata']:
+                value = self._metadata_values[k][v]
+                # Interned values are shared; hand out copies of lists
+                metadata[self._metadata_keys[k]] = list(value) if isinstance(value, list) else value
+            record['metadata'] = metadata
+        return record
+
+    def search_index(self, chunks):
+        """SearchIndex backed by the mapped postings; copy() it before changing it"""
+        search = self.header['search']
+        index = SearchIndex()
+        index.chunks = chunks
+        index.postings = MappedPostings(self)
+        index.doc_lengths = self.section('doc_lengths', 'I')
+        index.total_length = search['total_length']
+        index.metadata_postings = {(field, value): set(docs)
+                                   for field, value, docs in search['metadata_postings']}
+        index.image_docs = set(search['image_docs'])
+        index.long_docs = set(search['long_docs'])
+        index.doc_ids = {chunk_id: doc for doc, chunk_id in enumerate(self.section('chunk_ids', 'q'))}
+        index.live_docs = self.count
+        return index
+
+    def vector_index(self):
+        """VectorIndex whose arrays point into the mapped file, or None"""
+        dim = self.header.get('vector_dim')
+        if dim is None:
+            return None
+        import numpy as np
+        from utils.vector_index import VectorIndex
+
+        def matrix(name, columns):
+            return np.frombuffer(self.section(name), dtype=np.float32).reshape(-1, columns)
+
+        idf = np.frombuffer(self.section('vector_idf'), dtype=np.float32)
+        return VectorIndex(idf, matrix('vector_components', dim), matrix('vector_matrix', dim))
+
+
+class MappedPostings:
+    """Read-only term -> [(doc, tf)] mapping over the postings sections"""
+
+    def __init__(self, corpus_file):
+        self._offsets = corpus_file.section('posting_offsets', 'Q')
+        self._docs = corpus_file.section('posting_docs', 'I')
+        self._tfs = corpus_file.section('posting_tfs', 'I')
+        self._terms_section = corpus_file.section('terms')
+        self._term_ids = None
+
+    @property
+    def term_ids(self):
+        # The term table is only decoded on the first lookup
+        if self._term_ids is None:
+            terms = str(self._terms_section, 'utf-8').split('\n') if len(self._terms_section) else []
+            self._term_ids = {term: i for i, term in enumerate(terms)}
+        return self._term_ids
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def __contains__(self, term):
+        return term in self.term_ids
+
+    def __iter__(self):
+        return iter(self.term_ids)
+
+    def get(self, term, default=None):
+        i = self.term_ids.get(term)
+        if i is None:
+            return default
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return list(zip(self._docs[start:end], self._tfs[start:end]))
+
+    def __getitem__(self, term):
+        postings = self.get(term)
+        if postings is None:
+            raise KeyError(term)
+        return postings
+
+    def items(self):
+        for term in self.term_ids:
+            yield term, self[term]
+
+
+class MappedChunks(Sequence):
+    """Lazily decoded chunk list of a corpus file.
+
+    Behaves like the list of chunk dicts it was written from; each access
+    decodes a fresh dict, so changes to one are not seen by other readers.
+    """
+
+    def __init__(self, corpus_file):
+        self.corpus_file = corpus_file
+        self.corpus_id = corpus_file.corpus_id
+        self.path = corpus_file.path
+
+    def __len__(self):
+        return self.corpus_file.count
+
+    def __getitem__(self, doc):
+        if isinstance(doc, slice):
+            return [self.corpus_file.chunk(i) for i in range(*doc.indices(len(self)))]
+        if doc < 0:
+            doc += len(self)
+        if not 0 <= doc < len(self):
+            raise IndexError('chunk index out of range')
+        return self.corpus_file.chunk(doc)
+
+    def prebuilt(self):
+        """Factories for the derived structures stored in the file, by name"""
+        prebuilt = {'search_index': self.corpus_file.search_index}
+        if self.corpus_file.header.get('vector_dim') is not None:
+            prebuilt['vector_index'] = lambda chunks: self.corpus_file.vector_index()
+        return prebuilt
+
+
+def stale_message(path, source_path):
+    return (f"Corpus file {path} is out of date with {source_path}; rebuild it with "
+            f"python -m utils.corpus_format build {source_path} -o {path}")
+
+
+def open_corpus(path, source_path=None):
+    """Open a corpus file and return its MappedChunks, or None if unreadable.
+
+    With source_path, the file must have been built from the current
+    contents of that file; otherwise StaleCorpusError is raised.
+    """
+    try:
+        corpus_file = CorpusFile(path)
+        if source_path and corpus_file.source_sha256 != file_sha256(source_path):
+            raise StaleCorpusError(stale_message(path, source_path))
+        return MappedChunks(corpus_file)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error opening corpus file {path}: {e}")
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or check a binary corpus file for a chunks JSON file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='Convert chunks JSON into a corpus file')
+    build.add_argument('source', help='Chunks JSON file, e.g. output/chunks.json')
+    build.add_argument('-o', '--output', help='Corpus file to write (default: source with .corpus extension)')
+    build.add_argument('--no-vectors', action='store_true', help='Leave out the vector index')
+    check = subparsers.add_parser('check', help='Fail if a corpus file is missing or out of date with its source')
+    check.add_argument('source', help='Chunks JSON file, e.g. output/chunks.json')
+    check.add_argument('-o', '--output', help='Corpus file to check (default: source with .corpus extension)')
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.splitext(args.source)[0] + '.corpus'
+    if args.command == 'check':
+        return check_corpus(output, args.source)
+
+    with open(args.source, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+    if not isinstance(chunks, list):
+        print("Invalid chunks format")
+        return 1
+    corpus_id = write_corpus(chunks, output, source_sha256=file_sha256(args.source),
+                             vectors=not args.no_vectors)
+    print(f"Wrote {len(chunks)} chunks ({os.path.getsize(output)} bytes, corpus {corpus_id}) to {output}")
+    return 0
+
+
+def check_corpus(path, source_path):
+    """CLI check: 0 if the corpus file was built from the current source, else 1"""
+    try:
+        corpus_file = CorpusFile(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error opening corpus file {path}: {e}")
+        return 1
+    if corpus_file.source_sha256 != file_sha256(source_path):
+        print(stale_message(path, source_path))
+        return 1
+    print(f"Corpus file {path} is up to date with {source_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from utils.disk_lru import DiskLRU, write_file, touch, scan_files
+
+
+def compute_corpus_id(chunks):
+    """Content hash used as the corpus id"""
+    # Chunks mapped from a corpus file carry the id computed when it was built
+    corpus_id = getattr(chunks, 'corpus_id', None)
+    if corpus_id:
+        return corpus_id
+    payload = json.dumps(chunks, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+class Corpus:
+    """A loaded chunk list plus anything derived from it (indexes etc.)"""
+
+    def __init__(self, corpus_id, chunks, disk_dir=None):
+        self.corpus_id = corpus_id
+        self.chunks = chunks
+        self.disk_dir = disk_dir
+        self._derived = {}
+        self._lock = threading.Lock()
+
+        # Corpus files store their indexes prebuilt; their factories open them
+        prebuilt = getattr(chunks, 'prebuilt', None)
+        self._prebuilt = prebuilt() if prebuilt is not None else {}
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def derived(self, name, factory):
+        """Return a derived structure, building it with factory(chunks) once"""
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._prebuilt.get(name, factory)(self.chunks)
+                    self._derived[name] = value
+        return value
+
+    def is_prebuilt(self, name):
+        """True if the corpus came with this derived structure ready to open"""
+        return name in self._prebuilt
+
+    def set_derived(self, name, value):
+        with self._lock:
+            self._derived[name] = value
+
+    def artifact_path(self, name):
+        """Path for an on-disk artifact stored next to the chunks, or None"""
+        if not self.disk_dir:
+            return None
+        return os.path.join(self.disk_dir, f"{self.corpus_id}.{name}")
+
+
+class CorpusStore:
+    """Server-side corpus storage so sessions only carry a corpus id.
+
+    Corpora live in an in-process LRU; if disk_dir is set they are also
+    written there as JSON so other workers (or a warm restart) can reload them.
+    Corpora mapped from a corpus file are recorded as a reference to that
+    file instead, so every worker maps the same pages.  The disk tier,
+    artifacts included, is capped at max_disk_bytes by removing the least
+    recently used corpora first.
+    """
+
+    def __init__(self, max_entries=8, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'disk_evictions': 0}
+        self._disk = DiskLRU(lambda: scan_files(self.disk_dir), max_disk_bytes, group=self._corpus_of)
+
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+            except OSError:
+                self.disk_dir = None
+
+    def put(self, chunks, corpus_id=None):
+        """Store chunks and return the Corpus they were stored under"""
+        if corpus_id is None:
+            corpus_id = compute_corpus_id(chunks)
+
+        with self._lock:
+            corpus = self._entries.get(corpus_id)
+            if corpus is not None:
+                self._entries.move_to_end(corpus_id)
+                return corpus
+
+        corpus = Corpus(corpus_id, chunks, self.disk_dir)
+        self._write_to_disk(corpus)
+        self._remember(corpus)
+        return corpus
+
+    def get(self, corpus_id):
+        """Return the Corpus for corpus_id, or None if it is unknown"""
+        if not corpus_id:
+            return None
+
+        with self._lock:
+            corpus = self._entries.get(corpus_id)
+            if corpus is not None:
+                self._entries.move_to_end(corpus_id)
+                self._stats['hits'] += 1
+                return corpus
+
+        chunks = self._read_from_disk(corpus_id)
+        with self._lock:
+            self._stats['misses' if chunks is None else 'disk_hits'] += 1
+        if chunks is None:
+            return None
+
+        corpus = Corpus(corpus_id, chunks, self.disk_dir)
+        return self._remember(corpus)
+
+    def get_stats(self):
+        """Lookups served from memory (hits), from disk (disk_hits) or not at all"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+    def _remember(self, corpus):
+        with self._lock:
+            existing = self._entries.get(corpus.corpus_id)
+            if existing is not None:
+                self._entries.move_to_end(corpus.corpus_id)
+                return existing
+            self._entries[corpus.corpus_id] = corpus
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return corpus
+
+    def _disk_path(self, corpus_id):
+        return os.path.join(self.disk_dir, f"{corpus_id}.json")
+
+    def _write_to_disk(self, corpus):
+        if not self.disk_dir:
+            return
+        source_path = getattr(corpus.chunks, 'path', None)
+        if source_path:
+            path = os.path.join(self.disk_dir, f"{corpus.corpus_id}.ref")
+        else:
+            path = self._disk_path(corpus.corpus_id)
+        if os.path.exists(path):
+            touch(path)
+            return
+        try:
+            size = write_file(path, source_path or json.dumps(corpus.chunks, ensure_ascii=False))
+        except OSError as e:
+            print(f"Error writing corpus to disk: {e}")
+            return
+        self._disk.added(size)
+        self._evict(keep=corpus.corpus_id)
+
+    def evict_disk(self, keep=None):
+        """Remove the least recently used corpora from disk until it fits max_disk_bytes.
+
+        A corpus goes together with its artifacts; keep is a corpus id
+        that is never removed.  Call after writing artifacts.
+        """
+        if not self.disk_dir:
+            return
+        # Artifacts are written by their owners, so the total is rescanned
+        self._disk.forget()
+        self._evict(keep)
+
+    def _evict(self, keep=None):
+        evicted = self._disk.evict(keep=keep)
+        if evicted:
+            with self._lock:
+                self._stats['disk_evictions'] += evicted
+
+    @staticmethod
+    def _corpus_of(path):
+        return os.path.basename(path).split('.', 1)[0]
+
+    def _read_from_disk(self, corpus_id):
+        if not self.disk_dir:
+            return None
+        # Corpus ids are hex digests; never let one escape the store directory
+        if not all(c in '0123456789abcdef' for c in corpus_id):
+            return None
+        path = self._disk_path(corpus_id)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                chunks = json.load(f)
+            touch(path)
+            return chunks
+        except (OSError, ValueError):
+            pass
+        return self._read_reference(corpus_id)
+
+    def _read_reference(self, corpus_id):
+        """Map the corpus file a .ref entry points at, if it still holds corpus_id"""
+        path = os.path.join(self.disk_dir, f"{corpus_id}.ref")
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                source_path = f.read().strip()
+        except OSError:
+            return None
+        from utils.corpus_format import open_corpus
+        chunks = open_corpus(source_path)
+        if chunks is None or chunks.corpus_id != corpus_id:
+            return None
+        touch(path)
+        return chunks
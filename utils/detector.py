@@ -0,0 +1,171 @@
+import re
+
+# Vocabularies are {category: {label: [phrases]}}; label order matters (see
+# detect_context and detect_query_intent).  Phrases of WORD_CATEGORIES only
+# match whole words, with any run of whitespace between their words; all
+# other phrases match anywhere, literally.
+WORD_CATEGORIES = ('state',)
+
+# Matched against upper-cased document text during ingestion
+DOCUMENT_VOCABULARY = {
+    'state': {
+        'OH': ['OHIO', 'OH'],
+        'MD': ['MARYLAND', 'MD'],
+        'NJ': ['NEW JERSEY', 'NJ'],
+        'IL': ['ILLINOIS', 'IL'],
+        'NY': ['NEW YORK', 'NY'],
+        'NV': ['NEVADA', 'NV'],
+        'MA': ['MASSACHUSETTS', 'MA']
+    },
+    'section': {
+        'RISE': ['RISE'],
+        'REGULAR': ['REGULAR']
+    },
+    'topic': {
+        'PRICING': ['PRICING', 'MENU PRICE'],
+        'BATTERIES': ['BATTER'],
+        'BATCH_SUB': ['BATCH SUB'],
+        'DELIVERY_DATE': ['DELIVERY DATE'],
+        'ORDER_LIMIT': ['ORDER LIMIT']
+    }
+}
+
+# Matched against lower-cased search queries
+QUERY_VOCABULARY = {
+    'state': {
+        'OH': ['oh', 'ohio'],
+        'MD': ['md', 'maryland'],
+        'NJ': ['nj', 'new jersey', 'jersey'],
+        'IL': ['il', 'illinois'],
+        'NY': ['ny', 'new york'],
+        'NV': ['nv', 'nevada'],
+        'MA': ['ma', 'massachusetts']
+    },
+    'section': {
+        'RISE': ['rise', 'internal'],
+        'REGULAR': ['regular', 'wholesale']
+    },
+    'topic': {
+        'PRICING': ['price', 'pricing', 'cost', 'discount', 'menu'],
+        'BATTERIES': ['battery', 'batteries', 'separate', 'invoice'],
+        'BATCH_SUB': ['batch', 'sub', 'substitution', 'split'],
+        'DELIVERY_DATE': ['delivery', 'date', 'schedule'],
+        'ORDER_LIMIT': ['limit', 'maximum', 'max', 'unit'],
+        'LESS_AVAILABLE': ['less', 'available', 'partial', 'shortage']
+    },
+    'images': {
+        'IMAGES': ['image', 'show', 'example', 'visual']
+    }
+}
+
+
+def trie_pattern(entries, space=None):
+    """Regex matching any (phrase, tail) entry, factored as a prefix trie.
+
+    Each phrase is followed by its tail pattern; spaces in phrases become
+    the space pattern when one is given.  Sharing prefixes means the
+    regex engine tries one branch per distinct next character instead of
+    every phrase at every position.
+    """
+    trie = {}
+    for phrase, tail in entries:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node.setdefault('', tail)
+
+    def emit(node):
+        branches = []
+        for char, child in node.items():
+            if char:
+                branches.append((space if char == ' ' and space else re.escape(char)) + emit(child))
+        if '' in node:
+            branches.append(node[''])
+        return branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+    return emit(trie)
+
+
+class Detector:
+    """Finds every label of a vocabulary in one pass over a text.
+
+    All phrases are compiled into a single regex inside a zero-width
+    lookahead, with an empty named group marking the end of each phrase, so
+    one finditer reports every position where some phrase starts, overlapping
+    phrases included.  Only one phrase is seen per position, so phrases of
+    different labels must not match at the same position.
+    """
+
+    def __init__(self, vocabulary):
+        self.labels = {category: list(labels) for category, labels in vocabulary.items()}
+        self._groups = {}
+        words, substrings = [], []
+        for category, labels in vocabulary.items():
+            for label, phrases in labels.items():
+                for phrase in phrases:
+                    name = f"g{len(self._groups)}"
+                    self._groups[name] = (category, label)
+                    if category in WORD_CATEGORIES:
+                        words.append((phrase, rf"\b(?P<{name}>)"))
+                    else:
+                        substrings.append((phrase, f"(?P<{name}>)"))
+
+        branches = []
+        if words:
+            branches.append(r'\b' + trie_pattern(words, space=r'\s+'))
+        if substrings:
+            branches.append(trie_pattern(substrings))
+        self.pattern = re.compile(f"(?=(?:{'|'.join(branches)}))")
+
+    def find(self, text):
+        """{category: set of labels} occurring in text"""
+        found = {category: set() for category in self.labels}
+        for name in {match.lastgroup for match in self.pattern.finditer(text)}:
+            category, label = self._groups[name]
+            found[category].add(label)
+        return found
+
+    def ordered(self, found, category):
+        """Labels of a category found, in vocabulary order"""
+        return [label for label in self.labels[category] if label in found[category]]
+
+
+document_detector = Detector(DOCUMENT_VOCABULARY)
+query_detector = Detector(QUERY_VOCABULARY)
+
+
+def detect_context(text):
+    """Context set by one piece of text as [state, section, topic].
+
+    Entries are None where the text leaves the running context unchanged.
+    The last matching state wins; a section is only set together with a
+    state, and the first matching topic wins.
+    """
+    found = document_detector.find(text.upper())
+    states = document_detector.ordered(found, 'state')
+    if not states:
+        state, section = None, None
+    else:
+        state = states[-1]
+        sections = document_detector.ordered(found, 'section')
+        section = sections[0] if sections else None
+    topics = document_detector.ordered(found, 'topic')
+    return [state, section, topics[0] if topics else None]
+
+
+def detect_query_intent(query):
+    """State, section, topics and image interest a search query asks about.
+
+    Returns {'state', 'section', 'topics', 'wants_images'}; the last
+    matching state and the first matching section win, and every matching
+    topic is listed.
+    """
+    found = query_detector.find(query.lower())
+    states = query_detector.ordered(found, 'state')
+    sections = query_detector.ordered(found, 'section')
+    return {
+        'state': states[-1] if states else None,
+        'section': sections[0] if sections else None,
+        'topics': query_detector.ordered(found, 'topic'),
+        'wants_images': bool(found['images'])
+    }
@@ -0,0 +1,124 @@
+import os
+import threading
+
+
+def write_file(path, data):
+    """Write bytes or text to path through a temp file and os.replace.
+
+    Returns how many bytes the store grew by: the new size minus the size
+    of the file it replaced.  Raises OSError.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    try:
+        replaced = os.path.getsize(path)
+    except OSError:
+        replaced = 0
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return len(data) - replaced
+
+
+def touch(path):
+    """Mark a file as recently used"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def scan_files(directory, recursive=False):
+    """(mtime, size, path) for the files in directory, skipping temp files"""
+    files = []
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return files
+    for entry in entries:
+        if entry.name.endswith('.tmp'):
+            continue
+        try:
+            if entry.is_dir():
+                if recursive:
+                    files.extend(scan_files(entry.path, recursive))
+                continue
+            stat = entry.stat()
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    return files
+
+
+class DiskLRU:
+    """Byte cap on an on-disk cache tier, evicting the least recently used first.
+
+    scan() returns (mtime, size, path) for every file of the tier.  Files
+    with the same group(path) are evicted together, and groups are removed
+    in order of priority(path) (lower first), then of their newest mtime,
+    so readers keep entries alive by touching them.  The total is kept in
+    memory between scans; report writes with added().
+    """
+
+    def __init__(self, scan, max_bytes, group=None, priority=None, on_remove=None):
+        self.scan = scan
+        self.max_bytes = max_bytes
+        self.group = group or (lambda path: path)
+        self.priority = priority or (lambda path: 0)
+        self.on_remove = on_remove
+        self._total = None
+        self._lock = threading.Lock()
+
+    def added(self, size):
+        with self._lock:
+            if self._total is not None:
+                self._total += size
+
+    def forget(self):
+        """Drop the in-memory total, e.g. after files were written or removed elsewhere"""
+        with self._lock:
+            self._total = None
+
+    def total(self):
+        with self._lock:
+            if self._total is not None:
+                return self._total
+        total = sum(size for _, size, _ in self.scan())
+        with self._lock:
+            self._total = total
+        return total
+
+    def evict(self, keep=None):
+        """Remove groups until the tier fits max_bytes; returns how many were removed.
+
+        keep is a group that is never removed, e.g. the one just written.
+        """
+        if self.total() <= self.max_bytes:
+            return 0
+
+        groups = {}
+        for mtime, size, path in self.scan():
+            key = self.group(path)
+            rank, newest, group_size, paths = groups.get(key, (self.priority(path), 0, 0, []))
+            groups[key] = (rank, max(newest, mtime), group_size + size, paths + [path])
+
+        total = sum(group_size for _, _, group_size, _ in groups.values())
+        evicted = 0
+        for key, (_, _, size, paths) in sorted(groups.items(), key=lambda item: item[1][:2]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                if self.on_remove is not None:
+                    self.on_remove(path)
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._total = total
+        return evicted
@@ -1,412 +1,528 @@
 import io
 import re
-import os
-import tempfile
+import json
+import difflib
+import hashlib
 import traceback
+from collections import deque
+from lxml import etree
 from docx import Document
-from docx.oxml.ns import qn
+from docx.oxml.ns import qn, nsmap
 from docx.oxml.table import CT_Tbl
 from docx.oxml.text.paragraph import CT_P
 from docx.text.paragraph import Paragraph
 from docx.table import Table
 import unicodedata
 
-def enhanced_chunk_docx(file_content, chunk_size=800):
-    """Enhanced DOCX chunker with complete content extraction"""
-    try:
-        # Create document from uploaded content
-        doc = Document(io.BytesIO(file_content))
+from utils.detector import detect_context
+from utils.image_store import get_default_image_store
+
+# Every picture in the body, found with one compiled XPath instead of
+# serializing each run's XML to look for a drawing
+BLIP_XPATH = etree.XPath('.//w:drawing//a:blip', namespaces={'w': nsmap['w'], 'a': nsmap['a']})
+R_EMBED = qn('r:embed')
+W_P = qn('w:p')
+
+def clean_caption(text):
+    """Enhanced text cleaning with better normalization"""
+    cleaned = unicodedata.normalize('NFKC', text)
+    cleaned = re.sub(r"\s+", " ", cleaned).strip()
+    cleaned = cleaned.replace("–", "-").replace("—", "-").replace(""", '"').replace(""", '"')
+    cleaned = cleaned.replace("'", "'").replace("'", "'")
+    # Remove excessive punctuation
+    cleaned = re.sub(r'[.]{2,}', '.', cleaned)
+    return cleaned
+
+# Pattern for "Image X: description" format
+CAPTION_PATTERN = re.compile(r"^Image\s+(\d+)\s*[:.]?\s*(.*?)(?:\.|$)", re.IGNORECASE)
+FIGURE_PATTERN = re.compile(r"^Figure\s+(\d+)\s*[:.]?\s*(.*?)(?:\.|$)", re.IGNORECASE)
+
+# Descriptive captions without numbers, keyed by the word each one needs.
+# The keyword check skips the (backtracking-heavy) search on long paragraphs
+# that cannot match.
+DESCRIPTIVE_PATTERNS = [
+    (keyword, re.compile(r'([^.]+\s+' + keyword + r'\s*[^.]*)', re.IGNORECASE))
+    for keyword in ['example', 'sheet', 'form', 'format', 'setup', 'process', 'workflow', 'template']
+]
+
+def extract_label(text):
+    """Enhanced label extraction supporting multiple formats"""
+    text = clean_caption(text)
+    
+    # Try Image pattern first
+    m = CAPTION_PATTERN.match(text)
+    if m:
+        idx = int(m.group(1))
+        desc = m.group(2).strip().rstrip(".")
+        return f"Image {idx}: {desc}" if desc else f"Image {idx}"
+    
+    # Try Figure pattern
+    m = FIGURE_PATTERN.match(text)
+    if m:
+        idx = int(m.group(1))
+        desc = m.group(2).strip().rstrip(".")
+        return f"Figure {idx}: {desc}" if desc else f"Figure {idx}"
+    
+    # Look for descriptive patterns without numbers
+    text_lower = text.lower()
+    for keyword, pattern in DESCRIPTIVE_PATTERNS:
+        if keyword not in text_lower:
+            continue
+        match = pattern.search(text)
+        if match:
+            desc = match.group(1).strip()
+            if len(desc) > 5 and len(desc) < 80:  # Reasonable caption length
+                return desc
+    
+    return None
+
+def find_body_images(doc):
+    """Map each top-level body element to the images inside it.
+
+    Returns {body_child: [(image_part, paragraph_element), ...]} in document
+    order, where paragraph_element is the w:p holding the drawing.
+    """
+    body = doc.element.body
+    related_parts = doc.part.related_parts
+    images = {}
+    
+    for blip in BLIP_XPATH(body):
+        rel_id = blip.get(R_EMBED)
+        if not rel_id or rel_id not in related_parts:
+            continue
         
-        chunks = []
-        current_chunk = ""
-        chunk_id = 0
-        image_counter = 1
-        current_context = {'state': None, 'section': None, 'topic': None}
+        paragraph = None
+        top = blip
+        for ancestor in blip.iterancestors():
+            if ancestor is body:
+                break
+            if paragraph is None and ancestor.tag == W_P:
+                paragraph = ancestor
+            top = ancestor
         
-        # Create temp directory for images
-        temp_image_dir = tempfile.mkdtemp()
+        images.setdefault(top, []).append((related_parts[rel_id], paragraph))
+    
+    return images
+
+def element_blocks(doc, child, child_images):
+    """Blocks for one top-level body element, in order and without positions"""
+    if isinstance(child, CT_P):
+        para = Paragraph(child, doc)
+        text = para.text.strip()
         
-        def update_context(text):
-            """Update current context based on text content"""
-            text_upper = text.upper()
-            
-            # State detection
-            state_patterns = {
-                'OH': [r'\bOHIO\b', r'\bOH\b(?!\w)'],
-                'MD': [r'\bMARYLAND\b', r'\bMD\b(?!\w)'],
-                'NJ': [r'\bNEW\s+JERSEY\b', r'\bNJ\b(?!\w)'],
-                'IL': [r'\bILLINOIS\b', r'\bIL\b(?!\w)'],
-                'NY': [r'\bNEW\s+YORK\b', r'\bNY\b(?!\w)'],
-                'NV': [r'\bNEVADA\b', r'\bNV\b(?!\w)'],
-                'MA': [r'\bMASSACHUSETTS\b', r'\bMA\b(?!\w)']
+        for image_part, _ in child_images:
+            yield {
+                'type': 'image',
+                'content': image_part,
+                'paragraph_text': text
             }
-            
-            for state, patterns in state_patterns.items():
-                for pattern in patterns:
-                    if re.search(pattern, text_upper):
-                        current_context['state'] = state
-                        if 'RISE' in text_upper:
-                            current_context['section'] = 'RISE'
-                        elif 'REGULAR' in text_upper:
-                            current_context['section'] = 'REGULAR'
-                        break
-            
-            # Topic detection
-            if 'PRICING' in text_upper or 'MENU PRICE' in text_upper:
-                current_context['topic'] = 'PRICING'
-            elif 'BATTER' in text_upper:
-                current_context['topic'] = 'BATTERIES'
-            elif 'BATCH SUB' in text_upper:
-                current_context['topic'] = 'BATCH_SUB'
-            elif 'DELIVERY DATE' in text_upper:
-                current_context['topic'] = 'DELIVERY_DATE'
-            elif 'ORDER LIMIT' in text_upper:
-                current_context['topic'] = 'ORDER_LIMIT'
         
-        def clean_caption(text):
-            """Enhanced text cleaning with better normalization"""
-            cleaned = unicodedata.normalize('NFKC', text)
-            cleaned = re.sub(r"\s+", " ", cleaned).strip()
-            cleaned = cleaned.replace("–", "-").replace("—", "-").replace(""", '"').replace(""", '"')
-            cleaned = cleaned.replace("'", "'").replace("'", "'")
-            # Remove excessive punctuation
-            cleaned = re.sub(r'[.]{2,}', '.', cleaned)
-            return cleaned
+        yield {
+            'type': 'paragraph',
+            'text': text,
+            'has_image': bool(child_images)
+        }
+        
+    elif isinstance(child, CT_Tbl):
+        for image_part, paragraph in child_images:
+            yield {
+                'type': 'image',
+                'content': image_part,
+                'paragraph_text': Paragraph(paragraph, doc).text.strip() if paragraph is not None else ''
+            }
+        
+        table = Table(child, doc)
+        table_text = []
+        for row in table.rows:
+            row_text = []
+            for cell in row.cells:
+                cell_text = ' '.join(p.text.strip() for p in cell.paragraphs if p.text.strip())
+                if cell_text:
+                    row_text.append(cell_text)
+            if row_text:
+                table_text.append(' | '.join(row_text))
+        
+        yield {
+            'type': 'table',
+            'text': '\n'.join(table_text)
+        }
 
-        def extract_label(text):
-            """Enhanced label extraction supporting multiple formats"""
-            text = clean_caption(text)
-            
-            # Pattern for "Image X: description" format
-            caption_pattern = re.compile(r"^Image\s+(\d+)\s*[:.]?\s*(.*?)(?:\.|$)", re.IGNORECASE)
-            figure_pattern = re.compile(r"^Figure\s+(\d+)\s*[:.]?\s*(.*?)(?:\.|$)", re.IGNORECASE)
-            
-            # Try Image pattern first
-            m = caption_pattern.match(text)
-            if m:
-                idx = int(m.group(1))
-                desc = m.group(2).strip().rstrip(".")
-                return f"Image {idx}: {desc}" if desc else f"Image {idx}"
-            
-            # Try Figure pattern
-            m = figure_pattern.match(text)
-            if m:
-                idx = int(m.group(1))
-                desc = m.group(2).strip().rstrip(".")
-                return f"Figure {idx}: {desc}" if desc else f"Figure {idx}"
-            
-            # Look for descriptive patterns without numbers
-            descriptive_patterns = [
-                r'([^.]+\s+example\s*[^.]*)',
-                r'([^.]+\s+sheet\s*[^.]*)',
-                r'([^.]+\s+form\s*[^.]*)',
-                r'([^.]+\s+format\s*[^.]*)',
-                r'([^.]+\s+setup\s*[^.]*)',
-                r'([^.]+\s+process\s*[^.]*)',
-                r'([^.]+\s+workflow\s*[^.]*)',
-                r'([^.]+\s+template\s*[^.]*)'
-            ]
-            
-            for pattern in descriptive_patterns:
-                match = re.search(pattern, text, re.IGNORECASE)
-                if match:
-                    desc = match.group(1).strip()
-                    if len(desc) > 5 and len(desc) < 80:  # Reasonable caption length
-                        return desc
-            
-            return None
+def iter_docx_blocks(doc, body_images=None):
+    """Walk the document body once, yielding blocks in document order.
 
-        def extract_images_with_enhanced_labels():
-            """Extract images with sophisticated caption matching"""
-            nonlocal image_counter
-            
-            # Collect all document items in order
-            items = []
-            body = doc.element.body
-            position = 0
-            
-            for child in body.iterchildren():
-                if isinstance(child, CT_P):
-                    para = Paragraph(child, doc)
-                    
-                    # Check for images in paragraph
-                    has_image = False
-                    for run in para.runs:
-                        if 'graphic' in run._element.xml:
-                            for drawing in run._element.findall(".//w:drawing", namespaces=run._element.nsmap):
-                                for blip in drawing.findall(".//a:blip", namespaces=run._element.nsmap):
-                                    rel_id = blip.get(qn('r:embed'))
-                                    if rel_id and rel_id in doc.part.related_parts:
-                                        image_part = doc.part.related_parts[rel_id]
-                                        items.append({
-                                            'type': 'image', 
-                                            'content': image_part, 
-                                            'position': position,
-                                            'paragraph_text': para.text.strip(),
-                                            'element': child
-                                        })
-                                        has_image = True
-                    
-                    # Add text if it exists and doesn't have images
-                    if para.text.strip() and not has_image:
-                        items.append({
-                            'type': 'text', 
-                            'content': para.text.strip(), 
-                            'position': position
-                        })
-                        
-                elif isinstance(child, CT_Tbl):
-                    table = Table(child, doc)
-                    for row in table.rows:
-                        for cell in row.cells:
-                            for para in cell.paragraphs:
-                                # Check for images in table cells
-                                for run in para.runs:
-                                    if 'graphic' in run._element.xml:
-                                        for drawing in run._element.findall(".//w:drawing", namespaces=run._element.nsmap):
-                                            for blip in drawing.findall(".//a:blip", namespaces=run._element.nsmap):
-                                                rel_id = blip.get(qn('r:embed'))
-                                                if rel_id and rel_id in doc.part.related_parts:
-                                                    image_part = doc.part.related_parts[rel_id]
-                                                    items.append({
-                                                        'type': 'image', 
-                                                        'content': image_part, 
-                                                        'position': position,
-                                                        'paragraph_text': para.text.strip(),
-                                                        'element': para._element
-                                                    })
-                
-                position += 1
+    Every body element gets a position (its index in the body).  Yields
+    'image' blocks for each embedded picture (with the text of the paragraph
+    holding it), then a 'paragraph' or 'table' block carrying the element's
+    text.  Paragraphs that hold an image are flagged with has_image so they
+    are not used as captions for other images.
+    """
+    if body_images is None:
+        body_images = find_body_images(doc)
+    
+    for position, child in enumerate(doc.element.body.iterchildren()):
+        for block in element_blocks(doc, child, body_images.get(child, [])):
+            block['position'] = position
+            yield block
 
-            # Process images with enhanced caption matching
-            images = []
-            i = 0
-            
-            while i < len(items):
-                if items[i]['type'] == 'image':
-                    image_part = items[i]['content']
-                    
-                    # Look for caption in multiple places
-                    label = None
-                    
-                    # 1. Check if the image's paragraph contains caption text
-                    if items[i].get('paragraph_text'):
-                        potential_label = extract_label(items[i]['paragraph_text'])
-                        if potential_label:
-                            label = potential_label
-                    
-                    # 2. Look ahead for following caption
-                    if not label:
-                        for j in range(i + 1, min(i + 4, len(items))):  # Look ahead up to 3 items
-                            if items[j]['type'] == 'text':
-                                potential_label = extract_label(items[j]['content'])
-                                if potential_label:
-                                    label = potential_label
-                                    break
-                    
-                    # 3. Look behind for preceding caption
-                    if not label:
-                        for j in range(max(0, i - 3), i):  # Look behind up to 3 items
-                            if items[j]['type'] == 'text':
-                                potential_label = extract_label(items[j]['content'])
-                                if potential_label:
-                                    label = potential_label
-                                    break
-                    
-                    # Default label if none found
-                    if not label:
-                        label = f"Image {image_counter}"
-                    
-                    # Save image file
-                    image_extension = image_part.content_type.split('/')[-1]
-                    if image_extension == 'jpeg':
-                        image_extension = 'jpg'
-                    elif image_extension not in ['jpg', 'png', 'gif', 'bmp', 'webp']:
-                        image_extension = 'png'  # Default fallback
-                        
-                    image_filename = f"image_{image_counter}.{image_extension}"
-                    image_path = os.path.join(temp_image_dir, image_filename)
-                    
-                    with open(image_path, "wb") as f:
-                        f.write(image_part.blob)
-                    
-                    images.append({
-                        'filename': image_filename,
-                        'path': image_path,
-                        'label': label,
-                        'number': image_counter,
-                        'position': items[i]['position']
-                    })
-                    
-                    image_counter += 1
-                    
-                i += 1
-            
-            return images
+def element_key(child, child_images, stored_images):
+    """Content hash of a body element, including the bytes of its images"""
+    digest = hashlib.sha1(etree.tostring(child))
+    for image_part, _ in child_images:
+        digest.update(stored_images[str(image_part.partname)]['hash'].encode('ascii'))
+    return digest.hexdigest()
+
+class BlockCache:
+    """Extracted blocks of a document's body elements, keyed by element hash.
+
+    Blocks are stored without positions, together with the context they set
+    and their caption labels once computed, all of which depend only on the
+    element's content.  A cache made with revision() looks elements up in
+    the previous document's cache first, so re-ingesting an edited document
+    only parses and scans the elements that changed.
+    """
+
+    def __init__(self, entries=None, previous=None):
+        self.entries = entries if entries is not None else {}
+        self.previous = previous
+        self.hits = 0
+        self.misses = 0
+
+    def revision(self):
+        """Empty cache for the next revision of this document"""
+        return BlockCache(previous=self)
+
+    def get(self, key):
+        blocks = self.entries.get(key)
+        if blocks is None and self.previous is not None:
+            blocks = self.previous.entries.get(key)
+            if blocks is not None:
+                self.entries[key] = blocks
+        if blocks is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return blocks
+
+    def put(self, key, blocks):
+        self.entries[key] = blocks
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'entries': self.entries}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f)['entries'])
+
+# Images within this many positions of a chunk's range are attached to it,
+# and each image looks this many caption items ahead and behind for a label
+IMAGE_WINDOW = 3
+
+# Headers and footers are given fixed positions outside the body
+HEADER_POSITION = -1
+FOOTER_POSITION = 999
+
+def iter_chunks_docx(file_content, chunk_size=800, image_store=None, block_cache=None):
+    """Chunk a DOCX file, yielding each chunk as soon as it is complete.
+
+    Produces the same chunks as enhanced_chunk_docx, but only keeps the
+    text of the open chunk and a small window of images around the current
+    position: images are labeled once IMAGE_WINDOW caption items after them
+    have been seen, and a chunk is yielded once every image that can attach
+    to it is labeled.  With a block_cache, elements already in it are not
+    parsed again.  Errors are raised to the caller.
+    """
+    # Create document from uploaded content
+    doc = Document(io.BytesIO(file_content))
+    
+    if image_store is None:
+        image_store = get_default_image_store()
+    
+    # Images already in the store (e.g. from an earlier revision) are not written again
+    body_images = find_body_images(doc)
+    image_parts = [image_part for images in body_images.values() for image_part, _ in images]
+    stored_images = image_store.add_images(image_parts) if image_parts else {}
+    
+    current_chunk = ""
+    chunk_id = 0
+    image_counter = 1
+    current_position = 0
+    current_context = {'state': None, 'section': None, 'topic': None}
+    
+    recent_items = deque(maxlen=IMAGE_WINDOW)  # Caption candidates behind the cursor
+    pending_images = deque()  # Images still collecting caption items ahead
+    image_window = []  # Labeled images that can still attach to a chunk
+    closed_chunks = deque()  # Chunks waiting for their images to be labeled
+    
+    def update_context(context):
+        """Update current context with what a text block sets"""
+        state, section, topic = context
+        if state:
+            current_context['state'] = state
+        if section:
+            current_context['section'] = section
+        if topic:
+            current_context['topic'] = topic
+    
+    def parse_element(child, child_images):
+        """Blocks of one element, with image parts resolved to stored images"""
+        blocks = []
+        for block in element_blocks(doc, child, child_images):
+            if block['type'] == 'image':
+                stored = stored_images[str(block.pop('content').partname)]
+                block['filename'] = stored['filename']
+                block['hash'] = stored['hash']
+            blocks.append(block)
+        return blocks
+    
+    def label_for(block, field='text', cache_key='label'):
+        # Each text item is checked by up to six neighbouring images; the
+        # label is kept on the block so a block cache carries it over
+        if cache_key not in block:
+            block[cache_key] = extract_label(block[field])
+        return block[cache_key]
+    
+    def add_caption_item(item):
+        """Feed one caption candidate (text or image) through the lookahead"""
+        for pending in pending_images:
+            pending['ahead'].append(item)
+        while pending_images and len(pending_images[0]['ahead']) >= IMAGE_WINDOW:
+            label_image(pending_images.popleft())
         
-        def process_table(table):
-            """Extract table content"""
-            table_text = []
-            for row in table.rows:
-                row_text = []
-                for cell in row.cells:
-                    cell_text = ' '.join(p.text.strip() for p in cell.paragraphs if p.text.strip())
-                    if cell_text:
-                        row_text.append(cell_text)
-                if row_text:
-                    table_text.append(' | '.join(row_text))
-            return '\n'.join(table_text)
+        if item['type'] == 'image':
+            pending_images.append({'item': item, 'behind': list(recent_items), 'ahead': []})
+        recent_items.append(item)
+    
+    def label_image(pending):
+        """Label an image using captions from neighbouring text items"""
+        nonlocal image_counter
+        item = pending['item']
+        block = item['block']
         
-        # Extract all images with enhanced labels first
-        all_images = extract_images_with_enhanced_labels()
+        # Look for caption in multiple places
+        label = None
         
-        # Process document body elements in order
-        all_content = []
-        position = 0
+        # 1. Check if the image's paragraph contains caption text
+        if block.get('paragraph_text'):
+            label = label_for(block, 'paragraph_text', 'paragraph_label')
         
-        # Process paragraphs and tables
-        for element in doc.element.body:
-            if element.tag.endswith('p'):
-                # Paragraph
-                para = next(p for p in doc.paragraphs if p._element == element)
-                text = para.text.strip()
-                if text:
-                    all_content.append({
-                        'type': 'paragraph',
-                        'text': text,
-                        'position': position
-                    })
-            elif element.tag.endswith('tbl'):
-                # Table
-                table = next(t for t in doc.tables if t._element == element)
-                table_text = process_table(table)
-                if table_text:
-                    all_content.append({
-                        'type': 'table',
-                        'text': table_text,
-                        'position': position
-                    })
-            position += 1
+        # 2. Look ahead for following caption
+        if not label:
+            for neighbour in pending['ahead']:
+                if neighbour['type'] != 'image':
+                    label = label_for(neighbour)
+                    if label:
+                        break
         
-        # Also check headers and footers
-        for section in doc.sections:
-            # Headers
-            if section.header:
-                for para in section.header.paragraphs:
-                    text = para.text.strip()
-                    if text:
-                        all_content.insert(0, {
-                            'type': 'header',
-                            'text': text,
-                            'position': -1  # Headers come first
-                        })
-            
-            # Footers
-            if section.footer:
-                for para in section.footer.paragraphs:
-                    text = para.text.strip()
-                    if text:
-                        all_content.append({
-                            'type': 'footer',
-                            'text': text,
-                            'position': 999  # Footers come last
-                        })
+        # 3. Look behind for preceding caption
+        if not label:
+            for neighbour in pending['behind']:
+                if neighbour['type'] != 'image':
+                    label = label_for(neighbour)
+                    if label:
+                        break
         
-        # Create image lookup by position for efficient matching
-        image_by_position = {}
-        for img in all_images:
-            pos = img.get('position', 0)
-            if pos not in image_by_position:
-                image_by_position[pos] = []
-            image_by_position[pos].append(img)
+        # Default label if none found
+        if not label:
+            label = f"Image {image_counter}"
         
-        # Create chunks with strict position-based image attachment
-        chunk_ranges = []  # Track [start_pos, end_pos] for each chunk
-        current_position = 0
+        image_window.append({
+            'filename': block['filename'],
+            'hash': block['hash'],
+            'label': label,
+            'number': image_counter,
+            'position': item['position']
+        })
+        image_counter += 1
+    
+    def close_chunk(start_pos, end_pos):
+        """Finish the open chunk; images are attached once they are labeled"""
+        nonlocal chunk_id, current_chunk
+        closed_chunks.append({
+            'chunk_id': chunk_id,
+            'text': current_chunk.strip(),
+            'images': [],  # Filled in by attach_images
+            'start_pos': start_pos,
+            'end_pos': end_pos,
+            'metadata': {
+                'states': [current_context['state']] if current_context['state'] else [],
+                'sections': [current_context['section']] if current_context['section'] else [],
+                'topics': [current_context['topic']] if current_context['topic'] else [],
+                'word_count': len(current_chunk.split()),
+                'has_images': False,
+                'image_count': 0
+            }
+        })
+        chunk_id += 1
+        current_chunk = ""
+    
+    def add_content(text, content_position, context):
+        nonlocal current_chunk, current_position
         
-        for content in all_content:
-            text = content['text']
-            content_position = content.get('position', current_position)
-            
-            if not text:
-                continue
-            
-            # Update context
-            update_context(text)
-            
-            # If adding this text would exceed chunk size, save current chunk
-            if len(current_chunk) + len(text) > chunk_size and current_chunk:
-                # Record the position range for this chunk
-                chunk_ranges.append([current_position - 10, current_position])  # Rough range
-                
-                chunks.append({
-                    'chunk_id': chunk_id,
-                    'text': current_chunk.strip(),
-                    'images': [],  # Will be filled in next step
-                    'start_pos': current_position - 10,
-                    'end_pos': current_position,
-                    'metadata': {
-                        'states': [current_context['state']] if current_context['state'] else [],
-                        'sections': [current_context['section']] if current_context['section'] else [],
-                        'topics': [current_context['topic']] if current_context['topic'] else [],
-                        'word_count': len(current_chunk.split()),
-                        'has_images': False,
-                        'image_count': 0
-                    }
-                })
-                chunk_id += 1
-                current_chunk = ""
-            
-            current_chunk += text + " "
-            current_position = content_position
+        # Update context
+        update_context(context)
         
-        # Add final chunk
-        if current_chunk.strip():
-            chunks.append({
-                'chunk_id': chunk_id,
-                'text': current_chunk.strip(),
-                'images': [],
-                'start_pos': current_position - 10,
-                'end_pos': current_position + 10,
-                'metadata': {
-                    'states': [current_context['state']] if current_context['state'] else [],
-                    'sections': [current_context['section']] if current_context['section'] else [],
-                    'topics': [current_context['topic']] if current_context['topic'] else [],
-                    'word_count': len(current_chunk.split()),
-                    'has_images': False,
-                    'image_count': 0
-                }
-            })
+        # If adding this text would exceed chunk size, save current chunk
+        if len(current_chunk) + len(text) > chunk_size and current_chunk:
+            close_chunk(current_position - 10, current_position)  # Rough range
         
-        # Now assign images to chunks based on strict document position adjacency
-        for chunk in chunks:
-            chunk_images = []
-            start_pos = chunk.get('start_pos', 0)
-            end_pos = chunk.get('end_pos', 999)
-            
-            # Find images that are immediately before, within, or after this chunk
-            # Check positions: [start-3, start-2, start-1, start...end, end+1, end+2, end+3]
-            for check_pos in range(start_pos - 3, end_pos + 4):
-                if check_pos in image_by_position:
-                    chunk_images.extend(image_by_position[check_pos])
-            
-            # Sort images by their document position to maintain order
-            chunk_images.sort(key=lambda x: x.get('position', 0))
+        current_chunk += text + " "
+        current_position = content_position
+    
+    def attach_images(chunk):
+        """Assign images by strict document position adjacency"""
+        start_pos = chunk.pop('start_pos')
+        end_pos = chunk.pop('end_pos')
+        
+        # Find images that are immediately before, within, or after this chunk
+        chunk_images = [img for img in image_window
+                        if start_pos - IMAGE_WINDOW <= img['position'] <= end_pos + IMAGE_WINDOW]
+        
+        # Sort images by their document position to maintain order
+        chunk_images.sort(key=lambda x: x['position'])
+        
+        chunk['images'] = chunk_images
+        chunk['metadata']['has_images'] = len(chunk_images) > 0
+        chunk['metadata']['image_count'] = len(chunk_images)
+        return chunk
+    
+    def ready_chunks(labeled_through):
+        """Pop closed chunks whose images are all labeled"""
+        while closed_chunks and closed_chunks[0]['end_pos'] + IMAGE_WINDOW <= labeled_through:
+            yield attach_images(closed_chunks.popleft())
+        
+        # Later chunks start at or after the current position (less the
+        # rough 10-position range), so older images can be dropped.  Images
+        # near FOOTER_POSITION are kept for chunks made of footers.
+        lowest = current_position - 10
+        if closed_chunks:
+            lowest = min(lowest, closed_chunks[0]['start_pos'])
+        image_window[:] = [img for img in image_window
+                           if img['position'] >= lowest - IMAGE_WINDOW
+                           or abs(img['position'] - FOOTER_POSITION) <= 10 + IMAGE_WINDOW]
+    
+    # Headers come first; each one is placed in front of the previous ones
+    headers = []
+    for section in doc.sections:
+        if section.header:
+            for para in section.header.paragraphs:
+                text = para.text.strip()
+                if text:
+                    headers.insert(0, text)
+    for text in headers:
+        add_content(text, HEADER_POSITION, detect_context(text))
+    
+    # Single pass over the body: paragraphs, tables and images in order
+    for position, child in enumerate(doc.element.body.iterchildren()):
+        child_images = body_images.get(child, [])
+        if block_cache is None:
+            blocks = parse_element(child, child_images)
+        else:
+            key = element_key(child, child_images, stored_images)
+            blocks = block_cache.get(key)
+            if blocks is None:
+                blocks = parse_element(child, child_images)
+                block_cache.put(key, blocks)
+        
+        for block in blocks:
+            if block['type'] == 'image':
+                add_caption_item({'type': 'image', 'block': block, 'position': position})
+                continue
             
-            # Update chunk with images
-            chunk['images'] = chunk_images
-            chunk['metadata']['has_images'] = len(chunk_images) > 0
-            chunk['metadata']['image_count'] = len(chunk_images)
+            if block['text']:
+                # Paragraphs holding an image are not caption candidates
+                if block['type'] == 'paragraph' and not block['has_image']:
+                    add_caption_item(block)
+                if 'context' not in block:
+                    block['context'] = detect_context(block['text'])
+                add_content(block['text'], position, block['context'])
             
-            # Clean up temporary position fields
-            if 'start_pos' in chunk:
-                del chunk['start_pos']
-            if 'end_pos' in chunk:
-                del chunk['end_pos']
-        
-        return chunks
+            # Every image up to this element has been seen; those still
+            # waiting for captions ahead are not labeled yet
+            labeled_through = position
+            if pending_images:
+                labeled_through = pending_images[0]['item']['position'] - 1
+            yield from ready_chunks(labeled_through)
+    
+    # End of body: remaining images label with what they have
+    while pending_images:
+        label_image(pending_images.popleft())
+    
+    # Footers come last
+    for section in doc.sections:
+        if section.footer:
+            for para in section.footer.paragraphs:
+                text = para.text.strip()
+                if text:
+                    add_content(text, FOOTER_POSITION, detect_context(text))
+    
+    # Add final chunk
+    if current_chunk.strip():
+        close_chunk(current_position - 10, current_position + 10)
+    
+    while closed_chunks:
+        yield attach_images(closed_chunks.popleft())
+
+def chunk_content(chunk):
+    """What a chunk contributes to search and answers.
+
+    Leaves out image positions and numbers, which shift whenever content is
+    inserted or removed earlier in the document.
+    """
+    return (
+        chunk['text'],
+        chunk.get('metadata'),
+        [(img.get('filename'), img.get('label')) for img in chunk.get('images', [])]
+    )
+
+def diff_chunks(old_chunks, new_chunks):
+    """Give a re-ingested document's chunks stable ids and list the changes.
+
+    Chunks are aligned with the previous corpus by text.  Aligned chunks
+    keep their old chunk_id, chunks that replace others in place take over
+    their ids, and the rest get ids after the highest old one.  Returns
+    (new_chunks, changes) where changes maps 'added', 'removed' and
+    'modified' to lists of chunk ids; chunks in none of them have the same
+    chunk_content as before.
+    """
+    matcher = difflib.SequenceMatcher(None, [chunk['text'] for chunk in old_chunks],
+                                      [chunk['text'] for chunk in new_chunks], autojunk=False)
+    next_id = max((chunk['chunk_id'] for chunk in old_chunks), default=-1) + 1
+    changes = {'added': [], 'removed': [], 'modified': []}
+    
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        paired = min(i2 - i1, j2 - j1)
+        for old, new in zip(old_chunks[i1:i1 + paired], new_chunks[j1:j1 + paired]):
+            new['chunk_id'] = old['chunk_id']
+            # Equal text can still come with different images or metadata
+            if chunk_content(new) != chunk_content(old):
+                changes['modified'].append(new['chunk_id'])
+        for old in old_chunks[i1 + paired:i2]:
+            changes['removed'].append(old['chunk_id'])
+        for new in new_chunks[j1 + paired:j2]:
+            new['chunk_id'] = next_id
+            changes['added'].append(next_id)
+            next_id += 1
+    
+    return new_chunks, changes
+
+def enhanced_chunk_docx(file_content, chunk_size=800, image_store=None, block_cache=None):
+    """Enhanced DOCX chunker with complete content extraction.
+
+    Images are registered in the content-addressed image store and only
+    written to disk when first requested.  Pass block_cache (see
+    BlockCache.revision) to reuse the parsing of unchanged elements.
+    """
+    try:
+        return list(iter_chunks_docx(file_content, chunk_size, image_store, block_cache))
         
     except Exception as e:
         print(f"Error processing document: {e}")
         print(traceback.format_exc())
-        return []
\ No newline at end of file
+        return []
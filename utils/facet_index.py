@@ -0,0 +1,139 @@
+FACET_FIELDS = ('states', 'sections', 'topics')
+FILTER_FIELDS = FACET_FIELDS + ('has_images',)
+
+
+def popcount(bitmap):
+    return bin(bitmap).count('1')
+
+
+def bitmap_from_positions(positions, size):
+    """Bitmap with the bits of the given chunk positions set"""
+    data = bytearray((size + 7) // 8)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+def bitmap_positions(bitmap):
+    """Sorted chunk positions whose bits are set"""
+    positions = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for i, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            positions.append(i * 8 + low.bit_length() - 1)
+            byte ^= low
+    return positions
+
+
+def parse_filters(raw):
+    """Normalize filters from a request into {field: [values]} / {'has_images': bool}.
+
+    Values may be a list or a comma-separated string; a value starting with
+    '-' excludes chunks that have it.  Raises ValueError for unknown fields.
+    """
+    if raw is None:
+        return {}
+    if not isinstance(raw, dict):
+        raise ValueError("Filters must map fields to values")
+    filters = {}
+    for field, values in raw.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter '{field}'. Use one of: {', '.join(FILTER_FIELDS)}")
+        if field == 'has_images':
+            if isinstance(values, str):
+                values = values.lower() in ('1', 'true', 'yes')
+            filters[field] = bool(values)
+            continue
+        if isinstance(values, str):
+            values = values.split(',')
+        elif not isinstance(values, (list, tuple)):
+            values = [values]
+        values = [str(value).strip() for value in values if str(value).strip()]
+        if values:
+            filters[field] = values
+    return filters
+
+
+class FacetIndex:
+    """Metadata facets as bitmaps over chunk positions, built once per corpus.
+
+    Each (field, value) maps to a Python int whose bit i is set when chunk
+    i has that value, so filters combine with &, | and ~ over the whole
+    corpus at once, and facet counts are popcounts of an AND.
+    """
+
+    def __init__(self, chunks):
+        self.size = len(chunks)
+        self.all = (1 << self.size) - 1
+        self.bitmaps = {field: {} for field in FACET_FIELDS}
+
+        positions = {field: {} for field in FACET_FIELDS}
+        image_positions = []
+        for position, chunk in enumerate(chunks):
+            metadata = chunk.get('metadata', {})
+            for field in FACET_FIELDS:
+                for value in metadata.get(field, []):
+                    positions[field].setdefault(value, []).append(position)
+            if metadata.get('has_images'):
+                image_positions.append(position)
+
+        for field, values in positions.items():
+            for value, value_positions in values.items():
+                self.bitmaps[field][value] = bitmap_from_positions(value_positions, self.size)
+        self.image_bitmap = bitmap_from_positions(image_positions, self.size)
+
+    def __len__(self):
+        return self.size
+
+    def bitmap(self, field, value):
+        if field == 'has_images':
+            return self.image_bitmap if value else self.all & ~self.image_bitmap
+        return self.bitmaps.get(field, {}).get(value, 0)
+
+    def select(self, filters):
+        """Bitmap of chunks matching parsed filters.
+
+        Values of one field are ORed, fields are ANDed, and '-' values are
+        subtracted: {'states': ['NJ', 'MD'], 'topics': ['-PRICING']} is
+        (NJ or MD) and not PRICING.
+        """
+        selected = self.all
+        for field, values in filters.items():
+            if field == 'has_images':
+                selected &= self.bitmap(field, values)
+                continue
+            included = [value for value in values if not value.startswith('-')]
+            if included:
+                any_of = 0
+                for value in included:
+                    any_of |= self.bitmap(field, value)
+                selected &= any_of
+            for value in values:
+                if value.startswith('-'):
+                    selected &= ~self.bitmap(field, value[1:])
+        return selected
+
+    def positions(self, bitmap):
+        return bitmap_positions(bitmap)
+
+    def counts(self, bitmap=None):
+        """Facet counts within bitmap (default: the whole corpus), non-zero only"""
+        if bitmap is None:
+            bitmap = self.all
+        counts = {}
+        for field, values in self.bitmaps.items():
+            field_counts = {}
+            for value, value_bitmap in values.items():
+                count = popcount(value_bitmap & bitmap)
+                if count:
+                    field_counts[value] = count
+            counts[field] = field_counts
+        counts['has_images'] = popcount(self.image_bitmap & bitmap)
+        counts['total'] = popcount(bitmap)
+        return counts
+
+
+def build_facet_index(chunks):
+    """Build a FacetIndex for a chunk list"""
+    return FacetIndex(chunks)
@@ -1,54 +1,282 @@
-import requests
+import os
 import json
-import base64
+import codecs
+import hashlib
+import threading
+from collections import OrderedDict
+
+from utils.disk_lru import DiskLRU, write_file, touch, scan_files
+
+GITHUB_API_URL = 'https://api.github.com'
+
+# Raw media type: the contents API streams the file itself instead of
+# base64 inside JSON, and keeps working past the 1 MB inline-content limit
+RAW_MEDIA_TYPE = 'application/vnd.github.raw'
+
+NUMBER_CHARS = '0123456789.eE+-'
+
+def iter_json_array(text_chunks):
+    """Yield the items of a JSON array as the text arrives.
+    
+    text_chunks is an iterable of str pieces of one JSON document that must
+    be an array; items are decoded with raw_decode as soon as they are
+    complete, so the whole file is never held as a single string.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    started = False
+    expect_item = True
+    after_comma = False
+    pieces = iter(text_chunks)
+    
+    while True:
+        # Skip whitespace and separators
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+            pos += 1
+        if pos < len(buffer):
+            char = buffer[pos]
+            if not started:
+                if char != '[':
+                    raise ValueError("Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if char == ']':
+                if after_comma:
+                    raise ValueError("Trailing ',' in JSON array")
+                return
+            if not expect_item:
+                if char != ',':
+                    raise ValueError("Expected ',' or ']' in JSON array")
+                expect_item = True
+                after_comma = True
+                pos += 1
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                item, end = None, None  # Item not complete yet
+            # A number at the end of the buffer, or cut inside its fraction
+            # or exponent, may still be growing
+            if (end is not None and end < len(buffer)
+                    and not (isinstance(item, (int, float)) and buffer[end] in NUMBER_CHARS)):
+                yield item
+                pos = end
+                expect_item = False
+                after_comma = False
+                continue
+        
+        piece = next(pieces, None)
+        if piece is None:
+            raise ValueError("Unexpected end of JSON array")
+        # Drop what has been consumed before growing the buffer
+        buffer = buffer[pos:] + piece
+        pos = 0
+
 
 class GitHubClient:
-    def __init__(self):
-        pass
+    """Loads chunk files from GitHub with conditional, cached requests.
     
-    def fetch_chunks(self, owner, repo, file_path, token):
+    Parsed chunk lists are cached per (owner, repo, path, ref) together with
+    the ETag they were served with.  Later loads send If-None-Match, and a
+    304 reuses the cached chunks without downloading or parsing anything
+    (conditional requests that return 304 also do not count against the
+    GitHub rate limit).  Files are fetched with the raw media type and
+    parsed incrementally while they stream in.  The disk tier is bounded by
+    max_disk_bytes, removing the least recently used files first.
+    """
+    
+    def __init__(self, base_url=GITHUB_API_URL, cache_dir=None, max_entries=16,
+                 max_disk_bytes=64 * 1024 * 1024, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._session = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'not_modified': 0, 'downloads': 0, 'disk_evictions': 0}
+        # A body and its ETag share a digest and are evicted together
+        self._disk = DiskLRU(lambda: scan_files(self.cache_dir), max_disk_bytes, group=self._digest_of)
+        
+        if self.cache_dir:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+            except OSError:
+                self.cache_dir = None
+    
+    @property
+    def session(self):
+        # requests is only imported once GitHub is actually used
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+    
+    def fetch_chunks(self, owner, repo, file_path, token, ref=None):
         """Fetch chunks from GitHub repository"""
+        key = (owner, repo, file_path, ref or '')
+        cached = self._get_cached(key)
+        
         try:
             # GitHub API URL for file content
-            url = f"https://api.github.com/repos/{owner}/{repo}/contents/{file_path}"
+            url = f"{self.base_url}/repos/{owner}/{repo}/contents/{file_path}"
             
             headers = {
                 'Authorization': f'token {token}',
-                'Accept': 'application/vnd.github.v3+json'
+                'Accept': RAW_MEDIA_TYPE
             }
+            if cached:
+                headers['If-None-Match'] = cached['etag']
             
-            response = requests.get(url, headers=headers, timeout=30)
+            params = {'ref': ref} if ref else None
+            with self._lock:
+                self._stats['requests'] += 1
             
-            if response.status_code == 200:
-                data = response.json()
+            with self.session.get(url, headers=headers, params=params,
+                                  timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304 and cached:
+                    with self._lock:
+                        self._stats['not_modified'] += 1
+                    if self.cache_dir:
+                        touch(self._cache_path(key, 'etag'))
+                    return cached['chunks']
                 
-                # Decode base64 content
-                content = base64.b64decode(data['content']).decode('utf-8')
-                
-                # Parse JSON content
-                chunks = json.loads(content)
-                
-                # Validate chunks format
-                if isinstance(chunks, list) and all(isinstance(chunk, dict) for chunk in chunks):
-                    return chunks
-                else:
-                    print("Invalid chunks format in GitHub file")
+                if response.status_code != 200:
+                    print(f"Failed to fetch from GitHub: {response.status_code} - {response.text}")
                     return []
-            else:
-                print(f"Failed to fetch from GitHub: {response.status_code} - {response.text}")
-                return []
                 
+                with self._lock:
+                    self._stats['downloads'] += 1
+                etag = response.headers.get('ETag')
+                body_path = self._cache_path(key, 'body') if self.cache_dir and etag else None
+                chunks = self._parse_chunks(response, body_path)
+            
+            if chunks and etag:
+                self._put_cached(key, etag, chunks, body_path)
+            return chunks
+        
         except Exception as e:
             print(f"Error fetching from GitHub: {str(e)}")
             return []
     
+    def _parse_chunks(self, response, body_path=None):
+        """Parse a streamed chunks file, validating items as they arrive.
+        
+        With body_path, the raw bytes are also written to a temp file next to
+        it, so the disk cache stores the file as downloaded.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        sink = None
+        if body_path:
+            try:
+                sink = open(f"{body_path}.{os.getpid()}.tmp", 'wb')
+            except OSError as e:
+                print(f"Error writing GitHub cache entry: {e}")
+        
+        def text_chunks():
+            for data in response.iter_content(chunk_size=64 * 1024):
+                if sink:
+                    sink.write(data)
+                yield decoder.decode(data)
+        
+        chunks = []
+        complete = False
+        try:
+            for chunk in iter_json_array(text_chunks()):
+                # Validate chunks format
+                if not isinstance(chunk, dict):
+                    print("Invalid chunks format in GitHub file")
+                    chunks = []
+                    break
+                chunks.append(chunk)
+            complete = bool(chunks)
+        finally:
+            if sink:
+                sink.close()
+                if not complete:
+                    os.remove(sink.name)
+        return chunks
+    
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached_files'] = len(self._cache)
+        return stats
+    
+    def _cache_path(self, key, kind):
+        """Disk cache file for a key: 'body' holds the file, 'etag' its ETag"""
+        digest = hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.{kind}")
+    
+    @staticmethod
+    def _digest_of(path):
+        return os.path.basename(path).split('.', 1)[0]
+    
+    def _get_cached(self, key):
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(key, 'etag'), 'r', encoding='utf-8') as f:
+                etag = f.read().strip()
+            with open(self._cache_path(key, 'body'), 'r', encoding='utf-8') as f:
+                chunks = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not etag or not isinstance(chunks, list):
+            return None
+        touch(self._cache_path(key, 'etag'))
+        cached = {'etag': etag, 'chunks': chunks}
+        self._remember(key, cached)
+        return cached
+    
+    def _put_cached(self, key, etag, chunks, body_path=None):
+        self._remember(key, {'etag': etag, 'chunks': chunks})
+        if not body_path:
+            return
+        # The body was written while it streamed in; the ETag goes last so a
+        # partial entry is never used
+        etag_path = self._cache_path(key, 'etag')
+        try:
+            try:
+                replaced = os.path.getsize(body_path)
+            except OSError:
+                replaced = 0
+            os.replace(f"{body_path}.{os.getpid()}.tmp", body_path)
+            size = os.path.getsize(body_path) - replaced
+            size += write_file(etag_path, etag)
+        except OSError as e:
+            print(f"Error writing GitHub cache entry: {e}")
+            self._disk.forget()
+            return
+        
+        self._disk.added(size)
+        evicted = self._disk.evict(keep=self._digest_of(body_path))
+        if evicted:
+            with self._lock:
+                self._stats['disk_evictions'] += evicted
+    
+    def _remember(self, key, cached):
+        with self._lock:
+            self._cache[key] = cached
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+    
     def fetch_raw_file(self, owner, repo, file_path, token):
         """Fetch raw file content from GitHub"""
         try:
             # Use raw.githubusercontent.com for direct file access
             url = f"https://raw.githubusercontent.com/{owner}/{repo}/main/{file_path}"
             
-            response = requests.get(url, timeout=30)
+            response = self.session.get(url, timeout=30)
             
             if response.status_code == 200:
                 return response.text
@@ -58,4 +286,4 @@ class GitHubClient:
                 
         except Exception as e:
             print(f"Error fetching raw file: {str(e)}")
-            return None
\ No newline at end of file
+            return None
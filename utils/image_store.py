@@ -0,0 +1,217 @@
+import io
+import os
+import re
+import hashlib
+import threading
+
+from utils.disk_lru import DiskLRU, write_file, touch, scan_files
+
+IMAGE_EXTENSIONS = ('jpg', 'png', 'gif', 'bmp', 'webp')
+IMAGE_FILENAME_PATTERN = re.compile(r'^([0-9a-f]{32})\.(jpg|png|gif|bmp|webp)$')
+
+# Thumbnail widths that are generated; requests are snapped to one of these
+THUMBNAIL_WIDTHS = (160, 320, 640)
+PIL_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'gif': 'GIF', 'bmp': 'BMP', 'webp': 'WEBP'}
+
+
+_pil_image = False  # Not imported yet
+
+
+def pil_image():
+    """Pillow's Image module, imported on first use; None if Pillow is missing"""
+    global _pil_image
+    if _pil_image is False:
+        try:
+            from PIL import Image
+        except ImportError:  # Thumbnails fall back to the original image
+            Image = None
+        _pil_image = Image
+    return _pil_image
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def image_extension(content_type):
+    """File extension for an image part's content type"""
+    extension = content_type.split('/')[-1]
+    if extension == 'jpeg':
+        return 'jpg'
+    if extension not in IMAGE_EXTENSIONS:
+        return 'png'  # Default fallback
+    return extension
+
+
+class ImageStore:
+    """Content-addressed image store shared across uploads and sessions.
+
+    Images are named by the hash of their bytes, so a logo or screenshot
+    that appears in many documents (or SOP revisions) is stored once:
+    ingestion writes only the blobs that are not in the store yet.  Total
+    size of blobs and thumbnails is bounded, evicting the least recently
+    used files first.
+
+    Layout under root:
+        blobs/<hash>.<ext>    images
+        thumbs/<hash>_w<width>.<ext>  resized previews, generated once
+    """
+
+    def __init__(self, root='/tmp/image_store', max_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blobs_dir = os.path.join(root, 'blobs')
+        self.thumbs_dir = os.path.join(root, 'thumbs')
+        self._lock = threading.Lock()
+        # Thumbnails can be regenerated, so they are evicted before images
+        self._disk = DiskLRU(self._files, max_bytes,
+                             priority=lambda path: path.startswith(self.blobs_dir))
+        self._stats = {'stored_images': 0, 'reused_images': 0}
+
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        os.makedirs(self.thumbs_dir, exist_ok=True)
+
+    def add_images(self, image_parts):
+        """Store the images of a document, writing only blobs not stored yet.
+
+        image_parts is an iterable of python-docx image parts; returns
+        {partname: {'filename', 'hash'}} for each distinct part.
+        """
+        stored = {}
+        for image_part in image_parts:
+            partname = str(image_part.partname)
+            if partname in stored:
+                continue
+            blob = image_part.blob
+            digest = content_hash(blob)
+            filename = f"{digest}.{image_extension(image_part.content_type)}"
+            stored[partname] = {'filename': filename, 'hash': digest}
+
+            path = os.path.join(self.blobs_dir, filename)
+            if os.path.exists(path):
+                touch(path)
+                with self._lock:
+                    self._stats['reused_images'] += 1
+            else:
+                self._write_file(path, blob)
+                with self._lock:
+                    self._stats['stored_images'] += 1
+        return stored
+
+    def get_path(self, filename):
+        """Path of an image blob; None for unknown or invalid filenames"""
+        if not IMAGE_FILENAME_PATTERN.match(filename):
+            return None
+
+        path = os.path.join(self.blobs_dir, filename)
+        if not os.path.exists(path):
+            return None
+        touch(path)
+        return path
+
+    @staticmethod
+    def thumbnail_width(width):
+        """Snap a requested width to the smallest generated width that covers it"""
+        for candidate in THUMBNAIL_WIDTHS:
+            if width <= candidate:
+                return candidate
+        return THUMBNAIL_WIDTHS[-1]
+
+    @staticmethod
+    def etag(filename, width=None):
+        """Strong validator for an image or one of its thumbnails.
+
+        Filenames are content hashes, so the tag is known without touching
+        the store; returns None for invalid filenames.
+        """
+        match = IMAGE_FILENAME_PATTERN.match(filename)
+        if not match:
+            return None
+        if width is None or pil_image() is None:
+            return match.group(1)
+        return f"{match.group(1)}-w{width}"
+
+    def get_thumbnail_path(self, filename, width):
+        """Path of a thumbnail at most width pixels wide, generating it once.
+
+        width should come from thumbnail_width(). Images that are already
+        narrower, or that Pillow cannot read, are served as the original.
+        """
+        match = IMAGE_FILENAME_PATTERN.match(filename)
+        if not match:
+            return None
+        if pil_image() is None:
+            return self.get_path(filename)
+
+        digest, extension = match.groups()
+        path = os.path.join(self.thumbs_dir, f"{digest}_w{width}.{extension}")
+        if os.path.exists(path):
+            touch(path)
+            return path
+
+        source_path = self.get_path(filename)
+        if source_path is None:
+            return None
+        thumbnail = self._make_thumbnail(source_path, width, extension)
+        if thumbnail is None:
+            return source_path
+        self._write_file(path, thumbnail)
+        return path
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'images': len(os.listdir(self.blobs_dir)),
+            'thumbnails': len(os.listdir(self.thumbs_dir)),
+            'bytes': self._disk.total(),
+            'max_bytes': self.max_bytes
+        })
+        return stats
+
+    def _make_thumbnail(self, source_path, width, extension):
+        Image = pil_image()
+        try:
+            with Image.open(source_path) as image:
+                if image.width <= width:
+                    return None
+                height = max(1, round(image.height * width / image.width))
+                if extension == 'jpg' and image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                elif image.mode in ('1', 'P'):
+                    # Palette images only resize with nearest neighbour
+                    image = image.convert('RGBA')
+                resized = image.resize((width, height), Image.LANCZOS)
+                output = io.BytesIO()
+                resized.save(output, format=PIL_FORMATS[extension])
+                return output.getvalue()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error creating thumbnail for {source_path}: {e}")
+            return None
+
+    def _write_file(self, path, data):
+        try:
+            size = write_file(path, data)
+        except OSError as e:
+            print(f"Error writing image store file: {e}")
+            return
+        self._disk.added(size)
+        self._disk.evict(keep=path)
+
+    def _files(self):
+        """(mtime, size, path) for every stored file"""
+        return scan_files(self.thumbs_dir) + scan_files(self.blobs_dir)
+
+
+_default_store = None
+
+
+def get_default_image_store():
+    """Process-wide image store under IMAGE_STORE_DIR (default /tmp/image_store)"""
+    global _default_store
+    if _default_store is None:
+        _default_store = ImageStore(
+            root=os.environ.get('IMAGE_STORE_DIR', '/tmp/image_store'),
+            max_bytes=int(os.environ.get('IMAGE_STORE_MAX_BYTES', 256 * 1024 * 1024))
+        )
+    return _default_store
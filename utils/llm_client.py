@@ -1,17 +1,209 @@
-import requests
-from openai import OpenAI
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# openai (with httpx and pydantic) and requests are imported when the first
+# client is created; they dominate import time on a cold start
+
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash"
+SYSTEM_PROMPT = "You are a GTI SOP Assistant. Answer based ONLY on provided documentation."
+OPENAI_MODELS = {
+    "GPT-4": "gpt-4",
+    "GPT-4 Mini": "gpt-4o-mini"
+}
+# Model used when hedging or falling back to the other provider
+BACKUP_MODELS = {
+    'openai': "Gemini 2.0 Flash",
+    'gemini': "GPT-4 Mini"
+}
+
+# Failures are reported to the user as text starting with one of these
+ERROR_PREFIXES = ("Error", "⚠️")
+
+def is_error_response(text):
+    """True if a generated response is an error message rather than an answer"""
+    return not text or text.startswith(ERROR_PREFIXES)
+
+class LLMStreamError(Exception):
+    """A streamed response failed; any text yielded before it is incomplete"""
+
+class ResponseStream:
+    """Text deltas of a streamed response and the model producing them.
+
+    model starts as the requested model and changes if a fallback answers.
+    """
+    
+    def __init__(self, model, deltas):
+        self.model = model
+        self._deltas = deltas(self)
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        return next(self._deltas)
 
 class SimpleLLMClient:
-    def __init__(self):
+    """LLM client that keeps one pooled, keep-alive HTTP client per provider.
+
+    The clients are created once and shared across requests and threads, so
+    chat requests reuse warm TCP/TLS connections instead of opening new ones.
+    """
+    
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=30.0,
+                 write_timeout=10.0, pool_timeout=5.0, hedge=False, hedge_after=4.0):
         self.openai_key = ""
         self.gemini_key = ""
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.pool_timeout = pool_timeout
+        # Opt-in hedging: if the first provider has not answered within
+        # hedge_after seconds (its p95 budget), race the other provider
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        
+        self._lock = threading.Lock()
+        self._executor = None
+        self._openai_client = None
+        self._gemini_session = None
+        self._stats = {
+            'openai': {'clients_created': 0, 'requests': 0, 'connections_opened': 0},
+            'gemini': {'clients_created': 0, 'requests': 0},
+            'hedging': {'hedged_requests': 0, 'hedges_fired': 0, 'fallbacks': 0, 'backup_wins': 0}
+        }
     
     def setup_keys(self, openai_key, gemini_key):
-        self.openai_key = openai_key
-        self.gemini_key = gemini_key
+        """Set provider keys; the OpenAI client is only rebuilt if its key changes"""
+        with self._lock:
+            if openai_key != self.openai_key and self._openai_client is not None:
+                self._openai_client.close()
+                self._openai_client = None
+            self.openai_key = openai_key
+            self.gemini_key = gemini_key
+    
+    def _count(self, provider, key, amount=1):
+        with self._lock:
+            self._stats[provider][key] += amount
+    
+    def _trace_openai_connection(self, event_name, info):
+        # httpcore trace hook: fires once per newly opened connection
+        if event_name == 'connection.connect_tcp.started':
+            self._count('openai', 'connections_opened')
+    
+    def _on_openai_request(self, request):
+        self._count('openai', 'requests')
+        request.extensions['trace'] = self._trace_openai_connection
+    
+    def _get_openai_client(self):
+        client = self._openai_client
+        if client is None:
+            with self._lock:
+                client = self._openai_client
+                if client is None:
+                    import httpx
+                    from openai import OpenAI
+                    http_client = httpx.Client(
+                        limits=httpx.Limits(
+                            max_connections=self.pool_size,
+                            max_keepalive_connections=self.pool_size
+                        ),
+                        timeout=httpx.Timeout(
+                            self.read_timeout,
+                            connect=self.connect_timeout,
+                            write=self.write_timeout,
+                            pool=self.pool_timeout
+                        ),
+                        event_hooks={'request': [self._on_openai_request]}
+                    )
+                    client = OpenAI(api_key=self.openai_key, http_client=http_client)
+                    self._openai_client = client
+                    self._stats['openai']['clients_created'] += 1
+        return client
+    
+    def _get_gemini_session(self):
+        session = self._gemini_session
+        if session is None:
+            with self._lock:
+                session = self._gemini_session
+                if session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._gemini_session = session
+                    self._stats['gemini']['clients_created'] += 1
+        return session
     
-    def generate_response(self, model, context, temperature=0.1):
+    @property
+    def _gemini_timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+    
+    def get_stats(self):
+        """Pool configuration and connection reuse statistics per provider"""
+        with self._lock:
+            openai_stats = dict(self._stats['openai'])
+            gemini_stats = dict(self._stats['gemini'])
+            hedging_stats = dict(self._stats['hedging'])
+            hedging_stats['enabled'] = self.hedge
+            hedging_stats['hedge_after'] = self.hedge_after
+        
+        openai_stats['connections_reused'] = max(
+            openai_stats['requests'] - openai_stats['connections_opened'], 0
+        )
+        
+        # urllib3 counts requests and new connections per host pool
+        gemini_stats['connections_opened'] = 0
+        gemini_requests = 0
+        if self._gemini_session is not None:
+            for adapter in set(self._gemini_session.adapters.values()):
+                for key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is not None:
+                        gemini_stats['connections_opened'] += pool.num_connections
+                        gemini_requests += pool.num_requests
+        gemini_stats['connections_reused'] = max(gemini_requests - gemini_stats['connections_opened'], 0)
+        
+        return {
+            'pool_size': self.pool_size,
+            'timeouts': {
+                'connect': self.connect_timeout,
+                'read': self.read_timeout,
+                'write': self.write_timeout,
+                'pool': self.pool_timeout
+            },
+            'openai': openai_stats,
+            'gemini': gemini_stats,
+            'hedging': hedging_stats
+        }
+    
+    def generate_response(self, model, context, temperature=0.1, hedge=None):
         """Generate response using selected model"""
+        return self.generate_with_model(model, context, temperature, hedge)[0]
+    
+    def generate_with_model(self, model, context, temperature=0.1, hedge=None):
+        """Return (response, model that produced it); hedging may answer with the backup"""
+        backup_model = self._backup_model(model) if self._hedging(hedge) else None
+        if backup_model:
+            return self._generate_hedged(model, backup_model, context, temperature)
+        return self._generate_single(model, context, temperature), model
+    
+    def stream_response(self, model, context, temperature=0.1, hedge=None):
+        """Generate a response as a ResponseStream of text deltas.
+
+        Raises LLMStreamError, possibly after some deltas, if the provider
+        fails.  The stream's model is the one that produced the text.
+        """
+        backup_model = self._backup_model(model) if self._hedging(hedge) else None
+        if backup_model:
+            return ResponseStream(model, lambda stream: self._stream_with_fallback(
+                stream, model, backup_model, context, temperature))
+        return ResponseStream(model, lambda stream: self._stream_single(model, context, temperature))
+    
+    def _generate_single(self, model, context, temperature):
         if model == "Gemini 2.0 Flash" and self.gemini_key:
             return self._generate_gemini(context, temperature)
         elif "GPT" in model and self.openai_key:
@@ -19,33 +211,199 @@ class SimpleLLMClient:
         else:
             return "⚠️ Please configure API keys to use AI models."
     
-    def _generate_gemini(self, context, temperature):
+    def _stream_single(self, model, context, temperature):
+        if model == "Gemini 2.0 Flash" and self.gemini_key:
+            return self._stream_gemini(context, temperature)
+        elif "GPT" in model and self.openai_key:
+            return self._stream_openai(context, model, temperature)
+        else:
+            raise LLMStreamError("⚠️ Please configure API keys to use AI models.")
+    
+    def _hedging(self, hedge):
+        return self.hedge if hedge is None else hedge
+    
+    def _provider(self, model):
+        if model == "Gemini 2.0 Flash" and self.gemini_key:
+            return 'gemini'
+        elif "GPT" in model and self.openai_key:
+            return 'openai'
+        return None
+    
+    def _backup_model(self, model):
+        """The other provider's model, if both providers are configured"""
+        provider = self._provider(model)
+        if provider is None:
+            return None
+        backup_model = BACKUP_MODELS[provider]
+        return backup_model if self._provider(backup_model) else None
+    
+    def _get_executor(self):
+        executor = self._executor
+        if executor is None:
+            with self._lock:
+                executor = self._executor
+                if executor is None:
+                    executor = ThreadPoolExecutor(
+                        max_workers=self.pool_size * 2, thread_name_prefix='llm-hedge'
+                    )
+                    self._executor = executor
+        return executor
+    
+    def _generate_hedged(self, model, backup_model, context, temperature):
+        """Race the backup provider against a slow or failing primary.
+
+        The backup request is only sent if the primary has not answered
+        within hedge_after seconds, or as soon as the primary fails.  The
+        first successful answer wins; if both fail, the primary's error
+        is returned.  Returns (answer, model that produced it).
+        """
+        executor = self._get_executor()
+        self._count('hedging', 'hedged_requests')
+        
+        primary = executor.submit(self._generate_single, model, context, temperature)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            answer = primary.result()
+            if not is_error_response(answer):
+                return answer, model
+            self._count('hedging', 'fallbacks')
+        else:
+            self._count('hedging', 'hedges_fired')
+        
+        backup = executor.submit(self._generate_single, backup_model, context, temperature)
+        pending = {primary, backup}
+        errors = {}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                answer = future.result()
+                if not is_error_response(answer):
+                    if future is backup:
+                        self._count('hedging', 'backup_wins')
+                        return answer, backup_model
+                    return answer, model
+                errors[future] = answer
+        
+        if errors.get(primary):
+            return errors[primary], model
+        return errors.get(backup), backup_model
+    
+    def _open_stream(self, model, context, temperature):
+        """Start a stream and wait for its first delta: (stream, first delta or None)"""
+        stream = self._stream_single(model, context, temperature)
+        return stream, next(stream, None)
+    
+    @staticmethod
+    def _opened(future):
+        """(stream, first delta, error) of a finished _open_stream call"""
         try:
-            headers = {
-                'Content-Type': 'application/json',
-                'X-goog-api-key': self.gemini_key
-            }
-            
-            prompt = f"""You are a GTI SOP Assistant. Answer based ONLY on the provided documentation.
+            stream, first = future.result()
+        except LLMStreamError as e:
+            return None, None, e
+        return stream, first, None
+    
+    @staticmethod
+    def _close_opened(future):
+        # A stream that lost the race is closed once it has opened
+        try:
+            stream, _ = future.result()
+        except LLMStreamError:
+            return
+        stream.close()
+    
+    def _stream_with_fallback(self, response_stream, model, backup_model, context, temperature):
+        """Stream from whichever provider produces text first.
+
+        As with _generate_hedged, the backup is only started if the primary
+        has not produced its first delta within hedge_after seconds, or as
+        soon as it fails or ends without text; the other stream is closed.
+        A failure after the first delta is raised; so is the primary's
+        error if the backup fails too.
+        """
+        executor = self._get_executor()
+        self._count('hedging', 'hedged_requests')
+        
+        primary = executor.submit(self._open_stream, model, context, temperature)
+        done, _ = wait([primary], timeout=self.hedge_after)
+        errors = {}
+        if done:
+            stream, first, errors[primary] = self._opened(primary)
+            if first is not None:
+                yield first
+                yield from stream
+                return
+            self._count('hedging', 'fallbacks')
+        else:
+            self._count('hedging', 'hedges_fired')
+        
+        backup = executor.submit(self._open_stream, backup_model, context, temperature)
+        pending = {backup} if done else {primary, backup}
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # The primary wins a tie
+            for future in sorted(done, key=lambda f: f is not primary):
+                stream, first, errors[future] = self._opened(future)
+                if first is None:
+                    continue
+                if winner is None:
+                    winner = (future, stream, first)
+                else:
+                    stream.close()
+        for future in pending:
+            future.add_done_callback(self._close_opened)
+        
+        if winner is None:
+            error = errors.get(primary) or errors.get(backup)
+            if error is not None:
+                raise error
+            return
+        
+        future, stream, first = winner
+        if future is backup:
+            self._count('hedging', 'backup_wins')
+            response_stream.model = backup_model
+        yield first
+        yield from stream
+    
+    def _gemini_request(self, context, temperature):
+        headers = {
+            'Content-Type': 'application/json',
+            'X-goog-api-key': self.gemini_key
+        }
+        
+        prompt = f"""You are a GTI SOP Assistant. Answer based ONLY on the provided documentation.
 
 CONTEXT:
 {context}
 
 Provide a clear, specific answer based only on the information above. If the information is not in the context, say so clearly."""
-            
-            data = {
-                "contents": [{"parts": [{"text": prompt}]}],
-                "generationConfig": {
-                    "temperature": temperature,
-                    "maxOutputTokens": 1000
-                }
+        
+        data = {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {
+                "temperature": temperature,
+                "maxOutputTokens": 1000
             }
+        }
+        return headers, data
+    
+    def _openai_messages(self, context):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": context}
+        ]
+    
+    def _generate_gemini(self, context, temperature):
+        try:
+            headers, data = self._gemini_request(context, temperature)
             
-            response = requests.post(
-                "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent",
+            self._count('gemini', 'requests')
+            response = self._get_gemini_session().post(
+                f"{GEMINI_URL}:generateContent",
                 headers=headers,
                 json=data,
-                timeout=30
+                timeout=self._gemini_timeout
             )
             
             if response.status_code == 200:
@@ -60,22 +418,11 @@ Provide a clear, specific answer based only on the information above. If the inf
     
     def _generate_openai(self, context, model, temperature):
         try:
-            client = OpenAI(api_key=self.openai_key)
-            
-            model_map = {
-                "GPT-4": "gpt-4",
-                "GPT-4 Mini": "gpt-4o-mini"
-            }
+            client = self._get_openai_client()
             
             response = client.chat.completions.create(
-                model=model_map.get(model, "gpt-4o-mini"),
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are a GTI SOP Assistant. Answer based ONLY on provided documentation."
-                    },
-                    {"role": "user", "content": context}
-                ],
+                model=OPENAI_MODELS.get(model, "gpt-4o-mini"),
+                messages=self._openai_messages(context),
                 max_tokens=1000,
                 temperature=temperature
             )
@@ -83,4 +430,56 @@ Provide a clear, specific answer based only on the information above. If the inf
             return response.choices[0].message.content
             
         except Exception as e:
-            return f"Error calling OpenAI: {str(e)}"
\ No newline at end of file
+            return f"Error calling OpenAI: {str(e)}"
+    
+    def _stream_gemini(self, context, temperature):
+        """Stream text deltas from Gemini's streamGenerateContent SSE mode"""
+        try:
+            headers, data = self._gemini_request(context, temperature)
+            
+            self._count('gemini', 'requests')
+            with self._get_gemini_session().post(
+                f"{GEMINI_URL}:streamGenerateContent",
+                params={'alt': 'sse'},
+                headers=headers,
+                json=data,
+                stream=True,
+                timeout=self._gemini_timeout
+            ) as response:
+                if response.status_code != 200:
+                    raise LLMStreamError(f"Error: {response.status_code} - {response.text}")
+                
+                response.encoding = 'utf-8'
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    result = json.loads(line[len('data:'):].strip())
+                    for candidate in result.get('candidates', [])[:1]:
+                        for part in candidate.get('content', {}).get('parts', []):
+                            if part.get('text'):
+                                yield part['text']
+                                
+        except LLMStreamError:
+            raise
+        except Exception as e:
+            raise LLMStreamError(f"Error calling Gemini: {str(e)}") from e
+    
+    def _stream_openai(self, context, model, temperature):
+        """Stream text deltas from the OpenAI chat completions API"""
+        try:
+            client = self._get_openai_client()
+            
+            stream = client.chat.completions.create(
+                model=OPENAI_MODELS.get(model, "gpt-4o-mini"),
+                messages=self._openai_messages(context),
+                max_tokens=1000,
+                temperature=temperature,
+                stream=True
+            )
+            
+            for event in stream:
+                if event.choices and event.choices[0].delta.content:
+                    yield event.choices[0].delta.content
+                    
+        except Exception as e:
+            raise LLMStreamError(f"Error calling OpenAI: {str(e)}") from e
\ No newline at end of file
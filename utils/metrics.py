@@ -0,0 +1,189 @@
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Quantiles reported over the rolling window
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if value != value:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative bucket counts plus the most recent samples for rolling quantiles"""
+
+    def __init__(self, buckets, max_samples):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=max_samples)
+
+    def observe(self, value, now):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append((now, value))
+
+    def window(self, since):
+        """(quantiles, sum, count) of the samples observed since a monotonic time"""
+        values = sorted(value for at, value in self.recent if at >= since)
+        if not values:
+            return [float('nan')] * len(QUANTILES), 0.0, 0
+        quantiles = [values[min(len(values) - 1, int(q * len(values)))] for q in QUANTILES]
+        return quantiles, sum(values), len(values)
+
+
+class Metrics:
+    """In-process latency histograms and counters in the Prometheus text format.
+
+    Every histogram is exported twice: as a cumulative Prometheus histogram
+    (for rate() and histogram_quantile() on the server) and as a summary of
+    quantiles over the last `window` seconds, for reading /api/metrics
+    directly.  Collectors are called at export time to add values that other
+    components already count, such as cache hits.
+    """
+
+    def __init__(self, prefix='sop', window=300.0, max_samples=2048, buckets=LATENCY_BUCKETS):
+        self.prefix = prefix
+        self.window = window
+        self.max_samples = max_samples
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def observe(self, name, seconds, **labels):
+        """Record one duration in the histogram name"""
+        key = (name, tuple(sorted(labels.items())))
+        now = time.monotonic()
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets, self.max_samples)
+            histogram.observe(seconds, now)
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_collector(self, collector):
+        """Register collector() -> iterable of (name, type, labels dict, value)"""
+        self._collectors.append(collector)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        since = time.monotonic() - self.window
+        families = {}
+
+        def sample(name, kind, suffix, labels, value):
+            families.setdefault(name, (kind, []))[1].append((suffix, labels, value))
+
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    sample(name, 'histogram', '_bucket', labels + (('le', format_value(bound)),), cumulative)
+                sample(name, 'histogram', '_sum', labels, histogram.sum)
+                sample(name, 'histogram', '_count', labels, histogram.count)
+
+                quantiles, total, count = histogram.window(since)
+                recent = f"{name.rsplit('_seconds', 1)[0]}_recent_seconds"
+                for q, value in zip(QUANTILES, quantiles):
+                    sample(recent, 'summary', '', labels + (('quantile', str(q)),), value)
+                sample(recent, 'summary', '_sum', labels, total)
+                sample(recent, 'summary', '_count', labels, count)
+            for (name, labels), value in sorted(self._counters.items()):
+                sample(name, 'counter', '', labels, value)
+
+        for collector in self._collectors:
+            try:
+                for name, kind, labels, value in collector():
+                    sample(name, kind, '', tuple(sorted(labels.items())), value)
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+
+        lines = []
+        for name, (kind, samples) in families.items():
+            full_name = f"{self.prefix}_{name}"
+            help_text = self._help.get(name)
+            if help_text is None and name.endswith('_recent_seconds'):
+                help_text = f"Quantiles over the last {self.window:g} seconds"
+            if help_text:
+                lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{full_name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """Stage durations of one request, for its Server-Timing header and the metrics.
+
+    Stages may run after the response headers were sent (a streamed answer);
+    they are still recorded in the metrics.
+    """
+
+    def __init__(self, metrics, endpoint):
+        self.metrics = metrics
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """Add a stage timed elsewhere"""
+        self.stages.append((name, seconds))
+        self.metrics.observe('stage_duration_seconds', seconds, endpoint=self.endpoint, stage=name)
+
+    def finish(self, status):
+        """Record the request and return its Server-Timing header value"""
+        seconds = time.perf_counter() - self.start
+        self.metrics.observe('request_duration_seconds', seconds, endpoint=self.endpoint)
+        self.metrics.increment('requests_total', endpoint=self.endpoint, status=status)
+        timings = [f"{name};dur={stage_seconds * 1000:.2f}" for name, stage_seconds in self.stages]
+        timings.append(f"total;dur={seconds * 1000:.2f}")
+        return ', '.join(timings)
+
+
+def cache_samples(cache, hits, misses):
+    """Hit, miss and hit ratio samples for one cache"""
+    lookups = hits + misses
+    return [
+        ('cache_hits_total', 'counter', {'cache': cache}, hits),
+        ('cache_misses_total', 'counter', {'cache': cache}, misses),
+        ('cache_hit_ratio', 'gauge', {'cache': cache}, hits / lookups if lookups else 0.0)
+    ]
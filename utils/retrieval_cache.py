@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+from utils.search_engine import tokenize, is_analytical_query
+from utils.detector import detect_query_intent
+
+
+def normalize_query(query, ordered=False):
+    """Everything about a query that retrieval depends on, as a hashable tuple.
+
+    Keyword search scores the set of query terms, so casing, punctuation,
+    repeated words and word order do not change its results: "NJ batch
+    sub?" and "batch sub nj" normalize alike.  Vector search embeds word
+    pairs, so with ordered=True the terms keep their order.  The detected
+    state, section, topics and image interest and the analytical flag are
+    read from the raw text ("new york" is a state, "york new" is not), so
+    they are part of the key too.
+    """
+    terms = tokenize(query)
+    intent = detect_query_intent(query.lower())
+    return (tuple(terms) if ordered else tuple(sorted(set(terms))),
+            intent['state'], intent['section'], tuple(intent['topics']), intent['wants_images'],
+            is_analytical_query(query))
+
+
+def normalize_filters(filters):
+    """Parsed facet filters as a hashable tuple, independent of value order"""
+    return tuple(sorted((field, values if isinstance(values, bool) else tuple(sorted(values)))
+                        for field, values in (filters or {}).items()))
+
+
+class RetrievalCache:
+    """LRU of search results keyed by corpus, retrieval settings and normalized query.
+
+    Keys start with the corpus id, a content hash, so a changed corpus
+    never sees results computed against an earlier version; those entries
+    simply age out.  Cached result lists are copied on the way out, so
+    callers may modify what they get.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def make_key(corpus_id, query, search_mode='keyword', top_k=5, filters=None):
+        return (corpus_id, search_mode, top_k, normalize_filters(filters),
+                normalize_query(query, ordered=search_mode != 'keyword'))
+
+    def get(self, key):
+        """Return a copy of the cached results, or None on a miss"""
+        with self._lock:
+            results = self._entries.get(key)
+            if results is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return list(results)
+
+    def put(self, key, results):
+        with self._lock:
+            self._entries[key] = list(results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -1,110 +1,317 @@
 import re
+import math
+import heapq
+from collections import Counter
 
-def enhanced_search(chunks, query, top_k=5):
-    """Enhanced search with context and metadata awareness"""
+from utils.detector import detect_query_intent
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+ANALYTICAL_KEYWORDS = [
+    'how many', 'what states', 'which state', 'highest', 'lowest', 'compare',
+    'all states', 'total', 'maximum', 'minimum', 'list all', 'differences',
+    'across states', 'between states', 'summary', 'overview'
+]
+
+def tokenize(text):
+    """Lowercase word tokens used for both indexing and querying"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def is_analytical_query(query):
+    """Detect comparison/analytical questions that need broader context"""
     query_lower = query.lower()
-    query_words = set(query_lower.split())
-    
-    # Detect if this is a comparison/analytical question
-    analytical_keywords = [
-        'how many', 'what states', 'which state', 'highest', 'lowest', 'compare', 
-        'all states', 'total', 'maximum', 'minimum', 'list all', 'differences',
-        'across states', 'between states', 'summary', 'overview'
-    ]
-    
-    is_analytical = any(keyword in query_lower for keyword in analytical_keywords)
-    
-    if is_analytical:
-        # For analytical questions, we need broader context
-        top_k = min(15, len(chunks))  # Get more chunks for analysis
-    
-    # Extract query intent
-    query_state = None
-    query_section = None
-    query_topics = []
-    
-    # State detection
-    state_patterns = {
-        'OH': [r'\boh\b', r'\bohio\b'],
-        'MD': [r'\bmd\b', r'\bmaryland\b'],
-        'NJ': [r'\bnj\b', r'\bnew jersey\b', r'\bjersey\b'],
-        'IL': [r'\bil\b', r'\billinois\b'],
-        'NY': [r'\bny\b', r'\bnew york\b'],
-        'NV': [r'\bnv\b', r'\bnevada\b'],
-        'MA': [r'\bma\b', r'\bmassachusetts\b']
-    }
-    
-    for state, patterns in state_patterns.items():
-        for pattern in patterns:
-            if re.search(pattern, query_lower):
-                query_state = state
-                break
-    
-    # Section detection
-    if 'rise' in query_lower or 'internal' in query_lower:
-        query_section = 'RISE'
-    elif 'regular' in query_lower or 'wholesale' in query_lower:
-        query_section = 'REGULAR'
-    
-    # Topic detection
-    topic_keywords = {
-        'PRICING': ['price', 'pricing', 'cost', 'discount', 'menu'],
-        'BATTERIES': ['battery', 'batteries', 'separate', 'invoice'],
-        'BATCH_SUB': ['batch', 'sub', 'substitution', 'split'],
-        'DELIVERY_DATE': ['delivery', 'date', 'schedule'],
-        'ORDER_LIMIT': ['limit', 'maximum', 'max', 'unit'],
-        'LESS_AVAILABLE': ['less', 'available', 'partial', 'shortage']
-    }
-    
-    for topic, keywords in topic_keywords.items():
-        if any(keyword in query_lower for keyword in keywords):
-            query_topics.append(topic)
-    
-    # Score chunks
-    scored_chunks = []
-    for chunk in chunks:
-        score = 0
-        text_lower = chunk['text'].lower()
-        text_words = set(text_lower.split())
+    return any(keyword in query_lower for keyword in ANALYTICAL_KEYWORDS)
+
+class SearchIndex:
+    """Inverted index over a chunk list, built once per corpus.
+
+    Holds postings (term -> [(doc, tf)]), document lengths and metadata
+    postings so a query only touches the documents its terms and detected
+    intent point at.  Documents are numbered in the order they are added;
+    removed documents leave an empty (None) slot in chunks.  Until a change
+    set is applied, document numbers are positions in the chunk list.
+    """
+
+    def __init__(self, chunks=None):
+        self.chunks = []
+        self.postings = {}
+        self.doc_lengths = []
+        self.total_length = 0
+        self.metadata_postings = {}
+        self.image_docs = set()
+        self.long_docs = set()
+        self.doc_ids = {}  # chunk_id -> doc
+        self.live_docs = 0
+        self.in_chunk_order = True
+
+        for chunk in chunks or []:
+            self.add(chunk)
+
+    def __len__(self):
+        return self.live_docs
+
+    @property
+    def avg_doc_length(self):
+        return self.total_length / max(self.live_docs, 1)
+
+    def add(self, chunk):
+        """Index one more chunk and return its document number"""
+        doc = len(self.chunks)
+        self.chunks.append(chunk)
+        self.doc_ids[chunk.get('chunk_id')] = doc
+        self.live_docs += 1
+
+        tokens = tokenize(chunk['text'])
+        term_counts = {}
+        for token in tokens:
+            term_counts[token] = term_counts.get(token, 0) + 1
+        for term, tf in term_counts.items():
+            self.postings.setdefault(term, []).append((doc, tf))
+
+        self.doc_lengths.append(len(tokens))
+        self.total_length += len(tokens)
+
         metadata = chunk.get('metadata', {})
-        
-        # Base keyword overlap score
-        overlap = len(query_words.intersection(text_words))
-        score += overlap / max(len(query_words), 1)
-        
-        # Boost for exact phrase matches
-        for word in query_words:
-            if len(word) > 3 and word in text_lower:
-                score += 0.3
-        
-        # Boost for metadata matches
-        if query_state and query_state in metadata.get('states', []):
-            score += 0.5
-        
-        if query_section and query_section in metadata.get('sections', []):
-            score += 0.3
-        
-        for topic in query_topics:
-            if topic in metadata.get('topics', []):
-                score += 0.4
-        
-        # Boost for images if visual content is requested
-        if any(word in query_lower for word in ['image', 'show', 'example', 'visual']):
-            if metadata.get('has_images'):
-                score += 0.3
-        
-        # Boost for longer, more complete content
+        for field in ('states', 'sections', 'topics'):
+            for value in metadata.get(field, []):
+                self.metadata_postings.setdefault((field, value), set()).add(doc)
+        if metadata.get('has_images'):
+            self.image_docs.add(doc)
         if len(chunk['text']) > 200:
-            score += 0.1
-        
-        if score > 0:
-            scored_chunks.append({
-                'chunk': chunk,
-                'score': score,
-                'chunk_id': chunk['chunk_id'],
-                'search_types': []
-            })
-    
-    # Sort by score and return top results
-    scored_chunks.sort(key=lambda x: x['score'], reverse=True)
-    return scored_chunks[:top_k]
\ No newline at end of file
+            self.long_docs.add(doc)
+
+        return doc
+
+    def remove(self, doc):
+        """Drop a document; its number is not reused"""
+        chunk = self.chunks[doc]
+        if chunk is None:
+            return
+
+        for term in set(tokenize(chunk['text'])):
+            postings = [posting for posting in self.postings.get(term, ()) if posting[0] != doc]
+            if postings:
+                self.postings[term] = postings
+            else:
+                self.postings.pop(term, None)
+
+        self.total_length -= self.doc_lengths[doc]
+        self.doc_lengths[doc] = 0
+
+        metadata = chunk.get('metadata', {})
+        for field in ('states', 'sections', 'topics'):
+            for value in metadata.get(field, []):
+                self.metadata_postings.get((field, value), set()).discard(doc)
+        self.image_docs.discard(doc)
+        self.long_docs.discard(doc)
+
+        if self.doc_ids.get(chunk.get('chunk_id')) == doc:
+            del self.doc_ids[chunk.get('chunk_id')]
+        self.chunks[doc] = None
+        self.live_docs -= 1
+
+    def copy(self):
+        """Independent copy that can be changed without affecting this index"""
+        index = SearchIndex()
+        index.chunks = list(self.chunks)
+        index.postings = {term: list(postings) for term, postings in self.postings.items()}
+        index.doc_lengths = list(self.doc_lengths)
+        index.total_length = self.total_length
+        index.metadata_postings = {key: set(docs) for key, docs in self.metadata_postings.items()}
+        index.image_docs = set(self.image_docs)
+        index.long_docs = set(self.long_docs)
+        index.doc_ids = dict(self.doc_ids)
+        index.live_docs = self.live_docs
+        index.in_chunk_order = self.in_chunk_order
+        return index
+
+    def apply_changes(self, chunks, changes):
+        """Update the index in place for a new revision of the corpus.
+
+        chunks is the new chunk list and changes the change set from
+        diff_chunks: removed and modified chunks are dropped, modified and
+        added ones are indexed again, and every other document is pointed
+        at its chunk in the new list.
+        """
+        by_id = {chunk['chunk_id']: chunk for chunk in chunks}
+        self.in_chunk_order = False
+        for chunk_id in changes['removed'] + changes['modified']:
+            doc = self.doc_ids.get(chunk_id)
+            if doc is not None:
+                self.remove(doc)
+        for chunk_id in changes['modified'] + changes['added']:
+            self.add(by_id[chunk_id])
+
+        # Unchanged chunks can still carry new image positions
+        for chunk_id, doc in self.doc_ids.items():
+            if chunk_id in by_id:
+                self.chunks[doc] = by_id[chunk_id]
+
+    def docs_at(self, chunks, positions):
+        """Document numbers of the chunks at these positions of chunks"""
+        if self.in_chunk_order:
+            return set(positions)
+        docs = set()
+        for position in positions:
+            doc = self.doc_ids.get(chunks[position]['chunk_id'])
+            if doc is not None:
+                docs.add(doc)
+        return docs
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        n = self.live_docs
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def bm25_scores(self, terms, candidates=None):
+        """Normalized BM25 score per document for a set of query terms.
+
+        Scores are divided by the summed idf of the query terms that occur
+        in the corpus, which keeps them in the 0..(k1 + 1) range so the
+        additive metadata boosts keep the same weight they had against the
+        old overlap score.  With candidates, only those documents are scored.
+        """
+        return self.bm25_scores_many([terms], candidates)[0]
+
+    def bm25_scores_many(self, term_sets, candidates=None):
+        """bm25_scores for several queries in one pass over their postings.
+
+        The postings of a term are walked, and its per-document weights
+        computed, once for the whole batch however many queries use it.
+        Each query then sums the weights of its terms in the same order as
+        bm25_scores would, so the scores are identical.
+        """
+        avgdl = self.avg_doc_length or 1.0
+        # Only terms shared by several queries are worth keeping weights for
+        uses = Counter(term for terms in term_sets for term in terms) if len(term_sets) > 1 else {}
+        term_weights = {}
+        results = []
+        for terms in term_sets:
+            scores = {}
+            norm = 0.0
+            for term in terms:
+                # A term no chunk contains scores nothing, so its idf (the
+                # largest possible) must not dilute the other terms' scores
+                if term not in self.postings:
+                    continue
+                shared = term_weights.get(term)
+                if shared is None and uses.get(term, 0) > 1:
+                    shared = term_weights[term] = self._term_weights(term, avgdl, candidates)
+                if shared is not None:
+                    idf, weights = shared
+                    norm += idf
+                    for doc, weight in weights:
+                        scores[doc] = scores.get(doc, 0.0) + weight
+                    continue
+
+                idf = self.idf(term)
+                norm += idf
+                for doc, tf in self.postings.get(term, ()):
+                    if candidates is not None and doc not in candidates:
+                        continue
+                    length_norm = 1 - BM25_B + BM25_B * self.doc_lengths[doc] / avgdl
+                    weight = idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+                    scores[doc] = scores.get(doc, 0.0) + weight
+
+            if norm > 0:
+                for doc in scores:
+                    scores[doc] /= norm
+            results.append(scores)
+        return results
+
+    def _term_weights(self, term, avgdl, candidates):
+        """(idf, [(doc, weight)]) of one query term"""
+        idf = self.idf(term)
+        weights = []
+        for doc, tf in self.postings.get(term, ()):
+            if candidates is not None and doc not in candidates:
+                continue
+            length_norm = 1 - BM25_B + BM25_B * self.doc_lengths[doc] / avgdl
+            weights.append((doc, idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)))
+        return idf, weights
+
+    def docs_with(self, field, value):
+        return self.metadata_postings.get((field, value), set())
+
+def build_index(chunks):
+    """Build a SearchIndex for a chunk list"""
+    return SearchIndex(chunks)
+
+def enhanced_search(chunks, query, top_k=5, index=None, candidates=None):
+    """Enhanced search with context and metadata awareness.
+
+    candidates optionally restricts results to these positions in chunks
+    (e.g. a facet filter); only those chunks are scored.
+    """
+    return enhanced_search_many(chunks, [query], top_k, index, candidates)[0]
+
+def enhanced_search_many(chunks, queries, top_k=5, index=None, candidates=None):
+    """enhanced_search for a list of queries, sharing one pass over the index.
+
+    Returns one result list per query, in order.
+    """
+    if index is None:
+        index = build_index(chunks)
+    if candidates is not None:
+        candidates = index.docs_at(chunks, candidates)
+
+    # Text relevance only touches the postings of the query terms.  Terms
+    # are summed in sorted order, so word order cannot change a score
+    queries_lower = [query.lower() for query in queries]
+    all_scores = index.bm25_scores_many([sorted(set(tokenize(query_lower))) for query_lower in queries_lower],
+                                        candidates)
+    return [rank_results(index, query, query_lower, scores, top_k, candidates)
+            for query, query_lower, scores in zip(queries, queries_lower, all_scores)]
+
+def rank_results(index, query, query_lower, scores, top_k, candidates):
+    """Add metadata boosts to one query's BM25 scores and return its top results"""
+    # Detect if this is a comparison/analytical question
+    if is_analytical_query(query):
+        # For analytical questions, we need broader context
+        top_k = min(15, len(index))  # Get more chunks for analysis
+
+    # State, section, topics and image interest, in one pass over the query
+    intent = detect_query_intent(query_lower)
+    query_state = intent['state']
+    query_section = intent['section']
+    query_topics = intent['topics']
+    wants_images = intent['wants_images']
+
+    # Additive metadata boosts, applied through the metadata postings
+    boosts = []
+    if query_state:
+        boosts.append((index.docs_with('states', query_state), 0.5))
+    if query_section:
+        boosts.append((index.docs_with('sections', query_section), 0.3))
+    for topic in query_topics:
+        boosts.append((index.docs_with('topics', topic), 0.4))
+
+    # Boost for images if visual content is requested
+    if wants_images:
+        boosts.append((index.image_docs, 0.3))
+
+    for docs, boost in boosts:
+        if candidates is not None:
+            docs = docs & candidates
+        for doc in docs:
+            scores[doc] = scores.get(doc, 0.0) + boost
+
+    # Boost for longer, more complete content among the candidates
+    for doc in scores:
+        if doc in index.long_docs:
+            scores[doc] += 0.1
+
+    # Heap-based top-k over the candidates, ties keep document order
+    top = heapq.nlargest(top_k, ((doc, score) for doc, score in scores.items() if score > 0),
+                         key=lambda item: (item[1], -item[0]))
+
+    return [{
+        'chunk': index.chunks[doc],
+        'score': score,
+        'chunk_id': index.chunks[doc]['chunk_id'],
+        'search_types': []
+    } for doc, score in top]
@@ -0,0 +1,193 @@
+import re
+import threading
+from array import array
+from collections import OrderedDict
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# Query words at least this long tolerate one typo, and two from LONG_WORD
+FUZZY_MIN_LENGTH = 4
+FUZZY_LONG_WORD = 8
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def bounded_edit_distance(a, b, limit):
+    """Levenshtein distance of a and b, or limit + 1 once it is known to exceed limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def allowed_edits(word):
+    if len(word) < FUZZY_MIN_LENGTH:
+        return 0
+    return 1 if len(word) < FUZZY_LONG_WORD else 2
+
+
+class TrigramIndex:
+    """Substring and typo-tolerant lookup of chunks, built once per corpus.
+
+    Every distinct lowercase word maps to the chunks containing it, and the
+    vocabulary is indexed by padded character trigrams.  A substring query
+    is split into its words; each word only has to be looked up among
+    vocabulary words (a word in the middle of the query must match whole,
+    the first may be a word suffix and the last a word prefix), so only the
+    chunks holding all of them are checked against the full query.  Fuzzy
+    queries match each word against vocabulary words within one or two
+    edits, found through shared trigrams.  Results are cached per query, so
+    paging and totals never rescan the corpus.
+    """
+
+    def __init__(self, chunks, cache_size=64):
+        self.chunks = chunks
+        # Lowercased texts, so candidates are verified without lowering again
+        self.texts = [chunk['text'].lower() for chunk in chunks]
+        self.words = []
+        self.word_ids = {}
+        self.word_docs = []
+        self.word_trigrams = {}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        for doc, text in enumerate(self.texts):
+            for word in set(WORD_PATTERN.findall(text)):
+                word_id = self.word_ids.get(word)
+                if word_id is None:
+                    word_id = self.word_ids[word] = len(self.words)
+                    self.words.append(word)
+                    self.word_docs.append(array('I'))
+                self.word_docs[word_id].append(doc)
+
+        for word_id, word in enumerate(self.words):
+            for trigram in trigrams(f"^{word}$"):
+                self.word_trigrams.setdefault(trigram, array('I')).append(word_id)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query, fuzzy=False):
+        """Sorted chunk positions matching query.
+
+        Exact search has the semantics of a case-insensitive substring test;
+        fuzzy search matches chunks that contain every query word, or a word
+        within the allowed edits of it, anywhere.
+        """
+        key = (query.lower(), fuzzy)
+        with self._lock:
+            docs = self._cache.get(key)
+            if docs is not None:
+                self._cache.move_to_end(key)
+                return docs
+
+        docs = self._fuzzy(key[0]) if fuzzy else self._substring(key[0])
+        with self._lock:
+            self._cache[key] = docs
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return docs
+
+    def _substring(self, query):
+        tokens = list(WORD_PATTERN.finditer(query))
+        if not tokens:
+            # Nothing to look up (punctuation only); check every chunk
+            return [doc for doc, text in enumerate(self.texts) if query in text]
+
+        candidates = None
+        for match in tokens:
+            left_open = match.start() == 0
+            right_open = match.end() == len(query)
+            word_ids = self._matching_words(match.group(), left_open, right_open)
+            candidates = self._docs_of(word_ids, candidates)
+            if not candidates:
+                return []
+
+        if len(tokens) == 1 and tokens[0].group() == query:
+            # A single word query matches exactly the chunks of its words
+            return sorted(candidates)
+        return sorted(doc for doc in candidates if query in self.texts[doc])
+
+    def _fuzzy(self, query):
+        candidates = None
+        for word in set(WORD_PATTERN.findall(query)):
+            word_ids = set(self._matching_words(word, True, True))
+            edits = allowed_edits(word)
+            if edits:
+                word_ids.update(self._similar_words(word, edits))
+            candidates = self._docs_of(word_ids, candidates)
+            if not candidates:
+                return []
+        return sorted(candidates or ())
+
+    def _matching_words(self, token, left_open, right_open):
+        """Vocabulary words a query token can be part of at its position"""
+        if not left_open and not right_open:
+            word_id = self.word_ids.get(token)
+            return [] if word_id is None else [word_id]
+
+        if len(token) >= 3:
+            candidates = self._words_with(trigrams(token))
+        else:
+            candidates = range(len(self.words))
+
+        if left_open and right_open:
+            test = lambda word: token in word
+        elif left_open:
+            test = lambda word: word.endswith(token)
+        else:
+            test = lambda word: word.startswith(token)
+        return [word_id for word_id in candidates if test(self.words[word_id])]
+
+    def _similar_words(self, word, edits):
+        """Vocabulary words within edits of word, filtered by shared trigrams.
+
+        An edit changes at most three of the padded trigrams, so a match
+        shares at least len(word) - 3 * edits of them.
+        """
+        counts = {}
+        for trigram in trigrams(f"^{word}$"):
+            for word_id in self.word_trigrams.get(trigram, ()):
+                counts[word_id] = counts.get(word_id, 0) + 1
+        if len(word) - 3 * edits > 0:
+            candidates = [word_id for word_id, count in counts.items() if count >= len(word) - 3 * edits]
+        else:
+            candidates = range(len(self.words))
+        return [word_id for word_id in candidates
+                if bounded_edit_distance(word, self.words[word_id], edits) <= edits]
+
+    def _words_with(self, query_trigrams):
+        """Word ids holding all of the given trigrams, rarest list first"""
+        lists = sorted((self.word_trigrams.get(trigram, ()) for trigram in query_trigrams), key=len)
+        if not lists:
+            return range(len(self.words))
+        word_ids = set(lists[0])
+        for word_list in lists[1:]:
+            word_ids.intersection_update(word_list)
+            if not word_ids:
+                break
+        return word_ids
+
+    def _docs_of(self, word_ids, candidates=None):
+        docs = set()
+        for word_id in word_ids:
+            docs.update(self.word_docs[word_id])
+        if candidates is not None:
+            docs &= candidates
+        return docs
+
+
+def build_trigram_index(chunks):
+    """Build a TrigramIndex for a chunk list"""
+    return TrigramIndex(chunks)
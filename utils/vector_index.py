@@ -0,0 +1,224 @@
+import re
+import zlib
+import numpy as np
+
+from utils.search_engine import enhanced_search_many, is_analytical_query
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# Hashed feature space and the truncated SVD size it is projected onto
+HASH_DIM = 2048
+SVD_DIM = 128
+
+# Share of rows that may be folded into an existing basis before a corpus
+# revision rebuilds the index instead
+FOLD_IN_LIMIT = 0.25
+
+def _hashed_features(text):
+    """Bucket counts for word unigrams, word bigrams and char trigrams"""
+    words = WORD_PATTERN.findall(text.lower())
+    features = list(words)
+    features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+    for word in words:
+        padded = f"#{word}#"
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    counts = {}
+    for feature in features:
+        # crc32 is stable across processes, unlike hash()
+        h = zlib.crc32(feature.encode('utf-8'))
+        bucket = h % HASH_DIM
+        sign = 1.0 if (h >> 31) & 1 else -1.0
+        counts[bucket] = counts.get(bucket, 0.0) + sign
+    return counts
+
+def _tf_matrix(texts):
+    matrix = np.zeros((len(texts), HASH_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for bucket, count in _hashed_features(text).items():
+            if count:
+                # Sublinear tf, keeping the hashing sign
+                matrix[row, bucket] = np.sign(count) * (1.0 + np.log(abs(count)))
+    return matrix
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class VectorIndex:
+    """Offline dense retrieval: hashed n-gram TF-IDF reduced by truncated SVD.
+
+    Chunk embeddings are computed once and kept as one contiguous float32
+    matrix (one L2-normalized row per chunk), so a query is a single
+    matrix-vector product followed by argpartition.
+    """
+
+    def __init__(self, idf, components, matrix):
+        self.idf = np.ascontiguousarray(idf, dtype=np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @classmethod
+    def build(cls, chunks, svd_dim=SVD_DIM):
+        """Embed every chunk of a corpus"""
+        tf = _tf_matrix([chunk['text'] for chunk in chunks])
+        n = max(len(chunks), 1)
+        df = np.count_nonzero(tf, axis=0)
+        idf = (np.log((1 + n) / (1 + df)) + 1.0).astype(np.float32)
+        weighted = _normalize_rows(tf * idf)
+
+        # Truncated SVD of the TF-IDF matrix; components map features to topics
+        rank = min(svd_dim, *weighted.shape)
+        if rank > 0:
+            _, _, vt = np.linalg.svd(weighted, full_matrices=False)
+            components = vt[:rank].T
+        else:
+            components = np.zeros((HASH_DIM, 0), dtype=np.float32)
+
+        matrix = _normalize_rows(weighted @ components)
+        return cls(idf, components, matrix)
+
+    def embed(self, text):
+        """Embed a query into the same space as the chunks"""
+        return self.embed_many([text])[0]
+
+    def embed_many(self, texts):
+        """Embed texts with the existing idf and SVD basis, one row each"""
+        vectors = _normalize_rows(_tf_matrix(texts) * self.idf) @ self.components
+        return _normalize_rows(vectors)
+
+    def apply_changes(self, old_chunks, chunks, changes, max_fold_in=FOLD_IN_LIMIT):
+        """Index for a new revision of the corpus, aligned with chunks.
+
+        Rows of unchanged chunks are copied and added or modified chunks are
+        folded into the existing basis.  When more than max_fold_in of the
+        rows would be folded in, the basis is rebuilt from scratch instead.
+        """
+        old_rows = {chunk['chunk_id']: row for row, chunk in enumerate(old_chunks)}
+        changed = set(changes['added']) | set(changes['modified'])
+        fold_in = [row for row, chunk in enumerate(chunks)
+                   if chunk['chunk_id'] in changed or chunk['chunk_id'] not in old_rows]
+        if len(fold_in) > max_fold_in * max(len(chunks), 1):
+            return VectorIndex.build(chunks)
+
+        matrix = np.empty((len(chunks), self.matrix.shape[1]), dtype=np.float32)
+        for row, chunk in enumerate(chunks):
+            if chunk['chunk_id'] in old_rows:
+                matrix[row] = self.matrix[old_rows[chunk['chunk_id']]]
+        if fold_in:
+            matrix[fold_in] = self.embed_many([chunks[row]['text'] for row in fold_in])
+        return VectorIndex(self.idf, self.components, matrix)
+
+    def search(self, query, top_k=5, candidates=None):
+        """Return [(doc, cosine)] for the top_k chunks, best first.
+
+        candidates optionally restricts the search to these rows.
+        """
+        return self.search_many([query], top_k, candidates)[0]
+
+    def search_many(self, queries, top_k=5, candidates=None):
+        """search for a list of queries with one matrix-matrix product"""
+        rows = None
+        if candidates is not None:
+            rows = np.fromiter(sorted(candidates), dtype=np.int64, count=len(candidates))
+        n = len(self) if rows is None else len(rows)
+        if n == 0 or top_k <= 0 or not queries:
+            return [[] for _ in queries]
+
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        all_scores = matrix @ self.embed_many(queries).T
+        k = min(top_k, n)
+        results = []
+        for column in range(all_scores.shape[1]):
+            scores = all_scores[:, column]
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            if rows is None:
+                results.append([(int(doc), float(scores[doc])) for doc in top])
+            else:
+                results.append([(int(rows[i]), float(scores[i])) for i in top])
+        return results
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, idf=self.idf, components=self.components, matrix=self.matrix)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['idf'], data['components'], data['matrix'])
+
+def build_vector_index(chunks):
+    """Build a VectorIndex for a chunk list"""
+    return VectorIndex.build(chunks)
+
+def vector_search(chunks, query, top_k=5, vector_index=None, candidates=None):
+    """Dense retrieval with the same result format as enhanced_search"""
+    return vector_search_many(chunks, [query], top_k, vector_index, candidates)[0]
+
+def vector_search_many(chunks, queries, top_k=5, vector_index=None, candidates=None):
+    """vector_search for a list of queries, one result list per query"""
+    if vector_index is None:
+        vector_index = build_vector_index(chunks)
+
+    return [[{
+        'chunk': chunks[doc],
+        'score': score,
+        'chunk_id': chunks[doc]['chunk_id'],
+        'search_types': ['vector']
+    } for doc, score in matches if score > 0]
+        for matches in vector_index.search_many(queries, top_k, candidates)]
+
+def hybrid_search(chunks, query, top_k=5, index=None, vector_index=None, vector_weight=1.0,
+                  candidates=None):
+    """Keyword search plus vector similarity, fused by adding the scores"""
+    return hybrid_search_many(chunks, [query], top_k, index, vector_index, vector_weight, candidates)[0]
+
+def hybrid_search_many(chunks, queries, top_k=5, index=None, vector_index=None, vector_weight=1.0,
+                       candidates=None):
+    """hybrid_search for a list of queries, retrieving for all of them at once"""
+    if vector_index is None:
+        vector_index = build_vector_index(chunks)
+
+    # Both retrievers fetch top_k * 3 for the fusion; analytical questions get
+    # the same wider result set as enhanced_search (which widens its own)
+    keyword_results = enhanced_search_many(chunks, queries, top_k=top_k * 3, index=index, candidates=candidates)
+    query_top_k = [min(15, len(chunks)) if is_analytical_query(query) else top_k for query in queries]
+    vector_results = [None] * len(queries)
+    for k in set(query_top_k):
+        positions = [i for i, query_k in enumerate(query_top_k) if query_k == k]
+        matches = vector_index.search_many([queries[i] for i in positions], k * 3, candidates)
+        for i, match in zip(positions, matches):
+            vector_results[i] = match
+    return [fuse_results(chunks, keyword, vector, k, vector_weight)
+            for keyword, vector, k in zip(keyword_results, vector_results, query_top_k)]
+
+def fuse_results(chunks, keyword_results, vector_results, top_k, vector_weight=1.0):
+    """Add vector similarities to keyword results and keep the top_k"""
+    fused = {}
+    for result in keyword_results:
+        fused[result['chunk_id']] = {
+            'chunk': result['chunk'],
+            'score': result['score'],
+            'chunk_id': result['chunk_id'],
+            'search_types': ['keyword']
+        }
+    for doc, similarity in vector_results:
+        if similarity <= 0:
+            continue
+        chunk = chunks[doc]
+        entry = fused.setdefault(chunk['chunk_id'], {
+            'chunk': chunk,
+            'score': 0.0,
+            'chunk_id': chunk['chunk_id'],
+            'search_types': []
+        })
+        entry['score'] += vector_weight * similarity
+        entry['search_types'].append('vector')
+
+    results = sorted(fused.values(), key=lambda x: x['score'], reverse=True)
+    return results[:top_k]